@@ -96,7 +96,7 @@ def get_connection_to_turn_defs(net_file):
 
 
 
-get_connection_to_turn_defs('2LaneGrid.net.xml')
+# get_connection_to_turn_defs('2LaneGrid.net.xml')
 
 
 
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division
+import sys
+import glob
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+from tripinfo import load_tripinfo_columns, RunningStatistics, TRIPINFO_ATTRIBUTES
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def summarise_tripinfo(filepath, validate="mtime"):
+    """Returns the RunningStatistics of the tripinfo attributes of one output, from its columns. These are read
+    through the column cache of load_tripinfo_columns, so an output is only parsed again when it changes"""
+    columns = load_tripinfo_columns(filepath, validate=validate, memoise=False)
+    statistics = dict((attribute, RunningStatistics()) for attribute in TRIPINFO_ATTRIBUTES)
+    for attribute in TRIPINFO_ATTRIBUTES:
+        if attribute in columns:
+            values = columns[attribute]
+            for value in values[~np.isnan(values)] if values.dtype.kind == "f" else values:
+                statistics[attribute].add(float(value))
+    return statistics
+
+
+def _summarise_tripinfo_args(args):
+    return summarise_tripinfo(*args)
+
+
+def _summary_row(name, statistics, step_size):
+    """One row of the results table. Wait steps are converted to seconds"""
+    waitSteps = statistics["waitSteps"]
+    row = {"run": name,
+           "trips": statistics["duration"].get_count(),
+           "meanWaitTime": waitSteps.get_mean() * step_size,
+           "meanDuration": statistics["duration"].get_mean(),
+           "meanDepartDelay": statistics["departDelay"].get_mean()}
+    for q in QUANTILES:
+        row["waitTimeP%g" % (100 * q)] = waitSteps.get_quantile(q) * step_size
+        row["departDelayP%g" % (100 * q)] = statistics["departDelay"].get_quantile(q)
+    return row
+
+
+def analyse_runs(filepaths, step_size=0.1, processes=None, validate="mtime"):
+    """Reduces every tripinfo output in a process pool, one file per task, and returns a table with a row per run
+    and a final 'ALL' row from the merged statistics of all runs. Outputs whose cached statistics are current are
+    not read again, so only new or changed runs cost a parse"""
+    filepaths = sorted(filepaths)
+    pool = Pool(processes)
+    try:
+        statistics_by_run = pool.map(_summarise_tripinfo_args, [(filepath, validate) for filepath in filepaths])
+    finally:
+        pool.close()
+        pool.join()
+
+    merged = dict((attribute, RunningStatistics()) for attribute in TRIPINFO_ATTRIBUTES)
+    rows = []
+    for filepath, statistics in zip(filepaths, statistics_by_run):
+        rows.append(_summary_row(filepath, statistics, step_size))
+        for attribute in TRIPINFO_ATTRIBUTES:
+            merged[attribute].merge(statistics[attribute])
+    rows.append(_summary_row("ALL", merged, step_size))
+
+    return pd.DataFrame(rows).set_index("run")
+
+
+if __name__ == "__main__":
+
+    pattern = sys.argv[1] if len(sys.argv) > 1 else "tripsoutput*.xml"
+    step_size = 0.1
+
+    table = analyse_runs(glob.glob(pattern), step_size)
+    print(table.to_string())
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+Accuracy against speed of coarser simulation steps and controller decision intervals.
+
+    python cadence_benchmark.py [scenarios/grid.json] [-set backend=surrogate] [-set max_time=3600]
+
+Runs the scenario once per (step length, decision interval) in CADENCES with the same seed and compares the KPIs of
+every run with the first, the finest, one.
+"""
+from __future__ import print_function, division
+import sys
+import runner
+
+# (SUMO step length, controller decision interval) in simulated seconds, None updates with every step
+CADENCES = [(0.1, None), (0.1, 0.5), (0.1, 1.0), (0.5, None), (1.0, None)]
+
+KPIS = ("meanTravelTime", "totalWaitingTime", "arrived")
+
+
+def benchmark_cadences(config, cadences=CADENCES):
+    """Returns a row per cadence with the wall time, steps per second, KPIs and their relative errors against the
+    first cadence"""
+    rows = []
+    for step_length, decision_interval in cadences:
+        run_config = dict(config)
+        run_config.update({"step_length": step_length, "decision_interval": decision_interval, "metrics": True,
+                           "seed": config["seed"] or 0, "progress_interval": None})
+        result = runner.run_scenario(run_config, quiet=True)
+
+        row = {"step_length": step_length, "decision_interval": decision_interval,
+               "wall_time": result["wall_time"], "steps_per_second": result["steps_per_second"]}
+        for kpi in KPIS:
+            row[kpi] = result["metrics"][kpi]
+            reference = rows[0][kpi] if rows else row[kpi]
+            row[kpi + "Error"] = (row[kpi] - reference) / reference if reference else 0.
+        rows.append(row)
+    return rows
+
+
+if __name__ == "__main__":
+
+    argv = sys.argv if len(sys.argv) > 1 and not sys.argv[1].startswith("-") else \
+        [sys.argv[0], "scenarios/grid.json"] + sys.argv[1:]
+    config_filepath, overrides = runner.parse_arguments(argv)
+    config = runner.load_config(config_filepath, overrides)
+
+    print("%6s %8s %9s %9s %14s %7s %16s %7s %8s %7s" %
+          ("step", "decision", "wall (s)", "steps/s", "meanTravelTime", "error", "totalWaitingTime", "error",
+           "arrived", "error"))
+    for row in benchmark_cadences(config):
+        print("%6.1f %8s %9.2f %9.0f %14.2f %6.1f%% %16.0f %6.1f%% %8d %6.1f%%" %
+              (row["step_length"], "step" if row["decision_interval"] is None else "%.1f" % row["decision_interval"],
+               row["wall_time"], row["steps_per_second"], row["meanTravelTime"], 100 * row["meanTravelTimeError"],
+               row["totalWaitingTime"], 100 * row["totalWaitingTimeError"], row["arrived"],
+               100 * row["arrivedError"]))
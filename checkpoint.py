@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division
+import os
+import json
+import numbers
+import random
+import numpy as np
+
+CHECKPOINT_VERSION = 3
+
+# Per intersection values of IntersectionController.get_state, packed into one array each
+SCALARS = ("current_phase_index", "green_timer", "amber_timer", "state", "update_interval", "deferred_interval",
+           "phase_change_step", "vehicles_to_remove", "vehicles_removed")
+QUEUE_ARRAYS = ("queue_green_times", "queue_lengths", "capacities", "vehicles_to_remove_by_link_index")
+STRINGS = ("current_phase_string", "next_green_string")
+
+# Type of every packed number, saved next to each array so that ints and bools come back as they were
+_FLOAT, _INT, _BOOL = range(3)
+
+
+def _type_codes(values):
+    return [_BOOL if isinstance(value, (bool, np.bool_)) else _INT if isinstance(value, numbers.Integral) else _FLOAT
+            for value in values]
+
+
+def _restore_types(values, type_codes):
+    """The packed float values, as bools and ints where their type codes say so"""
+    return [bool(value) if type_code == _BOOL else int(value) if type_code == _INT else value
+            for value, type_code in zip(values, type_codes)]
+
+
+def _encode_random_state(random_state):
+    """Arrays and header values of a numpy RandomState"""
+    name, keys, position, has_gauss, cached_gaussian = random_state.get_state()
+    return keys, [name, int(position), int(has_gauss), float(cached_gaussian)]
+
+
+def _decode_random_state(keys, values):
+    name, position, has_gauss, cached_gaussian = values
+    return name, keys, position, has_gauss, cached_gaussian
+
+
+def save_checkpoint(filepath, states, header, random_states=()):
+    """Writes the states of the intersection controllers, a list of (tls id, IntersectionController.get_state()),
+    as a compressed .npz of packed arrays with a JSON header. header holds the caller's own values, e.g. the time.
+    random_states are numpy RandomStates of the controllers, restored in the same order by load_checkpoint. The
+    file is written under a temporary name and renamed, so a crash while saving leaves the previous checkpoint"""
+    num_junctions = len(states)
+    max_num_queues = max([len(state["queue_green_times"]) for _, state in states] + [0])
+
+    arrays = {"scalars": np.array([[float(state[name]) for name in SCALARS] for _, state in states]).reshape(
+        num_junctions, len(SCALARS)),
+              "scalars_types": np.array([_type_codes([state[name] for name in SCALARS]) for _, state in states],
+                                        dtype=np.int8).reshape(num_junctions, len(SCALARS))}
+    for name in QUEUE_ARRAYS:
+        arrays[name] = np.full((num_junctions, max_num_queues), np.nan)
+        arrays[name + "_types"] = np.zeros((num_junctions, max_num_queues), dtype=np.int8)
+        for junction, (_, state) in enumerate(states):
+            arrays[name][junction, :len(state[name])] = state[name]
+            arrays[name + "_types"][junction, :len(state[name])] = _type_codes(state[name])
+
+    # Lanes of all intersections one after the other; rate samples and vehicle ids flattened with counts per lane
+    lane_rates, lane_totals, sample_counts, samples, vehicle_counts, vehicle_ids = [], [], [], [], [], []
+    for _, state in states:
+        for lane in state["lanes"]:
+            lane_rates.append((state["mu"][lane], state["lambda"][lane]))
+            lane_totals.append(state["rate_totals"].get(lane, (0, 0, 0.)))
+            sample_counts.append(len(state["rate_samples"][lane]))
+            samples.extend(state["rate_samples"][lane])
+            vehicle_counts.append(len(state["vehicles_at_start"][lane]))
+            vehicle_ids.extend(state["vehicles_at_start"][lane])
+    for name, rows, width in (("lane_rates", lane_rates, 2), ("lane_totals", lane_totals, 3), ("samples", samples, 3)):
+        arrays[name] = np.array(rows, dtype=float).reshape(-1, width)
+        arrays[name + "_types"] = np.array([_type_codes(row) for row in rows], dtype=np.int8).reshape(-1, width)
+    arrays["sample_counts"] = np.array(sample_counts, dtype=np.int64)
+    arrays["vehicle_counts"] = np.array(vehicle_counts, dtype=np.int64)
+    arrays["vehicle_ids"] = np.array(vehicle_ids, dtype=np.unicode_)
+
+    python_random = random.getstate()
+    arrays["python_random"] = np.array(python_random[1], dtype=np.int64)
+    random_headers = []
+    for number, random_state in enumerate(random_states):
+        arrays["random_state_%d" % number], values = _encode_random_state(random_state)
+        random_headers.append(values)
+
+    header = dict(header)
+    header.update({"version": CHECKPOINT_VERSION,
+                   "junctions": [tls_id for tls_id, _ in states],
+                   "num_queues": [len(state["queue_green_times"]) for _, state in states],
+                   "lanes": [state["lanes"] for _, state in states],
+                   "strings": [[state[name] for name in STRINGS] for _, state in states],
+                   "python_random": [python_random[0], python_random[2]],
+                   "random_states": random_headers})
+    arrays["header"] = np.frombuffer(json.dumps(header).encode("utf-8"), dtype=np.uint8)
+
+    temporary_filepath = filepath + ".tmp"
+    with open(temporary_filepath, "wb") as checkpoint_file:
+        np.savez_compressed(checkpoint_file, **arrays)
+    os.rename(temporary_filepath, filepath)
+
+
+def load_checkpoint(filepath, random_states=()):
+    """Reads a checkpoint written by save_checkpoint. Restores the python random module and the given RandomStates
+    and returns the header and the list of (tls id, state)"""
+    with np.load(filepath) as checkpoint:
+        arrays = dict((name, checkpoint[name]) for name in checkpoint.files)
+    header = json.loads(arrays["header"].tostring().decode("utf-8"))
+    if header["version"] != CHECKPOINT_VERSION:
+        raise ValueError("Checkpoint %s has version %s, expected %s" % (filepath, header["version"], CHECKPOINT_VERSION))
+
+    version, gauss_next = header["python_random"]
+    random.setstate((version, tuple(int(value) for value in arrays["python_random"]), gauss_next))
+    for number, random_state in enumerate(random_states):
+        random_state.set_state(_decode_random_state(arrays["random_state_%d" % number],
+                                                    header["random_states"][number]))
+
+    sample_offsets = np.concatenate(([0], np.cumsum(arrays["sample_counts"])))
+    vehicle_offsets = np.concatenate(([0], np.cumsum(arrays["vehicle_counts"])))
+    lane_number = 0
+
+    states = []
+    for junction, tls_id in enumerate(header["junctions"]):
+        state = dict(zip(SCALARS, _restore_types(arrays["scalars"][junction].tolist(),
+                                                 arrays["scalars_types"][junction])))
+        for name in QUEUE_ARRAYS:
+            num_queues = header["num_queues"][junction]
+            state[name] = _restore_types(arrays[name][junction, :num_queues].tolist(),
+                                         arrays[name + "_types"][junction, :num_queues])
+        state.update(zip(STRINGS, header["strings"][junction]))
+
+        state["lanes"] = header["lanes"][junction]
+        state["mu"], state["lambda"], state["rate_totals"] = {}, {}, {}
+        state["rate_samples"], state["vehicles_at_start"] = {}, {}
+        for lane in state["lanes"]:
+            state["mu"][lane], state["lambda"][lane] = _restore_types(arrays["lane_rates"][lane_number].tolist(),
+                                                                      arrays["lane_rates_types"][lane_number])
+            state["rate_totals"][lane] = _restore_types(arrays["lane_totals"][lane_number].tolist(),
+                                                        arrays["lane_totals_types"][lane_number])
+            sample_rows = slice(sample_offsets[lane_number], sample_offsets[lane_number + 1])
+            state["rate_samples"][lane] = [tuple(_restore_types(sample, types)) for sample, types in
+                                           zip(arrays["samples"][sample_rows].tolist(),
+                                               arrays["samples_types"][sample_rows])]
+            state["vehicles_at_start"][lane] = [str(veh_id) for veh_id in arrays["vehicle_ids"][
+                vehicle_offsets[lane_number]:vehicle_offsets[lane_number + 1]]]
+            lane_number += 1
+        states.append((tls_id, state))
+
+    return header, states
@@ -2,6 +2,14 @@
 from __future__ import print_function, division
 import numpy as np
 import random
+import scipy.sparse as sparse
+
+def break_tie(phase_scores, random_state):
+    """Picks one of the best scoring phases, always consuming exactly one draw from random_state. Scores within a
+    small tolerance of the best are treated as ties, so summation order does not change the outcome"""
+    best_score = np.amax(phase_scores)
+    best_choices = np.nonzero(phase_scores >= best_score - 1e-9 * max(1, abs(best_score)))[0]
+    return best_choices[int(random_state.random_sample() * len(best_choices))]
 
 class MinMaxGreenTimeController:
     
@@ -65,10 +73,19 @@ class PGreenTimeController:
 
 class ModelBasedGreenTimeController:
 
-    def __init__(self, Tmin, Tmax):
+    def __init__(self, Tmin, Tmax, min_rate_difference=1e-9):
         self._Tmin = Tmin
         self._Tmax = Tmax
         self._initialGreenTime = (Tmax+Tmin)/2
+        if min_rate_difference <= 0:
+            raise ValueError("min_rate_difference must be positive, so that saturated phases never divide by zero")
+        self._min_rate_difference = min_rate_difference  # mu-lam below this is treated as saturated
+
+        # Per intersection: the phases each incoming lane is open in, and the sums of mu and lambda over the open
+        # lanes of every phase. Updated incrementally by update_lane_rates.
+        self._phases_by_lane = {}
+        self._mu_by_phase = {}
+        self._lambda_by_phase = {}
 
     def __repr__(self):
         return "Uses the model of traffic in flow to calculate green time. Staturates if the values exceed certain limits"
@@ -76,32 +93,55 @@ class ModelBasedGreenTimeController:
     def get_initial_green_time(self):
         return self._initialGreenTime
 
+    def attach_intersection_controller(self, IC):
+        phases = IC.get_phase_matrix_by_link_index()
+        phases_by_lane = {}
+        for lane in IC.get_incoming_lanes():
+            lane_open = np.any(phases[:, IC.get_indicies_of_incoming_lane(lane)], axis=1)
+            phases_by_lane[lane] = list(np.nonzero(lane_open)[0])
+
+        # Plain lists, as the few phases of a lane are updated faster in Python than by NumPy fancy indexing
+        self._phases_by_lane[IC] = phases_by_lane
+        self._mu_by_phase[IC] = [sum(IC.get_mu(lane) for lane in phases_by_lane if phase in phases_by_lane[lane])
+                                 for phase in range(len(phases))]
+        self._lambda_by_phase[IC] = [sum(IC.get_lambda(lane) for lane in phases_by_lane if phase in phases_by_lane[lane])
+                                     for phase in range(len(phases))]
+
+    def update_lane_rates(self, IC, lane, mu_change, lambda_change):
+        """Applies a change in the mu and lambda estimates of a lane to the sums of every phase the lane is open in"""
+        if not (mu_change or lambda_change):
+            return
+        mu_by_phase = self._mu_by_phase[IC]
+        lambda_by_phase = self._lambda_by_phase[IC]
+        for phase in self._phases_by_lane[IC][lane]:
+            mu_by_phase[phase] += mu_change
+            lambda_by_phase[phase] += lambda_change
+
     def get_new_green_time(self, IC):
 
-        open_lanes = IC.get_current_open_lanes()
         target_number_cars_cleared = IC.get_a_compare()
 
-        max_green_time = self._Tmin
-        mu = 0
-        lam = 0
-
-        for lane in open_lanes:
-            mu += IC.get_mu(lane)
-            lam += IC.get_lambda(lane)
+        if IC in self._mu_by_phase:
+            mu = self._mu_by_phase[IC][IC.get_current_phase_index()]
+            lam = self._lambda_by_phase[IC][IC.get_current_phase_index()]
+        else:
+            mu = 0
+            lam = 0
+            for lane in IC.get_current_open_lanes():
+                mu += IC.get_mu(lane)
+                lam += IC.get_lambda(lane)
 
         if target_number_cars_cleared > 0:
-            try:
+            # Vehicles are not being cleared faster than they arrive (the phase is saturated, however negative the
+            # margin), so give the queues the longest green time
+            if mu - lam < self._min_rate_difference:
+                modelBased_Gt = self._Tmax
+            else:
                 modelBased_Gt = target_number_cars_cleared/(mu-lam)
-            except ZeroDivisionError:
-                max_green_time = self._Tmax
         else:
             modelBased_Gt = self._Tmin
 
-        if modelBased_Gt > self._Tmax : modelBased_Gt = self._Tmax
-
-        if max_green_time < modelBased_Gt : max_green_time = modelBased_Gt
-
-        return max_green_time
+        return min(max(modelBased_Gt, self._Tmin), self._Tmax)
 
 class LmaxQueueController:
     
@@ -120,20 +160,25 @@ class LmaxQueueController:
 
 class CongestionAwareLmaxQueueController:
     
-    def __init__(self):
-        pass
+    def __init__(self, seed=None):
+        """ Controller that maximises the total number of vehicles released, ignoring queues whose outgoing lane is
+        full. Ties are broken with the controller's own seeded generator so that per-junction and batched decisions
+        draw the same random numbers in the same order """
+        self._random = np.random.RandomState(seed)
+
+    def __repr__(self):
+        return "Congestion Aware Lmax Queue Controller: Releases the largest set of queues that have somewhere to go"
     
     def discount_congested_queues(self, phases, capacities):
-        """Sets phase entry to 0 for queues which have nowhere to go"""
-        for row, phase in enumerate(phases):
-            for col, entry in enumerate(phase):
-                if capacities[col] < 1 :
-                    phases[row][col] = 0
-        return phases
+        """Sets phase entry to 0 for queues which have nowhere to go. Capacities broadcast against the last axis of
+        phases, so stacked (intersection x phase x queue) arrays are handled in the same way as a single junction"""
+        return np.where(np.asarray(capacities) < 1, 0, phases)
+
+    def break_tie(self, phase_scores):
+        return break_tie(phase_scores, self._random)
                  
     def best_queue_set(self, intersection_controller):
         """Picks the best queue to release, based on total number of vehicles in non-conflicting queues"""
-        phase_benefit = []
         phases = intersection_controller.get_phase_matrix_by_link_index()
 
         queues = intersection_controller.get_queues()
@@ -142,61 +187,214 @@ class CongestionAwareLmaxQueueController:
         phases_discounted = self.discount_congested_queues(phases, capacities)
         discounted_phases__queues_dot_product = np.dot(phases_discounted, queues)
 
-        best_choices = np.nonzero(discounted_phases__queues_dot_product == np.amax(discounted_phases__queues_dot_product))[0]
+        return self.break_tie(discounted_phases__queues_dot_product)
 
-        return random.choice(best_choices)
+    def best_queue_sets(self, intersection_controllers):
+        """Picks the best queue to release for every intersection controller given, in one call. The phase matrices,
+        queues and capacities are zero padded and stacked so that all phases of all junctions are scored together.
+        Returns the chosen phase indexes in the same order as the intersection controllers"""
+        if not intersection_controllers:
+            return []
+
+        phase_matrices = [intersection_controller.get_phase_matrix_by_link_index()
+                          for intersection_controller in intersection_controllers]
+        num_phases = max(len(phases) for phases in phase_matrices)
+        num_queues = max(intersection_controller.get_num_queues() for intersection_controller in intersection_controllers)
+
+        phases = np.zeros((len(intersection_controllers), num_phases, num_queues))
+        queues = np.zeros((len(intersection_controllers), num_queues))
+        capacities = np.zeros((len(intersection_controllers), num_queues))
+        valid_phases = np.zeros((len(intersection_controllers), num_phases), dtype=bool)
+
+        for ii, intersection_controller in enumerate(intersection_controllers):
+            n = intersection_controller.get_num_queues()
+            phases[ii, :len(phase_matrices[ii]), :n] = phase_matrices[ii]
+            queues[ii, :n] = intersection_controller.get_queues()
+            capacities[ii, :n] = intersection_controller.get_capacities()
+            valid_phases[ii, :len(phase_matrices[ii])] = True
+
+        phases_discounted = self.discount_congested_queues(phases, capacities[:, np.newaxis, :])
+        discounted_phases__queues_dot_product = np.einsum('ipq,iq->ip', phases_discounted, queues)
+        # Padded phases must never be chosen, even when every real phase scores zero
+        discounted_phases__queues_dot_product[~valid_phases] = -np.inf
+
+        return [self.break_tie(phase_scores) for phase_scores in discounted_phases__queues_dot_product]
 
 class CongestionDemandOptimisingQueueController:
 
+    def __init__(self, seed=None):
+        """ Controller that bounds the demand of each queue by the capacity of the lane it wishes to join. The static
+        structures used for every decision are computed once per intersection and cached. Ties are broken with the
+        controller's own seeded generator """
+        self._random = np.random.RandomState(seed)
+        self._structures_by_intersection = {}
+
     def __repr__(self):
         return """Uses a matrix of the outgoing lanes for each queue, and knowledge of congestion, in order to further
         optimise the queues to unlock"""
 
-    def get_L_matrix_from_phase(self, phase):
-        L = []
-        for row_index, row_status in enumerate(phase):
-            L.append([])
-            for other_index, col_status in enumerate(phase):
-                if row_status and col_status:
-                    L[row_index].append(1)
-                else:
-                    L[row_index].append(0)
+    def attach_intersection_controller(self, intersection_controller):
+        """Precomputes and caches the static structures for an intersection using this controller"""
+        phases = intersection_controller.get_phase_matrix_by_link_index()
+        outgoing_lanes = np.array(intersection_controller.get_outgoing_lanes_by_index_array())
 
-        return L
+        # receiving_lanes_index[jj][ii] is 1 if queues jj and ii feed into the same outgoing lane
+        receiving_lanes_index = (outgoing_lanes[:, np.newaxis] == outgoing_lanes[np.newaxis, :]).astype(float)
 
-    def bounded_demand(self, x_tilda, capacity_vec):
-        return [min(val) for val in zip(x_tilda,capacity_vec)]
+        # Phase x queue x queue tensor of the outgoing lane matrix combined with the L matrix of every phase
+        combined_out_flows_and_L_tensor = receiving_lanes_index[np.newaxis, :, :] * self.get_L_matrix_from_phase(phases)
+        combined_out_flows_per_queue = np.sum(combined_out_flows_and_L_tensor, axis=2)
+
+        structures = (phases, combined_out_flows_and_L_tensor, combined_out_flows_per_queue)
+        self._structures_by_intersection[intersection_controller] = structures
+
+        return structures
+
+    def get_L_matrix_from_phase(self, phase):
+        """Returns the L matrix (1 where both queues are open) of a phase, or a stack of them for a matrix of phases"""
+        phase = np.asarray(phase)
+        return np.logical_and(phase[..., :, np.newaxis], phase[..., np.newaxis, :]).astype(float)
 
-    def demand_per_queue(self, combined_out_flows_and_L_matrix, x_bounded):
+    def bounded_demand(self, x_tilda, capacity_vec):
+        return np.minimum(x_tilda, capacity_vec)
 
-        return [(queue_bounded/np.sum(combined_out_flows_and_L_matrix[ii][:])) if np.sum(combined_out_flows_and_L_matrix[ii][:]) != 0 else 0 for ii, queue_bounded in enumerate(x_bounded)]
+    def demand_per_queue(self, combined_out_flows_per_queue, x_bounded):
+        has_out_flow = combined_out_flows_per_queue != 0
+        return np.where(has_out_flow, x_bounded / np.where(has_out_flow, combined_out_flows_per_queue, 1), 0)
 
     def best_queue_set(self, intersection_controller):
 
-        phase_benefit = []
-        phases = intersection_controller.get_phase_matrix_by_link_index()
-        receiving_lanes_index = [[1 if ii in intersection_controller.get_indicies_of_outgoing_lane(intersection_controller.get_outgoing_lane_from_index(jj))
-                                else 0
-                                for ii in range(intersection_controller.get_num_queues())]
-                                for jj in range(intersection_controller.get_num_queues())]
+        try:
+            phases, combined_out_flows_and_L_tensor, combined_out_flows_per_queue = \
+                self._structures_by_intersection[intersection_controller]
+        except KeyError:
+            phases, combined_out_flows_and_L_tensor, combined_out_flows_per_queue = \
+                self.attach_intersection_controller(intersection_controller)
 
         queues = intersection_controller.get_queues()
         capacities = intersection_controller.get_capacities()
 
-        for phase in phases:
-            L = self.get_L_matrix_from_phase(phase)
-            combined_out_flows_and_L_matrix = np.multiply(receiving_lanes_index, L)
-            x_tilda = np.dot(combined_out_flows_and_L_matrix, queues)
+        x_tilda = np.einsum('pij,j->pi', combined_out_flows_and_L_tensor, queues)
 
-            x_bounded = self.bounded_demand(x_tilda, capacities)
-            x_bounded_per_queue = self.demand_per_queue(combined_out_flows_and_L_matrix, x_bounded)
+        x_bounded = self.bounded_demand(x_tilda, capacities)
+        x_bounded_per_queue = self.demand_per_queue(combined_out_flows_per_queue, x_bounded)
 
-            total_demand_bounded_by_capacity = np.dot(phase, x_bounded_per_queue)
+        phase_benefit = np.einsum('pi,pi->p', phases, x_bounded_per_queue)
 
-            phase_benefit.append(total_demand_bounded_by_capacity)
+        return break_tie(phase_benefit, self._random)
 
-        best_choices = np.nonzero(phase_benefit == np.amax(phase_benefit))[0]
+class MaxPressureQueueController:
 
-        return random.choice(best_choices)
+    def __init__(self, seed=None):
+        """ Controller that releases the phase with the highest pressure, i.e. the sum over its open links of the
+        movement's queue minus the queue it feeds downstream. Pressures for every attached intersection are computed
+        together from network level link vectors and a sparse phase-link matrix """
+        self._random = np.random.RandomState(seed)
+
+        self._links_by_incoming_lane = {}  # Lane id -> number of links leaving it, for the lanes of attached intersections
+        self._out_lanes = []  # Outgoing lane of every link row
 
+        # Per link row: the movement's queue, the vehicles on its outgoing lane, and the turning share of the lane
+        # that each of those vehicles counts for downstream
+        self._upstream_queues = np.zeros(0)
+        self._downstream_vehicles = np.zeros(0)
+        self._downstream_weights = np.zeros(0)
 
+        self._phase_entries = []  # (phase row, link column) for every open link of every attached phase
+        self._num_links = 0
+        self._num_phases = 0
+
+        self._phase_rows_by_intersection = {}
+        self._link_rows_by_intersection = {}
+
+        self._phase_link_matrix = None
+
+    def __repr__(self):
+        return "Max Pressure Queue Controller: Releases the phase with the largest upstream minus downstream queue"
+
+    def attach_intersection_controller(self, intersection_controller):
+        """Adds the links and phases of an intersection to the network level vectors and matrix"""
+        link_offset = self._num_links
+
+        for index in range(intersection_controller.get_num_queues()):
+            in_lane = intersection_controller.get_incoming_lane_from_index(index)
+            self._links_by_incoming_lane[in_lane] = len(intersection_controller.get_indicies_of_incoming_lane(in_lane))
+            self._out_lanes.append(intersection_controller.get_outgoing_lane_from_index(index))
+
+        phases = intersection_controller.get_phase_matrix_by_link_index()
+        for phase_number, phase in enumerate(phases):
+            for index in np.nonzero(phase)[0]:
+                self._phase_entries.append((self._num_phases + phase_number, link_offset + index))
+
+        self._phase_rows_by_intersection[intersection_controller] = np.arange(self._num_phases,
+                                                                              self._num_phases + len(phases))
+        self._link_rows_by_intersection[intersection_controller] = np.arange(
+            link_offset, link_offset + intersection_controller.get_num_queues())
+
+        self._num_links += intersection_controller.get_num_queues()
+        self._num_phases += len(phases)
+
+        # Rebuilt lazily at the next decision, so attaching many intersections costs one build
+        self._phase_link_matrix = None
+
+    def build_matrices(self):
+        """Builds the phase-link matrix and the downstream turning shares. The vehicles on an outgoing lane that feeds
+        an attached intersection are split evenly over the links leaving it, as in get_queues, so a link's downstream
+        queue is the share of the lane each following movement holds. Lanes that leave the network (or enter no
+        attached intersection) count as empty"""
+        rows, cols = zip(*self._phase_entries) if self._phase_entries else ((), ())
+        self._phase_link_matrix = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)),
+                                                    shape=(self._num_phases, self._num_links))
+
+        self._downstream_weights = np.array([1 / self._links_by_incoming_lane[lane]
+                                             if lane in self._links_by_incoming_lane else 0.
+                                             for lane in self._out_lanes])
+        self._upstream_queues = np.concatenate([self._upstream_queues,
+                                                np.zeros(self._num_links - len(self._upstream_queues))])
+        self._downstream_vehicles = np.concatenate([self._downstream_vehicles,
+                                                    np.zeros(self._num_links - len(self._downstream_vehicles))])
+
+    def update_network_queues(self, intersection_controllers):
+        """Copies the queues and outgoing lane vehicles the intersection controllers measured this step (in
+        update_queues and update_capacities) into the network vectors"""
+        for intersection_controller in intersection_controllers:
+            link_rows = self._link_rows_by_intersection[intersection_controller]
+            self._upstream_queues[link_rows] = intersection_controller.get_queues()
+            self._downstream_vehicles[link_rows] = intersection_controller.get_outgoing_vehicles()
+
+    def get_phase_pressures(self):
+        """Returns the pressure of every attached phase in the network"""
+        return self._phase_link_matrix.dot(self._upstream_queues - self._downstream_weights * self._downstream_vehicles)
+
+    def get_phase_demands(self):
+        """Returns the vehicles queued on the open links of every attached phase in the network"""
+        return self._phase_link_matrix.dot(self._upstream_queues)
+
+    def best_queue_set(self, intersection_controller):
+        """Picks the phase with the highest pressure"""
+        return self.best_queue_sets([intersection_controller])[0]
+
+    def best_queue_sets(self, intersection_controllers):
+        """Picks the phase with the highest pressure for every intersection controller given, in one call. Phases
+        with no vehicles waiting are only picked when no phase of the intersection has any, however congested the
+        lanes downstream of the others are"""
+        for intersection_controller in intersection_controllers:
+            if intersection_controller not in self._phase_rows_by_intersection:
+                self.attach_intersection_controller(intersection_controller)
+
+        if self._phase_link_matrix is None:
+            self.build_matrices()
+
+        self.update_network_queues(intersection_controllers)
+        phase_pressures = self.get_phase_pressures()
+        phase_demands = self.get_phase_demands()
+
+        best_phases = []
+        for intersection_controller in intersection_controllers:
+            phase_rows = self._phase_rows_by_intersection[intersection_controller]
+            pressures = phase_pressures[phase_rows]
+            demands = phase_demands[phase_rows]
+            if np.any(demands > 0):
+                pressures = np.where(demands > 0, pressures, -np.inf)
+            best_phases.append(break_tie(pressures, self._random))
+        return best_phases
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Deadline monitoring for real-time runs, e.g. with the lights of a hardware-in-the-loop rig. Every simulation step gets
+a wall clock budget; the monitor measures the time of the step's parts (the TraCI simulation step, the controllers,
+the metrics and deferred work) and records the steps over budget with the intersections and stages that took longest.
+"""
+from __future__ import print_function, division
+import csv
+import time
+from array import array
+from collections import deque
+import numpy as np
+from profiling import STAGES, StageTimer, clock_ns
+
+# Parts of a step, in the order the runner measures them
+PARTS = ("simulation", "controllers", "metrics", "deferred")
+SIMULATION, CONTROLLERS, METRICS, DEFERRED = range(len(PARTS))
+
+
+class DeadlineStageTimer(StageTimer):
+
+    def __init__(self, monitor, junction_id):
+        """ StageTimer of one intersection (or of the batched queue choices) that also charges every stage to the
+        current step of a DeadlineMonitor, so that overruns can be traced to their intersections and stages """
+        StageTimer.__init__(self)
+        self._monitor = monitor
+        self._junction_id = junction_id
+
+    def time_stage(self, stage_index, stage, *args):
+        start = clock_ns()
+        result = stage(*args)
+        elapsed = clock_ns() - start
+        self._total_ns[stage_index] += elapsed
+        self._calls[stage_index] += 1
+        self._monitor.add_stage_time(self._junction_id, stage_index, elapsed)
+        return result
+
+
+class DeadlineMonitor:
+
+    def __init__(self, budget, defer_after=None, max_blamed=3):
+        """ Measures the wall clock latency of every step against budget seconds. With defer_after, a fraction of the
+        budget, is_late tells non-critical work to wait once that much of the step has passed. Overruns keep the
+        max_blamed (intersection, stage) pairs that took longest in the step """
+        self._budget_ns = int(budget * 1e9)
+        self._defer_after_ns = None if defer_after is None else int(budget * defer_after * 1e9)
+        self._max_blamed = max_blamed
+
+        # Per step values in ns, kept whole for exact quantiles: 8 bytes a step
+        self._latencies = array("d")
+        self._part_latencies = [array("d") for _ in PARTS]
+        self._overruns = []
+        self._deferred_steps = 0
+
+        self._step = None
+        self._step_start = 0
+        self._lap_start = 0
+        self._laps = [0] * len(PARTS)
+        self._stage_ns = {}
+        self._deferred = False
+
+    def get_stage_timer(self, junction_id):
+        return DeadlineStageTimer(self, junction_id)
+
+    # Measurement of one step
+    def start_step(self, step):
+        self._step = step
+        self._step_start = self._lap_start = clock_ns()
+        self._laps = [0] * len(PARTS)
+        self._stage_ns = {}
+        self._deferred = False
+
+    def lap(self, part):
+        """Charges the time since the previous lap (or the start of the step) to part"""
+        now = clock_ns()
+        self._laps[part] += now - self._lap_start
+        self._lap_start = now
+
+    def add_stage_time(self, junction_id, stage_index, elapsed_ns):
+        key = (junction_id, stage_index)
+        self._stage_ns[key] = self._stage_ns.get(key, 0) + elapsed_ns
+
+    def end_step(self):
+        """Stores the latency of the step and, if it is over budget, an overrun record. Returns the latency in ns"""
+        latency = clock_ns() - self._step_start
+        self._latencies.append(latency)
+        for part, lap in enumerate(self._laps):
+            self._part_latencies[part].append(lap)
+        if self._deferred:
+            self._deferred_steps += 1
+        if latency > self._budget_ns:
+            blamed = sorted(self._stage_ns.items(), key=lambda item: -item[1])[:self._max_blamed]
+            self._overruns.append({"step": self._step, "latency_ms": latency / 1e6,
+                                   "parts_ms": [lap / 1e6 for lap in self._laps],
+                                   "blamed": [(junction_id, STAGES[stage_index], elapsed / 1e6)
+                                              for (junction_id, stage_index), elapsed in blamed]})
+        return latency
+
+    def remaining_ns(self):
+        return self._budget_ns - (clock_ns() - self._step_start)
+
+    def has_slack(self):
+        """True while the step is within the part of its budget where non-critical work may run"""
+        return self._defer_after_ns is None or clock_ns() - self._step_start < self._defer_after_ns
+
+    def is_late(self):
+        """True if non-critical work should wait for a later step. Counts the step as one with deferred work"""
+        if self.has_slack():
+            return False
+        self._deferred = True
+        return True
+
+    def sleep_until_deadline(self):
+        """Sleeps out the rest of the step's budget, pacing the run at one step per budget. A step over budget
+        does not shorten the next one"""
+        remaining = self.remaining_ns()
+        if remaining > 0:
+            time.sleep(remaining / 1e9)
+
+    # Results
+    def get_overruns(self):
+        return self._overruns
+
+    def get_summary(self):
+        """Step latency quantiles and maximum in ms, overall and per part, with the number of overruns, of steps
+        that deferred work and of overruns in which each stage was among the longest"""
+        steps = len(self._latencies)
+        latencies = np.frombuffer(self._latencies, dtype=float) / 1e6 if steps else np.zeros(1)
+        summary = {"steps": steps, "budget_ms": self._budget_ns / 1e6,
+                   "p50_ms": float(np.percentile(latencies, 50)), "p99_ms": float(np.percentile(latencies, 99)),
+                   "max_ms": float(latencies.max()), "mean_ms": float(latencies.mean()),
+                   "overruns": len(self._overruns), "overrun_fraction": len(self._overruns) / steps if steps else 0.,
+                   "deferred_steps": self._deferred_steps}
+        for part, part_latencies in zip(PARTS, self._part_latencies):
+            part_latencies = np.frombuffer(part_latencies, dtype=float) / 1e6 if steps else np.zeros(1)
+            summary[part + "_p99_ms"] = float(np.percentile(part_latencies, 99))
+            summary[part + "_max_ms"] = float(part_latencies.max())
+
+        blamed_stages = {}
+        for overrun in self._overruns:
+            for _, stage, _ in overrun["blamed"]:
+                blamed_stages[stage] = blamed_stages.get(stage, 0) + 1
+        summary["blamed_stages"] = blamed_stages
+        return summary
+
+    def write_overruns(self, filepath):
+        """Writes a CSV row per overrun: step, latency and part times in ms, and the blamed intersections and stages
+        as 'junction:stage:ms' separated by spaces"""
+        with open(filepath, "w") as output:
+            writer = csv.writer(output)
+            writer.writerow(("step", "latency_ms") + tuple(part + "_ms" for part in PARTS) + ("blamed",))
+            for overrun in self._overruns:
+                writer.writerow(["%.3f" % overrun["step"], "%.3f" % overrun["latency_ms"]] +
+                                ["%.3f" % lap for lap in overrun["parts_ms"]] +
+                                [" ".join("%s:%s:%.3f" % blamed for blamed in overrun["blamed"])])
+
+
+class DeferredRecorder:
+
+    def __init__(self, output_recorder, monitor):
+        """ Output recorder that queues the records for output_recorder and writes them in drain, called at the end of
+        each step, for as long as the step has slack left. flush writes whatever is still queued """
+        self._output_recorder = output_recorder
+        self._monitor = monitor
+        self._pending = deque()
+
+    def get_junction_number(self, junction_id):
+        return self._output_recorder.get_junction_number(junction_id)
+
+    def record_green_time(self, step, junction_number, phase_index, green_time):
+        self._pending.append((self._output_recorder.record_green_time, (step, junction_number, phase_index,
+                                                                        green_time)))
+
+    def record_phase_change(self, step, junction_number, phase_index, green_time, queues, capacities):
+        # The controllers keep changing their queue and capacity lists, so the record takes copies
+        self._pending.append((self._output_recorder.record_phase_change, (step, junction_number, phase_index,
+                                                                          green_time, list(queues),
+                                                                          list(capacities))))
+
+    def get_num_pending(self):
+        return len(self._pending)
+
+    def drain(self):
+        while self._pending and self._monitor.has_slack():
+            record, args = self._pending.popleft()
+            record(*args)
+
+    def flush(self):
+        while self._pending:
+            record, args = self._pending.popleft()
+            record(*args)
+        self._output_recorder.flush()
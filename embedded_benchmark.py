@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Per command overhead of the TraCI socket against the embedded mode.
+
+    python embedded_benchmark.py [net file] [route file] [repetitions]
+
+The same surrogate scenario answers the commands three ways: over a TCP socket from traciemb_standin.serve in another
+process (as SUMO with --remote-port), in this process through traci.initEmbedded and traciemb_standin (as SUMO's
+traciemb), and by calling the surrogate directly, which is the work every command does whatever the transport. The
+overhead of a transport is its time per command less the direct time.
+"""
+from __future__ import print_function, division
+import sys
+import multiprocessing
+from timeit import default_timer
+import tools
+import traci
+import traciemb_standin
+from surrogate import SurrogateSimulation
+
+WARMUP_STEPS = 600  # Steps before the commands are timed, so that lanes hold vehicles
+
+
+def _serve(net_file, route_file, step_length, seed, port):
+    traciemb_standin.serve(SurrogateSimulation(net_file, route_file, step_length, seed=seed), port)
+
+
+def _time_calls(calls, repetitions):
+    """Mean seconds per call of every (name, function, args), in order"""
+    times = []
+    for name, function, args in calls:
+        start = default_timer()
+        for _ in range(repetitions):
+            function(*args)
+        times.append((name, (default_timer() - start) / repetitions))
+    return times
+
+
+def _commands(simulation, lane, tls_id):
+    """(name, function, args) of the benchmarked commands, on traci or directly on a SurrogateSimulation. The
+    simulation step comes last as it changes the state the others read"""
+    if simulation is None:
+        return [("getMinExpectedNumber", traci.simulation.getMinExpectedNumber, ()),
+                ("getLastStepVehicleIDs", traci.lane.getLastStepVehicleIDs, (lane,)),
+                ("getRedYellowGreenState", traci.trafficlights.getRedYellowGreenState, (tls_id,)),
+                ("simulationStep", traci.simulationStep, ())]
+    return [("getMinExpectedNumber", simulation.getMinExpectedNumber, ()),
+            ("getLastStepVehicleIDs", simulation.getLastStepVehicleIDs, (lane,)),
+            ("getRedYellowGreenState", simulation.getRedYellowGreenState, (tls_id,)),
+            ("simulationStep", simulation.simulationStep, ())]
+
+
+def benchmark_transports(net_file, route_file, repetitions=2000, step_length=0.1, seed=0):
+    """Rows of (command, socket, embedded and direct seconds per command) over the same scenario state"""
+    direct = SurrogateSimulation(net_file, route_file, step_length, seed=seed)
+    for _ in range(WARMUP_STEPS):
+        direct.step()
+    lanes = sorted(direct._lane_index, key=lambda lane: -direct.getLastStepVehicleNumber(lane))
+    lane, tls_id = str(lanes[0]), str(sorted(direct._tls_states)[0])
+
+    # Socket
+    port = tools.getOpenPort()
+    server = multiprocessing.Process(target=_serve, args=(net_file, route_file, step_length, seed, port))
+    server.start()
+    traci.init(port, numRetries=8)
+    for _ in range(WARMUP_STEPS):
+        traci.simulationStep()
+    socket_times = _time_calls(_commands(None, lane, tls_id), repetitions)
+    traci.close()
+    server.join()
+
+    # Embedded
+    traciemb_standin.load(SurrogateSimulation(net_file, route_file, step_length, seed=seed))
+    traci.initEmbedded(traciemb_standin)
+    for _ in range(WARMUP_STEPS):
+        traci.simulationStep()
+    embedded_times = _time_calls(_commands(None, lane, tls_id), repetitions)
+    traci.close()
+
+    direct_times = _time_calls(_commands(direct, lane, tls_id), repetitions)
+    return [(name, socket_time, embedded_time, direct_time) for (name, socket_time), (_, embedded_time), (_, direct_time)
+            in zip(socket_times, embedded_times, direct_times)]
+
+
+if __name__ == "__main__":
+
+    net_file = sys.argv[1] if len(sys.argv) > 1 else "netFiles/grid.net.xml"
+    route_file = sys.argv[2] if len(sys.argv) > 2 else "netFiles/grid.rou.xml"
+    repetitions = int(sys.argv[3]) if len(sys.argv) > 3 else 2000
+
+    print("%-24s %11s %13s %11s %17s %19s" % ("command", "socket (us)", "embedded (us)", "direct (us)",
+                                               "socket overhead", "embedded overhead"))
+    for name, socket_time, embedded_time, direct_time in benchmark_transports(net_file, route_file, repetitions):
+        print("%-24s %11.1f %13.1f %11.1f %17.1f %19.1f" % (name, 1e6 * socket_time, 1e6 * embedded_time,
+                                                             1e6 * direct_time, 1e6 * (socket_time - direct_time),
+                                                             1e6 * (embedded_time - direct_time)))
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division
+import os
+import json
+import time
+import hashlib
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    name TEXT,
+    started REAL,
+    status TEXT,
+    error TEXT,
+    net_file TEXT,
+    net_hash TEXT,
+    route_file TEXT,
+    route_hash TEXT,
+    green_time_controller TEXT,
+    queue_controller TEXT,
+    x_star REAL,
+    Tmin REAL,
+    Tmax REAL,
+    step_length REAL,
+    decision_interval REAL,
+    seed INTEGER,
+    config TEXT,
+    wall_time REAL,
+    startup_time REAL,
+    simulated_time REAL,
+    steps_per_second REAL
+);
+CREATE INDEX IF NOT EXISTS runs_by_controllers ON runs (net_hash, queue_controller, green_time_controller);
+CREATE TABLE IF NOT EXISTS kpis (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    name TEXT NOT NULL,
+    value REAL,
+    PRIMARY KEY (run_id, name)
+);
+CREATE TABLE IF NOT EXISTS junction_series (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    junction TEXT NOT NULL,
+    name TEXT NOT NULL,
+    link INTEGER NOT NULL,
+    time REAL NOT NULL,
+    value REAL
+);
+CREATE INDEX IF NOT EXISTS junction_series_by_run ON junction_series (run_id, junction, name, link, time);
+CREATE TABLE IF NOT EXISTS file_hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime REAL,
+    hash TEXT
+);
+"""
+
+# Columns of runs copied from the runner config
+CONFIG_COLUMNS = (("green_time_controller", "green_time_controller"), ("queue_controller", "queue_controller"),
+                  ("x_star", "target_frac"), ("Tmin", "Tmin"), ("Tmax", "Tmax"), ("step_length", "step_length"),
+                  ("decision_interval", "decision_interval"), ("seed", "seed"))
+TIMING_COLUMNS = ("wall_time", "startup_time", "simulated_time", "steps_per_second")
+
+
+def summary_kpis(summary):
+    """The scalar KPIs of an OnlineMetrics summary, with the travel time quantiles as travelTimeP<percent>"""
+    kpis = dict((name, value) for name, value in summary.items()
+                if isinstance(value, (int, float)) and not isinstance(value, bool))
+    for quantile, value in summary.get("travelTimeQuantiles", {}).items():
+        kpis["travelTimeP%g" % (100 * float(quantile))] = value
+    return kpis
+
+
+class ExperimentStore:
+
+    def __init__(self, filepath, batch_rows=10000):
+        """ SQLite store of runs: their configuration with hashes of the net and route files, timings, summary KPIs
+        and optional per junction time series. Series rows are buffered and written batch_rows at a time, each
+        batch in one transaction """
+        self._connection = sqlite3.connect(filepath, timeout=60)
+        self._connection.execute("PRAGMA journal_mode=WAL")  # Readers do not block the writer during sweeps
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(SCHEMA)
+        self._batch_rows = batch_rows
+        self._series_rows = []
+
+    def close(self):
+        self.flush()
+        self._connection.close()
+
+    def file_hash(self, filepath):
+        """SHA-1 of a file, cached in the store by path, size and modification time"""
+        path = os.path.abspath(filepath)
+        size, mtime = os.path.getsize(path), os.path.getmtime(path)
+        cached = self._connection.execute("SELECT hash FROM file_hashes WHERE path = ? AND size = ? AND mtime = ?",
+                                          (path, size, mtime)).fetchone()
+        if cached:
+            return cached[0]
+
+        digest = hashlib.sha1()
+        with open(path, "rb") as hashed_file:
+            for block in iter(lambda: hashed_file.read(1 << 20), b""):
+                digest.update(block)
+        with self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?)",
+                                     (path, size, mtime, digest.hexdigest()))
+        return digest.hexdigest()
+
+    # Writing
+    def start_run(self, config):
+        """Adds a run with the runner config and returns its id"""
+        values = {"name": config.get("name"), "started": time.time(), "status": "running",
+                  "net_file": config.get("net_file"), "route_file": config.get("route_file"),
+                  "config": json.dumps(config, sort_keys=True)}
+        for column, key in CONFIG_COLUMNS:
+            values[column] = config.get(key)
+        for column, key in (("net_hash", "net_file"), ("route_hash", "route_file")):
+            if config.get(key) and os.path.exists(config[key]):
+                values[column] = self.file_hash(config[key])
+
+        columns = sorted(values)
+        with self._connection:
+            cursor = self._connection.execute("INSERT INTO runs (%s) VALUES (%s)" % (
+                ", ".join(columns), ", ".join("?" * len(columns))), [values[column] for column in columns])
+        return cursor.lastrowid
+
+    def finish_run(self, run_id, timings=None, kpis=None, error=None):
+        """Stores the timings (see TIMING_COLUMNS) and KPIs of a run, and its buffered series, in one transaction"""
+        timings = timings or {}
+        with self._connection:
+            self._connection.execute(
+                "UPDATE runs SET status = ?, error = ?, %s WHERE id = ?" % ", ".join(
+                    "%s = ?" % column for column in TIMING_COLUMNS),
+                ["failed" if error else "done", error] + [timings.get(column) for column in TIMING_COLUMNS] + [run_id])
+            self._connection.executemany("INSERT OR REPLACE INTO kpis VALUES (?, ?, ?)",
+                                         [(run_id, name, value) for name, value in sorted((kpis or {}).items())])
+            self._write_series()
+
+    def record_run(self, config, timings=None, kpis=None, error=None):
+        """Adds a finished run, e.g. one point of a sweep. Returns its id"""
+        run_id = self.start_run(config)
+        self.finish_run(run_id, timings, kpis, error)
+        return run_id
+
+    def add_series_row(self, run_id, junction, name, link, time, value):
+        """Buffers one value of a per junction series. link is the phase index of green times and phase choices and
+        the link index of queues and capacities"""
+        self._series_rows.append((run_id, junction, name, link, time, value))
+        if len(self._series_rows) >= self._batch_rows:
+            self.flush()
+
+    def flush(self):
+        if self._series_rows:
+            with self._connection:
+                self._write_series()
+
+    def _write_series(self):
+        self._connection.executemany("INSERT INTO junction_series VALUES (?, ?, ?, ?, ?, ?)", self._series_rows)
+        self._series_rows = []
+
+    # Queries
+    def get_runs(self, kpis=None, **filters):
+        """DataFrame of the runs whose columns equal the filters (e.g. queue_controller="LmaxQueueController"),
+        with a column for each KPI (all if kpis is None)"""
+        import pandas as pd
+        conditions = " AND ".join("runs.%s = ?" % column for column in sorted(filters)) or "1"
+        params = [filters[column] for column in sorted(filters)]
+        runs = pd.read_sql_query("SELECT * FROM runs WHERE %s ORDER BY id" % conditions, self._connection,
+                                 params=params).set_index("id")
+        values = pd.read_sql_query("SELECT kpis.run_id, kpis.name, kpis.value FROM kpis JOIN runs "
+                                   "ON runs.id = kpis.run_id WHERE %s" % conditions, self._connection, params=params)
+        if kpis is not None:
+            values = values[values["name"].isin(kpis)]
+        return runs.join(values.pivot(index="run_id", columns="name", values="value"))
+
+    def get_best_run(self, kpi, minimise=True, **filters):
+        """The run, as a row of get_runs, with the lowest (or highest) value of kpi among the filtered runs"""
+        runs = self.get_runs([kpi], **filters).dropna(subset=[kpi])
+        if not len(runs):
+            return None
+        return runs.loc[runs[kpi].idxmin() if minimise else runs[kpi].idxmax()]
+
+    def get_series(self, run_id, junction=None, name=None):
+        """DataFrame (junction, name, link, time, value) of the series of a run, ordered by time"""
+        import pandas as pd
+        conditions, params = ["run_id = ?"], [run_id]
+        for column, value in (("junction", junction), ("name", name)):
+            if value is not None:
+                conditions.append("%s = ?" % column)
+                params.append(value)
+        return pd.read_sql_query("SELECT junction, name, link, time, value FROM junction_series WHERE %s "
+                                 "ORDER BY time" % " AND ".join(conditions), self._connection, params=params)
+
+
+class StoreRecorder:
+
+    def __init__(self, store, run_id, junction_ids):
+        """ Records the same green times, phase choices, queues and capacities as recorder.OutputRecorder, as series
+        of a run in an ExperimentStore, so it can be set as the output recorder of the intersection controllers """
+        self._store = store
+        self._run_id = run_id
+        self._junction_ids = list(junction_ids)
+        self._junction_number = dict((junction_id, number) for number, junction_id in enumerate(junction_ids))
+
+    def get_junction_number(self, junction_id):
+        return self._junction_number[junction_id]
+
+    def record_green_time(self, step, junction_number, phase_index, green_time):
+        self._store.add_series_row(self._run_id, self._junction_ids[junction_number], "green_time", int(phase_index),
+                                   step, green_time)
+
+    def record_phase_change(self, step, junction_number, phase_index, green_time, queues, capacities):
+        junction = self._junction_ids[junction_number]
+        self._store.add_series_row(self._run_id, junction, "phase_choice", int(phase_index), step, green_time)
+        for link, queue in enumerate(queues):
+            self._store.add_series_row(self._run_id, junction, "queue", link, step, queue)
+        for link, capacity in enumerate(capacities):
+            self._store.add_series_row(self._run_id, junction, "capacity", link, step, capacity)
+
+    def flush(self):
+        self._store.flush()
@@ -1,18 +1,23 @@
 # -*- coding: UTF-8 -*-
+from __future__ import division
 import numpy as np
-from collections import defaultdict, Counter
+from collections import defaultdict, deque, Counter
 import traci
 import random
 import TLSlogic
+from profiling import StageTimer, STAGE_INDEX, export_profile
+from recorder import OutputRecorder
+from checkpoint import save_checkpoint, load_checkpoint
 
 class IntersectionController:
     def __init__(self, tls_id, inc_lanes_by_index, out_lanes_by_index, phase_matrix_by_link_index,
                  phase_strings, x_star, greenTimeController, queueController, link_index_to_turning_direction,
                  in_lane_and_out_lane_to_link_index,
-                 default_amber_phase_length = 5, sim_step_length = 0.1, time_window_for_mu_and_lambda = 600):
+                 default_amber_phase_length = 5, time_window_for_mu_and_lambda = 600):
         """ Class which controls the lights at each intersection. This class keps track of properties such as
         the time elapsed since the last phase. The algorithm for determining green times and queues will be defined
-        elsewhere and called by this function, in order to make it easy to switch algorithms """
+        elsewhere and called by this function, in order to make it easy to switch algorithms. All times and rates are
+        in simulated seconds, so the results do not depend on how often the controller is updated """
 
         # Static properties of the intersection
         self._id = tls_id
@@ -55,6 +60,7 @@ class IntersectionController:
 
         self._queue_lengths_by_link_index = [0] * self._num_queues  #  The queue length for each index
         self._capacities_by_link_index = [999] * self._num_queues  # The capacity of the links each queue wishes to join
+        self._outgoing_vehicles_by_link_index = [0] * self._num_queues  # Vehicles on the lane each queue wishes to join
 
         # Algorithms used for picking queues and calculating green time
         self._timerControl = greenTimeController
@@ -69,16 +75,19 @@ class IntersectionController:
 
         self._number_of_vehicles_to_remove_by_lane = defaultdict()
 
-        self._vehicles_leaving_lane_per_time_step = defaultdict(list)
-        self._vehicles_entering_lane_per_time_step = defaultdict(list)
-
         self._vehicles_at_start_of_timestep = defaultdict(list)
         self._vehicles_at_end_of_timestep = defaultdict(list)
 
-        # Model based controller values
-        self._sim_step_length = sim_step_length
+        # Model based controller values. mu and lambda are the rates (vehicles per second) at which vehicles leave and
+        # join each lane while it is open, over the last time_window_for_mu_and_lambda seconds of samples.
         self._time_window_for_mu_and_lambda = time_window_for_mu_and_lambda
-        self._step_window_for_mu_and_lambda = (1 / sim_step_length) * time_window_for_mu_and_lambda
+        self._update_interval = 0  # Simulated seconds since the previous update, the length of the next rate sample
+        self._lane_rate_samples = defaultdict(deque)  # lane -> (vehicles leaving, vehicles joining, seconds)
+        self._lane_rate_totals = {}  # lane -> [vehicles leaving, vehicles joining, seconds] summed over the samples
+        # In real-time runs the estimates may be left for a later update when a step runs late (see deadline.py),
+        # which then covers the time of the updates left out
+        self._defer_estimators = None
+        self._deferred_interval = 0
 
         self._mu = defaultdict(int)
         self._lambda = defaultdict(int)
@@ -90,9 +99,22 @@ class IntersectionController:
         # self._mu_G_year = mus[2]
         # self._lambda_G_year = lams[2]
 
-        # Output
+        # Output. Kept in memory by lane unless an output recorder is set, which writes it to disk in chunks.
         self._OUTPUT_green_time_change_step = defaultdict(list)
         self._OUTPUT_green_time_setting = defaultdict(list)
+        self._output_recorder = None
+        self._output_recorder_junction_number = None
+        self._phase_change_step = 0
+
+        # Per stage timers, only created when profiling is switched on
+        self._stage_timer = None
+
+        # Let the controllers precompute anything static about this intersection
+        for controller in (greenTimeController, queueController):
+            if hasattr(controller, "attach_intersection_controller"):
+                controller.attach_intersection_controller(self)
+        # Green time controllers that aggregate the mu and lambda estimates are told whenever an estimate changes
+        self._timer_tracks_lane_rates = hasattr(greenTimeController, "update_lane_rates")
 
     # Set property commands
     def set_queue_length_by_link_index(self, index, value):
@@ -104,7 +126,15 @@ class IntersectionController:
     def set_vehs_in_lane_at_end_of_step(self, lane, vehList):
         self._vehicles_at_end_of_timestep[lane] = vehList
 
+    def set_output_recorder(self, output_recorder):
+        self._output_recorder = output_recorder
+        self._output_recorder_junction_number = output_recorder.get_junction_number(self._id)
+
     def update_green_time_records_by_link_index(self, index, timeStep, Gt):
+        if self._output_recorder is not None:
+            self._output_recorder.record_green_time(timeStep, self._output_recorder_junction_number, index, Gt)
+            return
+
         lane = self.get_incoming_lane_from_index(index)
 
         self._OUTPUT_green_time_change_step[lane].append(timeStep)
@@ -156,16 +186,17 @@ class IntersectionController:
                 spaces_total = int(laneLength / (5 + (2 * 5) / 3))
             for index in self.get_indicies_of_outgoing_lane(lane):
                 self._capacities_by_link_index[index] = spaces_total - vehCount
+                self._outgoing_vehicles_by_link_index[index] = vehCount
 
-    def update_b_compare(self):
+    def update_b_compare(self, lanes=None):
 
-        """Updates the actual number of vehicles removed from the queue"""
+        """Updates the actual number of vehicles removed from the queue (of the open lanes unless lanes are given)"""
         # Identify only individual vehicles removed from the queue, that were there at the start
         # Compare the vehicles at the start to the vehicles at the end
 
         # Initialise a counter
 
-        for lane in self._current_open_lanes:
+        for lane in (self._current_open_lanes if lanes is None else lanes):
             # Get the final count (current vehicles in the lane)
             endCount = traci.lane.getLastStepVehicleIDs(lane)
             # Get the number of vehicles at the start of the green time
@@ -183,28 +214,43 @@ class IntersectionController:
                 if veh not in startCount:
                     lambda_per_step += 1
 
-            self._vehicles_leaving_lane_per_time_step[lane].append(b_per_step)
-            if len(self._vehicles_leaving_lane_per_time_step[lane]) > self._step_window_for_mu_and_lambda:
-                alpha_mu = self._vehicles_leaving_lane_per_time_step[lane].pop(0)
-                omega_mu = b_per_step
-                self._mu[lane] = self._mu[lane] + ((omega_mu - alpha_mu) / self._step_window_for_mu_and_lambda)
-            else:
-                self._mu[lane] = ((len(self._vehicles_leaving_lane_per_time_step[lane]) - 1) /
-                                  len(self._vehicles_leaving_lane_per_time_step[lane])) * self._mu[lane] \
-                                 + (1 / len(self._vehicles_leaving_lane_per_time_step[lane])) * b_per_step
-
-            self._vehicles_entering_lane_per_time_step[lane].append(lambda_per_step)
-            if len(self._vehicles_entering_lane_per_time_step) > self._step_window_for_mu_and_lambda:
-                alpha_lam = self._vehicles_entering_lane_per_time_step[lane].pop(0)
-                omega_lam = lambda_per_step
-                self._lambda[lane] = self._lambda[lane] + ((omega_lam - alpha_lam) / self._step_window_for_mu_and_lambda)
-            else:
-                self._lambda[lane] = ((len(self._vehicles_entering_lane_per_time_step[lane]) - 1) / len(self._vehicles_entering_lane_per_time_step[lane])) * \
-                                     self._lambda[lane] + 1 / len(self._vehicles_entering_lane_per_time_step[lane]) * lambda_per_step
+            old_mu = self._mu[lane]
+            old_lambda = self._lambda[lane]
+
+            # Add the sample, then drop the oldest samples for as long as the rest still cover the time window
+            samples = self._lane_rate_samples[lane]
+            totals = self._lane_rate_totals.setdefault(lane, [0, 0, 0.])
+            samples.append((b_per_step, lambda_per_step, self._update_interval))
+            totals[0] += b_per_step
+            totals[1] += lambda_per_step
+            totals[2] += self._update_interval
+            while len(samples) > 1 and totals[2] - samples[0][2] >= self._time_window_for_mu_and_lambda - 1e-9:
+                alpha_mu, alpha_lam, alpha_interval = samples.popleft()
+                totals[0] -= alpha_mu
+                totals[1] -= alpha_lam
+                totals[2] -= alpha_interval
+
+            if totals[2] > 0:
+                self._mu[lane] = totals[0] / totals[2]
+                self._lambda[lane] = totals[1] / totals[2]
+
+            if self._timer_tracks_lane_rates:
+                self._timerControl.update_lane_rates(self, lane, self._mu[lane] - old_mu, self._lambda[lane] - old_lambda)
 
             # Update the list of vehicles at the intersection to be compared next time.
             self._vehicles_at_start_of_timestep[lane] = endCount
 
+    def observe_lane_rates(self, step_length):
+        """Updates the mu and lambda estimates of the incoming lanes with a green link in the state SUMO shows now,
+        without controlling the lights. Seeds the estimates while another program, e.g. SUMO's static one, runs"""
+        self._update_interval = step_length
+        state = traci.trafficlights.getRedYellowGreenState(self._id)
+        green_lanes = set([lane for lane, light in zip(self._incoming_lanes_by_index, state) if light in "gG"])
+        self.update_b_compare(green_lanes)
+        for lane in self._incoming_lanes - green_lanes:
+            self._vehicles_at_start_of_timestep[lane] = traci.lane.getLastStepVehicleIDs(lane)
+        self.reset_b()
+
     def reset_b(self):
         self._vehicles_removed_value_for_green_time_calculation = 0
 
@@ -226,8 +272,12 @@ class IntersectionController:
         self._number_of_vehicles_to_remove_by_link_index = (map(lambda x: x * self._proportion_of_vehicles_to_remove, self.get_queues()))
         self._vehicles_to_remove_this_time_step_value_for_green_time_calculation = np.sum(np.multiply(self._number_of_vehicles_to_remove_by_link_index, self._current_open_queues))
 
-    def choose_queues_to_release(self):
-        self._current_phase_index = self._queueControl.best_queue_set(self)
+    def choose_queues_to_release(self, phase_index=None):
+        """Sets the phase to release next. The phase is picked by the queue controller unless it has already been
+        chosen for this intersection, e.g. by a batched call across the container"""
+        if phase_index is None:
+            phase_index = self._queueControl.best_queue_set(self)
+        self._current_phase_index = phase_index
         self._current_open_queues = self._phase_matrix_by_link_index[self._current_phase_index]
         self._current_open_indexes = np.nonzero(self._current_open_queues)[0]
         self._current_open_lanes = []
@@ -279,8 +329,150 @@ class IntersectionController:
     def send_tls_settings_to_sumo(self):
         traci.trafficlights.setRedYellowGreenState(self._id, self._current_phase_string)
 
+    # Profiling of the update stages
+    def enable_profiling(self):
+        self._stage_timer = StageTimer()
+
+    def disable_profiling(self):
+        self._stage_timer = None
+
+    def set_stage_timer(self, stage_timer):
+        """Times the stages with stage_timer, e.g. a deadline.DeadlineStageTimer, instead of a plain StageTimer"""
+        self._stage_timer = stage_timer
+
+    def get_stage_timer(self):
+        return self._stage_timer
+
+    def set_estimator_deferral(self, is_late):
+        """Leaves the mu and lambda updates of the green steps out while is_late() is true (None never does)"""
+        self._defer_estimators = is_late
+
+    def run_stage(self, stage, *args):
+        """Runs one stage of the update, timing it if profiling is on"""
+        if self._stage_timer is None:
+            return stage(*args)
+        return self._stage_timer.time_stage(STAGE_INDEX[stage.__name__], stage, *args)
+
+    # Phase change sequence, split in two so that the queue choice can be made for many intersections at once
+    def is_due_phase_change(self):
+        """True if the traffic light is in the green phase and the green timer has run out"""
+        return self._state and self._green_timer <= 0
+
+    def prepare_phase_change(self, step, step_length):
+        """Measures the intersection and updates the green time of the last phase, ready for a new phase to be chosen"""
+        self._phase_change_step = step
+        self._update_interval = step_length + self._deferred_interval
+        self._deferred_interval = 0
+        # Update the queue lengths at each link
+        self.run_stage(self.update_queues)
+        # Update the capacities of each exit lane
+        self.run_stage(self.update_capacities)
+        # Update the number of vehicles which were cleared during the last green phase
+        self.run_stage(self.update_b_compare)
+        # Update the green time for the links used in the last phase
+        self.run_stage(self.update_green_time, step)
+        # Update the time step when the phase was changed
+        # self._updateGtRecords_greenTime()
+        # self.updateGtRecords_changeStep(step)
+
+    def apply_phase_change(self, phase_index=None):
+        """Switches to the chosen phase (picked by the queue controller if not given) via an amber phase"""
+        # Update the queues to be set to green in the next phase
+        self.run_stage(self.choose_queues_to_release, phase_index)
+        # Update the target number of vehicles to be removed during the next phase
+        self.run_stage(self.update_a)
+
+        # Update the green timer according to the queues to be unlocked
+        self.set_green_timer()
+        # Update the green string according to the queue
+        self.set_green_string()
+
+        # Set queues for which the outgoing lane is congested to red (discontinued due to poor performance)
+        # self.setCongestedLanes2Red()   # Turned off the lane closing behaviour as it caused long queues at green lights
+
+        # Set the amber phase according to the next green phase
+        self.run_stage(self.set_amber_phase)
+
+        # Transmit the settings to SUMO
+        self.run_stage(self.send_tls_settings_to_sumo)
+
+        # Record the choice and the state it was made from
+        if self._output_recorder is not None:
+            self.record_phase_change()
+
+        # Set the state of the intersection to false, indicating the start of the amber phase
+        self.reset_b()
+        self._state = False
+
+    def record_phase_change(self):
+        self._output_recorder.record_phase_change(self._phase_change_step, self._output_recorder_junction_number,
+                                                  self._current_phase_index, self._green_timer,
+                                                  self._queue_lengths_by_link_index, self._capacities_by_link_index)
+
+    # Checkpoints of the dynamic state
+    def get_state(self):
+        """The dynamic state of the controller: phase, timers, green times, measurements and the mu and lambda
+        estimators, as plain values (see checkpoint.py)"""
+        lanes = sorted(self._incoming_lanes)
+        # The phase choice and the sum of vehicles to remove come from NumPy as NumPy scalars
+        return {"current_phase_index": np.asarray(self._current_phase_index).item(),
+                "green_timer": self._green_timer,
+                "amber_timer": self._amber_timer,
+                "state": self._state,
+                "update_interval": self._update_interval,
+                "deferred_interval": self._deferred_interval,
+                "phase_change_step": self._phase_change_step,
+                "vehicles_to_remove": np.asarray(
+                    self._vehicles_to_remove_this_time_step_value_for_green_time_calculation).item(),
+                "vehicles_removed": self._vehicles_removed_value_for_green_time_calculation,
+                "queue_green_times": list(self._queue_green_times),
+                "queue_lengths": list(self._queue_lengths_by_link_index),
+                "capacities": list(self._capacities_by_link_index),
+                "vehicles_to_remove_by_link_index": list(self._number_of_vehicles_to_remove_by_link_index),
+                "current_phase_string": self._current_phase_string,
+                "next_green_string": self._next_green_string,
+                "lanes": lanes,
+                "mu": dict((lane, self._mu[lane]) for lane in lanes),
+                "lambda": dict((lane, self._lambda[lane]) for lane in lanes),
+                "rate_totals": dict((lane, list(self._lane_rate_totals[lane]))
+                                    for lane in lanes if lane in self._lane_rate_totals),
+                "rate_samples": dict((lane, list(self._lane_rate_samples[lane])) for lane in lanes),
+                "vehicles_at_start": dict((lane, list(self._vehicles_at_start_of_timestep[lane])) for lane in lanes)}
+
+    def set_state(self, state):
+        """Restores a state from get_state, e.g. to resume a run from a checkpoint"""
+        self.choose_queues_to_release(state["current_phase_index"])
+        self._green_timer = state["green_timer"]
+        self._amber_timer = state["amber_timer"]
+        self._state = state["state"]
+        self._update_interval = state["update_interval"]
+        self._deferred_interval = state["deferred_interval"]
+        self._phase_change_step = state["phase_change_step"]
+        self._vehicles_to_remove_this_time_step_value_for_green_time_calculation = state["vehicles_to_remove"]
+        self._vehicles_removed_value_for_green_time_calculation = state["vehicles_removed"]
+        self._queue_green_times = list(state["queue_green_times"])
+        self._queue_lengths_by_link_index = list(state["queue_lengths"])
+        self._capacities_by_link_index = list(state["capacities"])
+        self._number_of_vehicles_to_remove_by_link_index = list(state["vehicles_to_remove_by_link_index"])
+        self._current_phase_string = state["current_phase_string"]
+        self._next_green_string = state["next_green_string"]
+
+        for lane in state["lanes"]:
+            self._mu[lane] = state["mu"][lane]
+            self._lambda[lane] = state["lambda"][lane]
+            if lane in state["rate_totals"]:
+                self._lane_rate_totals[lane] = list(state["rate_totals"][lane])
+            self._lane_rate_samples[lane] = deque(state["rate_samples"][lane])
+            self._vehicles_at_start_of_timestep[lane] = list(state["vehicles_at_start"][lane])
+
+        # Green time controllers that aggregate the estimates rebuild their sums from the restored ones
+        if hasattr(self._timerControl, "attach_intersection_controller"):
+            self._timerControl.attach_intersection_controller(self)
+
     # Main update function
     def update(self, step, step_length):
+        """Advances the lights by step_length simulated seconds, the time since the previous update"""
+        self._update_interval = step_length
 
         # If the traffic light is in an amber phase and amber timer has reached zero. Go into the green phase.
         if not (self._state) and self._amber_timer <= 0:
@@ -293,47 +485,20 @@ class IntersectionController:
             self._amber_timer -= step_length
         # Else if the traffic light is in the green phase and the green timer has reached zero. Update all variables
         # and calculate the new green time and phase. Then switch into the amber phase.
-        elif self._state and self._green_timer <= 0:
+        elif self.is_due_phase_change():
             # ORDER IS IMPORTANT IN THIS SECTION. DO NOT REORDER WITHOUT FULL UNDERSTANDING OF THE CHANGES TO OBJECT PROPERTIES.
-            # Update the queue lengths at each link
-            self.update_queues()
-            # Update the capacities of each exit lane
-            self.update_capacities()
-            # Update the number of vehicles which were cleared during the last green phase
-            self.update_b_compare()
-            # Update the green time for the links used in the last phase
-            self.update_green_time(step)
-            # Update the time step when the phase was changed
-            # self._updateGtRecords_greenTime()
-            # self.updateGtRecords_changeStep(step)
-
-            # Update the queues to be set to green in the next phase
-            self.choose_queues_to_release()
-            # Update the target number of vehicles to be removed during the next phase
-            self.update_a()
-
-            # Update the green timer according to the queues to be unlocked
-            self.set_green_timer()
-            # Update the green string according to the queue
-            self.set_green_string()
-
-            # Set queues for which the outgoing lane is congested to red (discontinued due to poor performance)
-            # self.setCongestedLanes2Red()   # Turned off the lane closing behaviour as it caused long queues at green lights
-
-            # Set the amber phase according to the next green phase
-            self.set_amber_phase()
-
-            # Transmit the settings to SUMO
-            self.send_tls_settings_to_sumo()
-
-            # Set the state of the intersection to false, indicating the start of the amber phase
-            self.reset_b()
-            self._state = False
+            self.prepare_phase_change(step, step_length)
+            self.apply_phase_change()
 
         # Else if the traffic light is in a green phase and the green timer is not finished, decrement the green timer
         elif self._state and self._green_timer > 0:
             self._green_timer -= step_length
-            self.update_b_compare()
+            if self._defer_estimators is not None and self._defer_estimators():
+                self._deferred_interval += step_length
+            else:
+                self._update_interval += self._deferred_interval
+                self._deferred_interval = 0
+                self.run_stage(self.update_b_compare)
         # Catch all to check for logical errors
         else:
             print("Something wrong in update phase logic")
@@ -345,6 +510,9 @@ class IntersectionController:
 
     # Get functions
 
+    def get_queue_controller(self):
+        return self._queueControl
+
     def get_num_queues(self):
         return self._num_queues
 
@@ -369,12 +537,19 @@ class IntersectionController:
             print("WARNING: retreiving object in memory may result in accidental altering of contents (capacities_by_link_index)")
             return self._capacities_by_link_index
 
+    def get_outgoing_vehicles(self):
+        """Vehicles on each link's outgoing lane, as measured by update_capacities"""
+        return self._outgoing_vehicles_by_link_index[:]
+
     def get_a_compare(self):
         return self._vehicles_to_remove_this_time_step_value_for_green_time_calculation
 
     def get_b_compare(self):
         return self._vehicles_removed_value_for_green_time_calculation
 
+    def get_current_phase_index(self):
+        return self._current_phase_index
+
     def get_current_green_time(self):
         return self._queue_green_times[self._current_phase_index]
 
@@ -467,8 +642,22 @@ class IntersectionControllerContainer:
         Provides methods for automatically creating the intersection objects from net file and updating them
         simultaneously during a simulation"""
 
-    def __init__(self):
+    def __init__(self, decision_interval=None):
         self._intersection_controller_container = defaultdict(IntersectionController)
+        self._batch_stage_timer = None  # Times the batched queue choices, which no single intersection owns
+        self._output_recorder = None
+
+        # Simulated seconds between controller updates, None to update with every simulation step
+        self._decision_interval = decision_interval
+        self._time_since_update = 0
+
+    def set_decision_interval(self, decision_interval):
+        """Updates the controllers every decision_interval simulated seconds (None for every simulation step),
+        independently of SUMO's step length. The lights are measured and switched only at these updates"""
+        self._decision_interval = decision_interval
+
+    def get_decision_interval(self):
+        return self._decision_interval
 
     def add_intersection_controller(self,
                                     tls_id, inc_lanes_by_index, out_lanes_by_index,
@@ -505,8 +694,144 @@ class IntersectionControllerContainer:
                                              green_time_controller, queue_controller, dirs, lane2index)
 
     def update_intersection_controllers(self, step, step_length):
+        """Updates every intersection. Intersections due a phase change whose queue controller provides
+        best_queue_sets have their next phases chosen together, in one call per queue controller. With a decision
+        interval, steps in between only add their step_length to the time passed on at the next update"""
+        self._time_since_update += step_length
+        if self._decision_interval is not None and self._time_since_update < self._decision_interval - 1e-9:
+            return
+        step_length = self._time_since_update
+        self._time_since_update = 0
+
+        due_by_queue_controller = defaultdict(list)
+        batched_queue_controllers = []
+
+        for intersection_controller in self._intersection_controller_container.itervalues():
+            queue_controller = intersection_controller.get_queue_controller()
+            if intersection_controller.is_due_phase_change() and hasattr(queue_controller, "best_queue_sets"):
+                intersection_controller.prepare_phase_change(step, step_length)
+                if queue_controller not in due_by_queue_controller:
+                    batched_queue_controllers.append(queue_controller)
+                due_by_queue_controller[queue_controller].append(intersection_controller)
+            else:
+                intersection_controller.update(step, step_length)
+
+        for queue_controller in batched_queue_controllers:
+            intersection_controllers = due_by_queue_controller[queue_controller]
+            if self._batch_stage_timer is None:
+                phase_indexes = queue_controller.best_queue_sets(intersection_controllers)
+            else:
+                phase_indexes = self._batch_stage_timer.time_stage(STAGE_INDEX["choose_queues_to_release"],
+                                                                   queue_controller.best_queue_sets,
+                                                                   intersection_controllers)
+            for intersection_controller, phase_index in zip(intersection_controllers, phase_indexes):
+                intersection_controller.apply_phase_change(phase_index)
+
+    def observe_intersection_controllers(self, step_length):
+        """Updates the mu and lambda estimates of every intersection from the lights SUMO shows, without controlling
+        them (see IntersectionController.observe_lane_rates)"""
+        for intersection_controller in self._intersection_controller_container.itervalues():
+            intersection_controller.observe_lane_rates(step_length)
+
+    def _get_random_states(self):
+        """The numpy RandomStates of the controllers, each once, in the order of the sorted tls ids"""
+        random_states = []
+        for tls_id in sorted(self._intersection_controller_container):
+            intersection_controller = self._intersection_controller_container[tls_id]
+            for controller in (intersection_controller._timerControl, intersection_controller.get_queue_controller()):
+                random_state = getattr(controller, "_random", None)
+                if isinstance(random_state, np.random.RandomState) and \
+                        not any(random_state is known for known in random_states):
+                    random_states.append(random_state)
+        return random_states
+
+    def save_checkpoint(self, filepath, step, **header):
+        """Writes the dynamic state of every intersection controller, the container's decision timing and the
+        random generators to a checkpoint at simulation time step. Further keyword values, e.g. the file of the
+        SUMO state saved at the same time, are stored in the checkpoint's header"""
+        states = [(tls_id, self._intersection_controller_container[tls_id].get_state())
+                  for tls_id in sorted(self._intersection_controller_container)]
+        header.update({"step": step, "time_since_update": self._time_since_update})
+        save_checkpoint(filepath, states, header, self._get_random_states())
+
+    def load_checkpoint(self, filepath):
+        """Restores a checkpoint of save_checkpoint into intersection controllers built from the same net file and
+        controllers. Returns the checkpoint's header, with the simulation time under 'step'"""
+        header, states = load_checkpoint(filepath, self._get_random_states())
+        if sorted(tls_id for tls_id, _ in states) != sorted(self._intersection_controller_container):
+            raise ValueError("Checkpoint %s is for different intersections" % filepath)
+        for tls_id, state in states:
+            self._intersection_controller_container[tls_id].set_state(state)
+        self._time_since_update = header["time_since_update"]
+        return header
+
+    def get_incoming_lanes(self):
+        """All lanes controlled by the intersection controllers"""
+        lanes = set()
+        for intersection_controller in self._intersection_controller_container.itervalues():
+            lanes.update(intersection_controller.get_incoming_lanes())
+        return lanes
+
+    def enable_output_recorder(self, directory, chunk_rows=65536, resume_step=None):
+        """Records green times, phase choices, queues and capacities of every intersection into chunked .npy
+        segments in directory, instead of keeping the green time history in memory. An earlier recording in
+        directory is replaced, unless this run resumes it from the checkpoint at resume_step"""
+        junction_ids = sorted(self._intersection_controller_container)
+        max_num_queues = max([intersection_controller.get_num_queues()
+                              for intersection_controller in self._intersection_controller_container.itervalues()] + [0])
+        return self.set_output_recorder(OutputRecorder(directory, junction_ids, max_num_queues, chunk_rows,
+                                                       resume_step))
+
+    def set_output_recorder(self, output_recorder):
+        """Records the output of every intersection with output_recorder, which provides the methods of
+        OutputRecorder (e.g. experiment_store.StoreRecorder)"""
+        self._output_recorder = output_recorder
+        for intersection_controller in self._intersection_controller_container.itervalues():
+            intersection_controller.set_output_recorder(self._output_recorder)
+        return self._output_recorder
+
+    def get_junction_ids(self):
+        return sorted(self._intersection_controller_container)
+
+    def get_output_recorder(self):
+        return self._output_recorder
+
+    def flush_output(self):
+        """Writes any recorded output still held in memory to disk"""
+        if self._output_recorder is not None:
+            self._output_recorder.flush()
+
+    def enable_profiling(self):
+        """Switches on the per stage timers of every intersection controller"""
+        for intersection_controller in self._intersection_controller_container.itervalues():
+            intersection_controller.enable_profiling()
+        self._batch_stage_timer = StageTimer()
+
+    def disable_profiling(self):
         for intersection_controller in self._intersection_controller_container.itervalues():
-            intersection_controller.update(step, step_length)
+            intersection_controller.disable_profiling()
+        self._batch_stage_timer = None
+
+    def enable_deadline_monitor(self, monitor, defer_estimators=False):
+        """Charges the stages of every intersection to the steps of a deadline.DeadlineMonitor. With
+        defer_estimators, the mu and lambda updates wait while the monitor says the step is late"""
+        for tls_id, intersection_controller in self._intersection_controller_container.iteritems():
+            intersection_controller.set_stage_timer(monitor.get_stage_timer(tls_id))
+            intersection_controller.set_estimator_deferral(monitor.is_late if defer_estimators else None)
+        self._batch_stage_timer = monitor.get_stage_timer("batched")
+
+    def get_stage_timers(self):
+        """Stage timers by tls id, plus the timer of the batched queue choices under 'batched'"""
+        stage_timers = dict((tls_id, intersection_controller.get_stage_timer())
+                            for tls_id, intersection_controller in self._intersection_controller_container.iteritems()
+                            if intersection_controller.get_stage_timer() is not None)
+        if self._batch_stage_timer is not None:
+            stage_timers["batched"] = self._batch_stage_timer
+        return stage_timers
+
+    def export_profile(self, filepath):
+        """Writes the stage timings of every intersection, and their totals, to a CSV or JSON file"""
+        export_profile(self.get_stage_timers(), filepath)
 
     def print_details(self, tls_id):
 
@@ -6,59 +6,182 @@
 
 Code to generate a routes file for the "simpleT" SUMO model.
 
+Departures are sampled with NumPy for all routes and a window of seconds at a time, then sorted by depart time and
+written in one buffered block per window, so large demand files are produced quickly and in flat memory.
+generate_flows writes the same demand as one <flow> per route and time slice instead, which SUMO expands itself.
 """
+from __future__ import print_function, division
+import argparse
+from collections import defaultdict
+import xml.etree.cElementTree as ET
+import numpy as np
 
-import random
-
-routes = open("grid.rou.xml", "w")
-print >> routes, """<routes>
+HEADER = """<routes>
 <vType id="typeCar" accel="0.8" decel="4.5" sigma="0.5" length="5" minGap="2.5" maxSpeed="25" guiShape="passenger"/>
 <vType id="typeBus" accel="0.8" decel="4.5" sigma="0.5" length="17" minGap="3" maxSpeed="25" guiShape="bus"/>
 
-<route id="bottom0totop0" edges="bottom0to0/0 0/0to0/1 0/1totop0" />
-<route id="bottom0totop1" edges="bottom0to0/0 0/0to1/0 1/0to1/1 1/1totop1" />
-<route id="bottom0toright1" edges="bottom0to0/0 0/0to1/0 1/0to1/1 1/1toright1" />
-<route id="left0toright1" edges="left0to0/0 0/0to1/0 1/0to1/1 1/1toright1" />
-<route id="top0toright0" edges="top0to0/1 0/1to1/1 1/1to1/0 1/0toright0" />
-<route id="top1toleft1" edges="top1to1/1 1/1to0/1 0/1toleft1" />
 """
 
-N = 9000
-peS = 1./30
-peW = 1./10
-pwS = 1./30
-pwE = 1./10
-psE = 1./50
-psW = 1./50
-
-lastVeh = 0
-vehNr = 0
-for i in range(N):
-	if random.uniform(0,1) < peS:
-	    print >> routes, '    <vehicle id="%i" type="typeCar" route="bottom0totop0" depart="%i" />' % (vehNr, i)
-	    vehNr += 1
-	    lastVeh = i
-	if random.uniform(0,1) < peW:
-	    print >> routes, '    <vehicle id="%i" type="typeCar" route="bottom0totop1" depart="%i" />' % (vehNr, i)
-	    vehNr += 1
-	    lastVeh = i
-	if random.uniform(0,1) < pwS:
-	    print >> routes, '    <vehicle id="%i" type="typeCar" route="bottom0toright1" depart="%i" />' % (vehNr, i)
-	    vehNr += 1
-	    lastVeh = i
-	if random.uniform(0,1) < pwE:
-	    print >> routes, '    <vehicle id="%i" type="typeCar" route="left0toright1" depart="%i" />' % (vehNr, i)
-	    vehNr += 1
-	    lastVeh = i
-	if random.uniform(0,1) < psE:
-	    print >> routes, '    <vehicle id="%i" type="typeCar" route="top0toright0" depart="%i" />' % (vehNr, i)
-	    vehNr += 1
-	    lastVeh = i
-	if random.uniform(0,1) < psW:
-	    print >> routes, '    <vehicle id="%i" type="typeCar" route="top1toleft1" depart="%i" />' % (vehNr, i)
-	    vehNr += 1
-	    lastVeh = i
-
-print >> routes, "</routes>"
-routes.close()
+# (route id, edges, probability of a departure each second)
+ROUTES = [("bottom0totop0", "bottom0to0/0 0/0to0/1 0/1totop0", 1./30),
+          ("bottom0totop1", "bottom0to0/0 0/0to1/0 1/0to1/1 1/1totop1", 1./10),
+          ("bottom0toright1", "bottom0to0/0 0/0to1/0 1/0to1/1 1/1toright1", 1./30),
+          ("left0toright1", "left0to0/0 0/0to1/0 1/0to1/1 1/1toright1", 1./10),
+          ("top0toright0", "top0to0/1 0/1to1/1 1/1to1/0 1/0toright0", 1./50),
+          ("top1toleft1", "top1to1/1 1/1to0/1 0/1toleft1", 1./50)]
+
+
+def sample_departures(rng, start, num_seconds, probabilities, distribution="bernoulli"):
+    """Returns the depart times and route numbers of the vehicles departing in [start, start + num_seconds), sorted
+    by depart time. 'bernoulli' gives at most one vehicle per route and second, departing on the second (the
+    original model); 'poisson' gives Poisson counts per second with uniformly spread depart times"""
+    if distribution == "bernoulli":
+        # np.nonzero returns the hits ordered by second, then by route
+        seconds, route_numbers = np.nonzero(rng.random_sample((num_seconds, len(probabilities))) < probabilities)
+        return start + seconds, route_numbers
+    elif distribution == "poisson":
+        counts = rng.poisson(probabilities, (num_seconds, len(probabilities)))
+        seconds, route_numbers = np.nonzero(counts)
+        repeats = counts[seconds, route_numbers]
+        departs = start + np.repeat(seconds, repeats) + rng.random_sample(np.sum(repeats))
+        route_numbers = np.repeat(route_numbers, repeats)
+        order = np.argsort(departs, kind="mergesort")
+        return departs[order], route_numbers[order]
+    raise ValueError("Unknown distribution %s" % distribution)
+
+
+def generate_routes(filepath, duration=9000, routes=ROUTES, seed=None, distribution="bernoulli", window=3600,
+                    vehicle_type="typeCar"):
+    """Writes a routes file with the vehicles departing over duration seconds. Returns the number of vehicles"""
+    rng = np.random.RandomState(seed)
+    route_ids = [route_id for route_id, _, _ in routes]
+    probabilities = np.array([probability for _, _, probability in routes])
+    template = '    <vehicle id="%%i" type="%s" route="%%s" depart="%s" />\n' % (
+        vehicle_type, "%i" if distribution == "bernoulli" else "%.2f")
+
+    vehNr = 0
+    with open(filepath, "w") as output:
+        output.write(HEADER)
+        for route_id, edges, _ in routes:
+            output.write('<route id="%s" edges="%s" />\n' % (route_id, edges))
+        output.write("\n")
+
+        for start in range(0, duration, window):
+            departs, route_numbers = sample_departures(rng, start, min(window, duration - start), probabilities,
+                                                       distribution)
+            output.write("".join([template % (vehNr + ii, route_ids[route_number], depart)
+                                  for ii, (depart, route_number) in enumerate(zip(departs.tolist(), route_numbers.tolist()))]))
+            vehNr += len(departs)
+
+        output.write("</routes>\n")
+
+    return vehNr
+
+
+def generate_flows(filepath, duration=9000, routes=ROUTES, interval=900, mode="probability", profile=None,
+                   vehicle_type="typeCar"):
+    """Writes the demand of generate_routes as flows, one per route and interval of interval seconds. With mode
+    'probability' a vehicle departs each second with the route's probability, the same Bernoulli process as the
+    per vehicle file; with 'period' vehicles depart at the mean headway 1 / probability. profile optionally holds a
+    factor per interval applied to all rates, for demand that changes over the run. Returns the number of flows"""
+    if mode not in ("probability", "period"):
+        raise ValueError("Unknown flow mode %s" % mode)
+
+    with open(filepath, "w") as output:
+        output.write(HEADER)
+        for route_id, edges, _ in routes:
+            output.write('<route id="%s" edges="%s" />\n' % (route_id, edges))
+        output.write("\n")
+
+        lines = []
+        for slice_number, begin in enumerate(range(0, duration, interval)):
+            end = min(begin + interval, duration)
+            factor = profile[slice_number % len(profile)] if profile else 1.
+            for route_id, _, probability in routes:
+                rate = probability * factor
+                if rate <= 0:
+                    continue
+                if mode == "probability":
+                    if rate > 1:
+                        raise ValueError("Rate %g of route %s exceeds one vehicle per second, use mode 'period'" %
+                                         (rate, route_id))
+                    value = 'probability="%.6g"' % rate
+                else:
+                    value = 'period="%.6g"' % (1. / rate)
+                lines.append('    <flow id="%s.%i" type="%s" route="%s" begin="%i" end="%i" %s />\n' %
+                             (route_id, slice_number, vehicle_type, route_id, begin, end, value))
+        output.write("".join(lines))
+        output.write("</routes>\n")
+
+    return len(lines)
+
+
+def compare_arrival_rates(vehicle_filepath, flow_filepath):
+    """Statistical check that a per vehicle file and a flow file describe the same demand. The vehicles of each
+    flow's route departing within the flow's interval are counted and compared with the flow's expected count.
+    Returns rows (flow id, observed, expected, z) where z is the deviation in standard deviations of the binomial
+    count of a probability flow (Poisson for a period flow), and the chi-square sum of z^2 over all flows"""
+    flows = []
+    for _, element in ET.iterparse(flow_filepath):
+        if element.tag == "flow":
+            begin, end = float(element.get("begin")), float(element.get("end"))
+            if element.get("probability") is not None:
+                probability = float(element.get("probability"))
+                expected = probability * (end - begin)
+                variance = expected * (1 - probability)
+            else:
+                expected = (end - begin) / float(element.get("period"))
+                variance = expected
+            flows.append((element.get("id"), element.get("route"), begin, end, expected, variance))
+            element.clear()
+
+    departs_by_route = defaultdict(list)
+    for _, element in ET.iterparse(vehicle_filepath):
+        if element.tag == "vehicle":
+            departs_by_route[element.get("route")].append(float(element.get("depart")))
+            element.clear()
+    departs_by_route = dict((route, np.sort(departs)) for route, departs in departs_by_route.items())
+
+    rows = []
+    for flow_id, route, begin, end, expected, variance in flows:
+        departs = departs_by_route.get(route, np.zeros(0))
+        observed = int(np.searchsorted(departs, end, "left") - np.searchsorted(departs, begin, "left"))
+        rows.append((flow_id, observed, expected, (observed - expected) / np.sqrt(max(variance, 1e-12))))
+    return rows, sum(z ** 2 for _, _, _, z in rows)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Generate a routes file for the grid model")
+    parser.add_argument("-o", "--output", default="grid.rou.xml")
+    parser.add_argument("-n", "--duration", type=int, default=9000, help="seconds of demand")
+    parser.add_argument("-s", "--seed", type=int, default=None)
+    parser.add_argument("-d", "--distribution", choices=("bernoulli", "poisson"), default="bernoulli")
+    parser.add_argument("-x", "--scale", type=float, default=1.0, help="factor applied to every route's rate")
+    parser.add_argument("-r", "--rate", action="append", default=[], metavar="ROUTE=PROBABILITY",
+                        help="departure probability per second of one route, may be repeated")
+    parser.add_argument("-f", "--flows", choices=("probability", "period"), default=None,
+                        help="write <flow> definitions instead of individual vehicles")
+    parser.add_argument("-i", "--interval", type=int, default=900, help="seconds per flow interval")
+    parser.add_argument("-p", "--profile", default=None, help="comma separated rate factors per flow interval")
+    parser.add_argument("-c", "--check", default=None, metavar="VEHICLE_FILE",
+                        help="compare the arrival rates of the flow output with a per vehicle file")
+    options = parser.parse_args()
+
+    rates = dict((route_id, float(rate)) for route_id, rate in (entry.split("=") for entry in options.rate))
+    routes = [(route_id, edges, rates.get(route_id, probability) * options.scale)
+              for route_id, edges, probability in ROUTES]
+
+    if options.flows is None:
+        number = generate_routes(options.output, options.duration, routes, options.seed, options.distribution)
+        print("Wrote %d vehicles to %s" % (number, options.output))
+    else:
+        profile = [float(factor) for factor in options.profile.split(",")] if options.profile else None
+        number = generate_flows(options.output, options.duration, routes, options.interval, options.flows, profile)
+        print("Wrote %d flows to %s" % (number, options.output))
 
+        if options.check is not None:
+            rows, chi_square = compare_arrival_rates(options.check, options.output)
+            for flow_id, observed, expected, z in rows:
+                print("%-20s observed %6d expected %9.1f z %6.2f" % (flow_id, observed, expected, z))
+            print("chi-square %.1f with %d flows" % (chi_square, len(rows)))
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division
+import os
+import sys
+import json
+import xml.etree.cElementTree as ET
+import numpy as np
+from recorder import ChunkedTable
+
+# Columns of the tables written by convert_netstate_dump, each stored with the smallest type that holds its range:
+# times exactly in float64, lane and vehicle numbers and counts in int32, positions and speeds in float32. 24 bytes a
+# row, against 20 for all float32 (which rounds times past about 10^5 s and merges vehicle numbers past 2^24)
+LANE_COLUMNS = ("time", "lane", "vehicles", "halting", "mean_speed")
+VEHICLE_COLUMNS = ("time", "vehicle", "lane", "pos", "speed")
+LANE_DTYPE = np.dtype(list(zip(LANE_COLUMNS, ("f8", "i4", "i4", "i4", "f4"))))
+VEHICLE_DTYPE = np.dtype(list(zip(VEHICLE_COLUMNS, ("f8", "i4", "i4", "f4", "f4"))))
+
+
+def _as_rows(records):
+    """Float rows, one column per field, of records read from a table"""
+    return np.column_stack([records[name].astype(float) for name in records.dtype.names]) if len(records) else \
+        np.zeros((0, len(records.dtype.names)))
+
+
+def convert_netstate_dump(dump_filepath, directory, chunk_rows=1 << 20, halting_speed=0.1):
+    """Converts a SUMO netstate dump (e.g. the acosta_dump.xml written by main_v2.py) in one streaming pass into a
+    per lane and a per vehicle time series. Rows (see LANE_DTYPE and VEHICLE_DTYPE) are written in chunks of
+    chunk_rows as uncompressed .npy segments, so memory use is bounded by the chunk size and the id tables, and the
+    segments can be memory mapped later. Lanes and vehicles are stored by number; the ids are saved in index.json.
+    Converting into a directory again replaces the earlier series"""
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    lanes = ChunkedTable(directory, "lanes", len(LANE_COLUMNS), chunk_rows, LANE_DTYPE)
+    vehicles = ChunkedTable(directory, "vehicles", len(VEHICLE_COLUMNS), chunk_rows, VEHICLE_DTYPE)
+    lane_numbers = {}
+    vehicle_numbers = {}
+
+    time = 0.
+    context = ET.iterparse(dump_filepath, events=("start", "end"))
+    _, root = next(context)
+
+    for event, element in context:
+        if event == "start":
+            if element.tag == "timestep":
+                time = float(element.get("time"))
+            continue
+
+        if element.tag == "lane":
+            lane_number = lane_numbers.setdefault(element.get("id"), len(lane_numbers))
+            speeds = []
+            for vehicle in element.iter("vehicle"):
+                speed = float(vehicle.get("speed"))
+                speeds.append(speed)
+                vehicles.append((time, vehicle_numbers.setdefault(vehicle.get("id"), len(vehicle_numbers)),
+                                 lane_number, float(vehicle.get("pos")), speed))
+            lanes.append((time, lane_number, len(speeds), sum(1 for speed in speeds if speed < halting_speed),
+                          sum(speeds) / len(speeds) if speeds else np.nan))
+            element.clear()
+        elif element.tag == "timestep":
+            root.clear()
+
+    lanes.flush()
+    vehicles.flush()
+
+    with open(os.path.join(directory, "index.json"), "w") as index_file:
+        json.dump({"lanes": sorted(lane_numbers, key=lane_numbers.get),
+                   "vehicles": sorted(vehicle_numbers, key=vehicle_numbers.get)}, index_file)
+
+    return NetstateSeries(directory)
+
+
+class NetstateSeries:
+
+    def __init__(self, directory):
+        """ Time range queries on a netstate dump converted by convert_netstate_dump. Only the segments that overlap
+        the requested times are read, through memory maps """
+        with open(os.path.join(directory, "index.json")) as index_file:
+            index = json.load(index_file)
+        self._lane_ids = index["lanes"]
+        self._vehicle_ids = index["vehicles"]
+        self._lane_numbers = dict((lane, number) for number, lane in enumerate(self._lane_ids))
+        self._vehicle_numbers = dict((vehicle, number) for number, vehicle in enumerate(self._vehicle_ids))
+
+        self._lanes = ChunkedTable(directory, "lanes", len(LANE_COLUMNS), 1, LANE_DTYPE, "r")
+        self._vehicles = ChunkedTable(directory, "vehicles", len(VEHICLE_COLUMNS), 1, VEHICLE_DTYPE, "r")
+
+    def get_lane_ids(self):
+        return self._lane_ids[:]
+
+    def get_vehicle_ids(self):
+        return self._vehicle_ids[:]
+
+    def get_lane_rows(self, lane_ids=None, begin=None, end=None):
+        """Rows (see LANE_COLUMNS) of the given lanes (all if None) with begin <= time < end"""
+        rows = _as_rows(self._lanes.load_range(begin, end))
+        if lane_ids is not None:
+            rows = rows[np.in1d(rows[:, 1], [self._lane_numbers[lane] for lane in lane_ids])]
+        return rows
+
+    def get_vehicle_rows(self, vehicle_ids=None, begin=None, end=None):
+        """Rows (see VEHICLE_COLUMNS) of the given vehicles (all if None) with begin <= time < end"""
+        rows = _as_rows(self._vehicles.load_range(begin, end))
+        if vehicle_ids is not None:
+            rows = rows[np.in1d(rows[:, 1], [self._vehicle_numbers[vehicle] for vehicle in vehicle_ids])]
+        return rows
+
+    def get_lane_matrix(self, lane_ids, column="vehicles", begin=None, end=None):
+        """Returns the times and a (time x lane) matrix of one lane column, e.g. the queue evolution of the incoming
+        lanes of a junction. Lanes without a row at a time (the dump omits empty lanes) are 0"""
+        rows = self.get_lane_rows(lane_ids, begin, end)
+        times, time_index = np.unique(rows[:, 0], return_inverse=True)
+        lane_index = dict((self._lane_numbers[lane], index) for index, lane in enumerate(lane_ids))
+
+        matrix = np.zeros((len(times), len(lane_ids)))
+        matrix[time_index, [lane_index[int(lane)] for lane in rows[:, 1]]] = rows[:, LANE_COLUMNS.index(column)]
+        return times, matrix
+
+
+if __name__ == "__main__":
+
+    dump_filepath = sys.argv[1] if len(sys.argv) > 1 else "acosta_dump.xml"
+    directory = sys.argv[2] if len(sys.argv) > 2 else dump_filepath + ".series"
+
+    series = convert_netstate_dump(dump_filepath, directory)
+    print("Converted %s into %s: %d lanes, %d vehicles" % (dump_filepath, directory,
+                                                            len(series.get_lane_ids()), len(series.get_vehicle_ids())))
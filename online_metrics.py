@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division
+import json
+import numpy as np
+import traci
+import traci.constants as tc
+from tripinfo import RunningStatistics
+
+_LANE_VARIABLES = (tc.LAST_STEP_VEHICLE_NUMBER, tc.LAST_STEP_VEHICLE_HALTING_NUMBER, tc.LAST_STEP_VEHICLE_ID_LIST)
+
+
+class OnlineMetrics:
+
+    def __init__(self, lanes, step_length):
+        """ Aggregates the KPIs of a run while it is simulated, so that no tripinfo output needs to be written and
+        parsed afterwards. Per lane: mean and max queue (vehicles), waiting time (halting vehicle seconds),
+        throughput (vehicles leaving the lane) and delay (seconds each vehicle spent on the lane beyond its free flow
+        travel time, summed and per vehicle). Per trip: travel time, from the departed and arrived vehicle lists.
+        The lane values arrive with every simulation step through lane subscriptions """
+        self._lanes = sorted(lanes)
+        self._step_length = step_length
+
+        self._steps = 0
+        self._queue_sum = np.zeros(len(self._lanes))
+        self._queue_max = np.zeros(len(self._lanes))
+        self._waiting_time = np.zeros(len(self._lanes))
+        self._throughput = np.zeros(len(self._lanes), dtype=int)
+        self._delay = np.zeros(len(self._lanes))
+        self._free_flow_time = np.zeros(len(self._lanes))
+        self._vehicles_on_lane = [{} for _ in self._lanes]  # Vehicle id -> time it was first seen on the lane
+
+        self._depart_time = {}  # Only vehicles currently in the network
+        self._departed = 0
+        self._travel_time = RunningStatistics()
+
+    def subscribe(self):
+        for index, lane in enumerate(self._lanes):
+            traci.lane.subscribe(lane, _LANE_VARIABLES)
+            self._free_flow_time[index] = traci.lane.getLength(lane) / traci.lane.getMaxSpeed(lane)
+
+    def update(self, time):
+        """Adds the state after the last simulation step, at the given simulation time in s"""
+        self._steps += 1
+
+        for veh_id in traci.simulation.getDepartedIDList():
+            self._depart_time[veh_id] = time
+            self._departed += 1
+        for veh_id in traci.simulation.getArrivedIDList():
+            depart_time = self._depart_time.pop(veh_id, None)
+            if depart_time is not None:
+                self._travel_time.add(time - depart_time)
+
+        queues = np.zeros(len(self._lanes))
+        halting = np.zeros(len(self._lanes))
+        for index, lane in enumerate(self._lanes):
+            results = traci.lane.getSubscriptionResults(lane) or {}
+            queues[index] = results.get(tc.LAST_STEP_VEHICLE_NUMBER, 0)
+            halting[index] = results.get(tc.LAST_STEP_VEHICLE_HALTING_NUMBER, 0)
+
+            vehicles = set(results.get(tc.LAST_STEP_VEHICLE_ID_LIST, ()))
+            entry_times = self._vehicles_on_lane[index]
+            for veh_id in [veh_id for veh_id in entry_times if veh_id not in vehicles]:
+                self._throughput[index] += 1
+                self._delay[index] += max(0., time - entry_times.pop(veh_id) - self._free_flow_time[index])
+            for veh_id in vehicles:
+                entry_times.setdefault(veh_id, time)
+
+        self._queue_sum += queues
+        np.maximum(self._queue_max, queues, out=self._queue_max)
+        self._waiting_time += halting * self._step_length
+
+    def get_summary(self):
+        steps = max(self._steps, 1)
+        return {"steps": self._steps,
+                "departed": self._departed,
+                "arrived": self._travel_time.get_count(),
+                "running": len(self._depart_time),
+                "meanTravelTime": self._travel_time.get_mean(),
+                "travelTimeQuantiles": dict((str(q), self._travel_time.get_quantile(q)) for q in (0.5, 0.9, 0.99)),
+                "totalWaitingTime": float(np.sum(self._waiting_time)),
+                "totalDelay": float(np.sum(self._delay)),
+                "lanes": self._lanes,
+                "meanQueue": list(self._queue_sum / steps),
+                "maxQueue": list(self._queue_max),
+                "waitingTime": list(self._waiting_time),
+                "throughput": [int(count) for count in self._throughput],
+                "delay": list(self._delay),
+                "meanDelay": list(self._delay / np.maximum(self._throughput, 1))}
+
+    def write_summary(self, filepath):
+        with open(filepath, "w") as output:
+            json.dump(self.get_summary(), output)
@@ -2,6 +2,8 @@
 import xml.etree.cElementTree as ET
 import numpy as np
 import pandas as pd
+from tripinfo import load_tripinfo_columns
+from experiment_store import ExperimentStore
 
 def parseXML2object(filepath):
     parsedFile = ET.parse(filepath)
@@ -18,30 +20,48 @@ def combineChildrenAttributeValuesInADicionary(root, *args):
     return dict
 
 def meanWaitSteps(results_Filepath, step_size):
-    root = parseXML2object(results_Filepath)
-    dict = combineChildrenAttributeValuesInADicionary(root, "waitSteps")
-    waitSteps = map(int, dict["waitSteps"])
-    waitTime = map(lambda x : x*step_size, waitSteps)
-    return np.mean(waitTime)
+    waitSteps = load_tripinfo_columns(results_Filepath, ["waitSteps"])["waitSteps"]
+    return np.mean(waitSteps)*step_size
     
 def meanDepartDelay(results_Filepath):
-    root = parseXML2object(results_Filepath)
-    dict = combineChildrenAttributeValuesInADicionary(root, "departDelay")
-    departDelay = map(float, dict["departDelay"])
+    departDelay = load_tripinfo_columns(results_Filepath, ["departDelay"])["departDelay"]
     return np.mean(departDelay)
 
+def quantilesWaitSteps(results_Filepath, step_size, quantiles=(0.5, 0.9, 0.99)):
+    waitSteps = load_tripinfo_columns(results_Filepath, ["waitSteps"])["waitSteps"]
+    return np.percentile(waitSteps, [100*q for q in quantiles])*step_size
+
+def meanDuration(results_Filepath):
+    duration = load_tripinfo_columns(results_Filepath, ["duration"])["duration"]
+    return np.mean(duration)
+
+def runsFromStore(store_Filepath, kpis=None, **filters):
+    store = ExperimentStore(store_Filepath)
+    try:
+        return store.get_runs(kpis, **filters)
+    finally:
+        store.close()
+
+def bestRunFromStore(store_Filepath, kpi, minimise=True, **filters):
+    store = ExperimentStore(store_Filepath)
+    try:
+        return store.get_best_run(kpi, minimise, **filters)
+    finally:
+        store.close()
+
+def seriesFromStore(store_Filepath, run_id, junction=None, name=None):
+    store = ExperimentStore(store_Filepath)
+    try:
+        return store.get_series(run_id, junction, name)
+    finally:
+        store.close()
+
 if __name__ == "__main__":
     
     step_size = 0.1
     
     results_Filepath = "tripsoutput.xml"
-    root = parseXML2object(results_Filepath)
-    
-    dict = combineChildrenAttributeValuesInADicionary(root, "id", "waitSteps", "duration", "departDelay")
-    
-    waitSteps = map(int, dict["waitSteps"])
-    waitTime = map(lambda x : x*step_size, waitSteps)
-    
-    print(np.mean(waitTime))
-    
-    
\ No newline at end of file
+
+    print(meanWaitSteps(results_Filepath, step_size))
+    print("Wait time quantiles (50%%, 90%%, 99%%): %s" % list(quantilesWaitSteps(results_Filepath, step_size)))
+    print("Mean duration %.2f, mean depart delay %.2f" % (meanDuration(results_Filepath), meanDepartDelay(results_Filepath)))
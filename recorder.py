@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division
+import os
+import glob
+import json
+import numpy as np
+
+
+class ChunkedTable:
+
+    def __init__(self, directory, name, num_columns, chunk_rows=65536, dtype=np.float64, mode="w"):
+        """ Append only table of fixed width float rows. Rows are written into a preallocated chunk, which is saved
+        as the next .npy segment in directory whenever it fills, so memory use does not grow with the run. dtype may
+        also be a structured dtype with a field per column, the time first, so that each column takes only the
+        bytes its range needs; rows are then records. As with files, mode "w" starts a new table, deleting the
+        table's segments left in directory, "a" appends after them and "r" only reads them """
+        if mode not in ("w", "a", "r"):
+            raise ValueError("Unknown table mode %r" % mode)
+        self._directory = directory
+        self._name = name
+        self._mode = mode
+        dtype = np.dtype(dtype)
+        self._records = dtype.names is not None
+        if self._records:
+            self._chunk = np.zeros(chunk_rows, dtype=dtype)
+        else:
+            self._chunk = np.full((chunk_rows, num_columns), np.nan, dtype=dtype)
+        self._rows_in_chunk = 0
+        if mode == "w":
+            for path in self.get_segment_paths():
+                os.remove(path)
+        self._segments_written = self._next_segment_number()
+
+    def _times(self, rows):
+        """The first column of rows"""
+        return rows[rows.dtype.names[0]] if self._records else rows[:, 0]
+
+    def _empty(self):
+        return self._chunk[:0].copy()
+
+    def _next_segment_number(self):
+        paths = self.get_segment_paths()
+        return int(os.path.splitext(paths[-1])[0].rsplit("_", 1)[1]) + 1 if paths else 0
+
+    def truncate(self, end):
+        """Drops the written rows whose first column (the time) is later than end, e.g. the rows a crashed run
+        recorded after the checkpoint it is resumed from, so that appended rows keep the times increasing. Cut
+        segments are rewritten under a temporary name and renamed, so a crash meanwhile loses no kept rows"""
+        if self._mode == "r":
+            raise IOError("Table %s was opened for reading" % self._name)
+        self.flush()
+        for path in self.get_segment_paths():
+            segment = np.load(path)
+            later = self._times(segment) > end
+            if not np.any(later):
+                continue
+            if np.all(later):
+                os.remove(path)
+            else:
+                temporary_path = path + ".tmp"  # Not matched by get_segment_paths
+                with open(temporary_path, "wb") as temporary_file:
+                    np.save(temporary_file, segment[~later])
+                os.rename(temporary_path, path)
+        self._segments_written = self._next_segment_number()
+
+    def append(self, row):
+        if self._mode == "r":
+            raise IOError("Table %s was opened for reading" % self._name)
+        if self._records:
+            self._chunk[self._rows_in_chunk] = tuple(row)
+        else:
+            self._chunk[self._rows_in_chunk, :len(row)] = row
+        self._rows_in_chunk += 1
+        if self._rows_in_chunk == len(self._chunk):
+            self.flush()
+
+    def flush(self):
+        """Writes the rows held in memory as a new segment"""
+        if not self._rows_in_chunk:
+            return
+        np.save(os.path.join(self._directory, "%s_%05d.npy" % (self._name, self._segments_written)),
+                self._chunk[:self._rows_in_chunk])
+        self._segments_written += 1
+        if not self._records:
+            self._chunk[:] = np.nan
+        self._rows_in_chunk = 0
+
+    def get_segment_paths(self):
+        return sorted(glob.glob(os.path.join(self._directory, "%s_[0-9]*.npy" % self._name)))
+
+    def get_segments(self):
+        """Returns the segments written so far as memory maps, followed by the rows still held in memory"""
+        segments = [np.load(path, mmap_mode="r") for path in self.get_segment_paths()]
+        if self._rows_in_chunk:
+            segments.append(self._chunk[:self._rows_in_chunk])
+        return segments
+
+    def load(self):
+        """Returns every row written so far, read into one array in memory. Use get_segments or load_range to
+        read large tables piece by piece"""
+        segments = self.get_segments()
+        if not segments:
+            return self._empty()
+        return np.concatenate(segments)
+
+    def load_range(self, begin=None, end=None):
+        """Returns the rows with begin <= first column < end, for tables whose first column (the time) never
+        decreases. Only the segments overlapping the range are read, through memory maps"""
+        begin = -np.inf if begin is None else begin
+        end = np.inf if end is None else end
+
+        rows = []
+        for segment in self.get_segments():
+            times = self._times(segment)
+            if not len(segment) or times[-1] < begin or times[0] >= end:
+                continue
+            rows.append(segment[np.searchsorted(times, begin, "left"):np.searchsorted(times, end, "left")])
+        if not rows:
+            return self._empty()
+        return np.concatenate(rows)
+
+
+class OutputRecorder:
+
+    def __init__(self, directory, junction_ids, max_num_queues, chunk_rows=65536, resume_step=None):
+        """ Records the green times, phase choices, queue vectors and capacities of every intersection into chunked
+        tables in directory. Junctions are stored by their position in junction_ids, queue and capacity rows are
+        padded with NaN to the widest junction. The junction order is saved in index.json. A recording replaces
+        the tables of an earlier one in directory, unless it continues a run resumed from the checkpoint at
+        resume_step: the earlier rows up to that step are kept and the rows after it dropped """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._junction_number = dict((junction_id, number) for number, junction_id in enumerate(junction_ids))
+
+        with open(os.path.join(directory, "index.json"), "w") as index_file:
+            json.dump({"junctions": list(junction_ids), "max_num_queues": max_num_queues}, index_file)
+
+        mode = "w" if resume_step is None else "a"
+        # Columns: step, junction, phase index, green time
+        self._green_times = ChunkedTable(directory, "green_times", 4, chunk_rows, mode=mode)
+        self._phase_choices = ChunkedTable(directory, "phase_choices", 4, chunk_rows, mode=mode)
+        # Columns: step, junction, value of every link index
+        self._queues = ChunkedTable(directory, "queues", 2 + max_num_queues, chunk_rows, mode=mode)
+        self._capacities = ChunkedTable(directory, "capacities", 2 + max_num_queues, chunk_rows, mode=mode)
+        if resume_step is not None:
+            for table in (self._green_times, self._phase_choices, self._queues, self._capacities):
+                table.truncate(resume_step)
+
+    def get_junction_number(self, junction_id):
+        return self._junction_number[junction_id]
+
+    def record_green_time(self, step, junction_number, phase_index, green_time):
+        self._green_times.append((step, junction_number, phase_index, green_time))
+
+    def record_phase_change(self, step, junction_number, phase_index, green_time, queues, capacities):
+        self._phase_choices.append((step, junction_number, phase_index, green_time))
+        self._queues.append([step, junction_number] + list(queues))
+        self._capacities.append([step, junction_number] + list(capacities))
+
+    def flush(self):
+        for table in (self._green_times, self._phase_choices, self._queues, self._capacities):
+            table.flush()
+
+    def get_green_times(self):
+        return self._green_times.load()
+
+    def get_phase_choices(self):
+        return self._phase_choices.load()
+
+    def get_queues(self):
+        return self._queues.load()
+
+    def get_capacities(self):
+        return self._capacities.load()
@@ -0,0 +1,457 @@
+# -*- coding: utf-8 -*-
+"""
+Runs a scenario described by a JSON config file with the intersection controllers, headless by default.
+
+    python runner.py scenarios/grid.json [-gui] [-benchmark] [-set key=value ...]
+                     [-record trace.gz | -replay trace.gz] [-stats] [-profile stages.csv] [-output dir]
+                     [-metrics summary.json] [-realtime]
+
+Input files in the config (net, route and additional files) are relative to the config file, outputs to the current
+directory. Keys missing from the config take the values in DEFAULT_CONFIG. Only what a run needs is imported: pandas
+and the tripinfo plotting helpers are loaded for the 'report' option only.
+
+The 'embedded' backend sends the TraCI commands within this process, without a socket: to SUMO itself when SUMO runs
+the runner as its embedded Python script (SUMO has then loaded the scenario from its own options), otherwise to the
+surrogate through traciemb_standin.
+"""
+from __future__ import print_function, division
+import time
+_START = time.time()  # Start of the imports, for the startup benchmark
+import os
+import sys
+import glob
+import inspect
+import json
+import random
+import socket
+import subprocess
+import tools
+import traci
+import controllers as ctrl
+from intersection_controller import IntersectionControllerContainer
+_IMPORTED = time.time()
+
+DEFAULT_CONFIG = {"name": None,  # Defaults to the name of the config file
+                  "net_file": None,
+                  "route_file": None,
+                  "additional_files": [],
+                  "step_length": 0.1,
+                  "decision_interval": None,  # Simulated seconds between controller updates, None for every step
+                  "backend": "sumo",  # "surrogate" for the point queue model in surrogate.py, or "embedded"
+                  "sumo_binary": "sumo",
+                  "gui_binary": "sumo-gui",
+                  "gui": False,
+                  "sumo_home": None,
+                  "sumo_options": "--no-step-log --time-to-teleport -1",
+                  "tripinfo_output": None,
+                  "netstate_dump": None,
+                  "target_frac": 0.5,
+                  "Tmin": 10,
+                  "Tmax": 60,
+                  "green_time_controller": "ModelBasedGreenTimeController",
+                  "green_time_controller_args": None,  # Defaults to [Tmin, Tmax]
+                  "queue_controller": "LmaxQueueController",
+                  "queue_controller_args": [],
+                  "max_time": None,  # Simulated seconds, None runs until all vehicles have arrived
+                  "warmup_time": None,  # Simulated seconds of SUMO's own (static) programs before the controllers
+                  "warmup_jump": 60.,  # Simulated seconds per simulationStep call during the warm-up
+                  "observation_window": 60.,  # Last seconds of the warm-up, stepped normally to seed mu and lambda
+                  "seed": None,
+                  "record": None,
+                  "replay": None,
+                  "stats": False,
+                  "profile": None,
+                  "output": None,
+                  "metrics": None,  # File for the OnlineMetrics summary, or true to only return it
+                  "report": False,  # Print wait time and delay statistics from the tripinfo output after the run
+                  "checkpoint_interval": None,  # Simulated seconds between checkpoints of SUMO and the controllers
+                  "checkpoint_dir": "checkpoints",
+                  "resume": None,  # Controller checkpoint to resume from, or "latest" in checkpoint_dir
+                  "store": None,  # SQLite experiment store (see experiment_store.py) the run is recorded in
+                  "store_series": False,  # Also record green times, phase choices, queues and capacities in the store
+                  "realtime": None,  # Wall clock budget per step in s (true for the step length), see deadline.py
+                  "realtime_pace": False,  # Sleep out the rest of every step's budget, running at real time
+                  "realtime_defer": None,  # Fraction of the budget after which recorders and estimators wait
+                  "realtime_overruns": None,  # CSV file of the steps over budget
+                  "progress_interval": 10.,  # Wall clock seconds between progress lines, None for no progress
+                  "max_port_attempts": 5}
+
+_INPUT_FILE_KEYS = ("net_file", "route_file")
+
+
+class PortCollisionError(Exception):
+    pass
+
+
+def load_config(filepath, overrides=None):
+    """Reads a scenario config, fills in the defaults and makes the input paths relative to the current directory"""
+    with open(filepath) as config_file:
+        loaded = json.load(config_file)
+    unknown = set(loaded) - set(DEFAULT_CONFIG)
+    if unknown:
+        raise KeyError("Unknown config keys in %s: %s" % (filepath, ", ".join(sorted(unknown))))
+
+    directory = os.path.dirname(os.path.abspath(filepath))
+    for key in _INPUT_FILE_KEYS:
+        if loaded.get(key) is not None:
+            loaded[key] = os.path.relpath(os.path.join(directory, loaded[key]))
+    loaded["additional_files"] = [os.path.relpath(os.path.join(directory, additional_file))
+                                  for additional_file in loaded.get("additional_files", [])]
+
+    config = dict(DEFAULT_CONFIG)
+    config["name"] = os.path.splitext(os.path.basename(filepath))[0]
+    config.update(loaded)
+    config.update(overrides or {})
+    return config
+
+
+def parse_arguments(argv):
+    """Config file path and overrides from the command line flags (see the module docstring)"""
+    overrides = {}
+    for flag in ("record", "replay", "profile", "output", "metrics"):
+        if "-" + flag in argv:
+            overrides[flag] = argv[argv.index("-" + flag) + 1]
+    for flag in ("gui", "stats", "realtime"):
+        if "-" + flag in argv:
+            overrides[flag] = True
+    for index, argument in enumerate(argv):
+        if argument == "-set":
+            key, value = argv[index + 1].split("=", 1)
+            try:
+                overrides[key] = json.loads(value)
+            except ValueError:
+                overrides[key] = value  # Unquoted strings, e.g. -set queue_controller=MaxPressureQueueController
+    return argv[1], overrides
+
+
+def checkpoint_files(config, step):
+    """Files of the controller checkpoint and of the SUMO state saved at simulation time step"""
+    return (os.path.join(config["checkpoint_dir"], "controllers_%.1f.npz" % step),
+            os.path.join(config["checkpoint_dir"], "sumo_%.1f.xml" % step))
+
+
+def checkpoint_times(config, begin=0):
+    """Simulation times of the checkpoints after begin. Runs without max_time are checkpointed for a day"""
+    interval = config["checkpoint_interval"]
+    end = config["max_time"] if config["max_time"] is not None else 86400
+    return [interval * number for number in range(int(begin // interval) + 1, int(end // interval) + 1)]
+
+
+def latest_checkpoint(config):
+    """The controller checkpoint with the latest time in checkpoint_dir whose SUMO state was written too"""
+    complete = [(float(os.path.basename(filepath)[len("controllers_"):-len(".npz")]), filepath)
+                for filepath in glob.glob(os.path.join(config["checkpoint_dir"], "controllers_*.npz"))]
+    complete = [(step, filepath) for step, filepath in complete if os.path.exists(checkpoint_files(config, step)[1])]
+    if not complete:
+        raise IOError("No complete checkpoint in %s" % config["checkpoint_dir"])
+    return max(complete)[1]
+
+
+def sumo_command(config, resume_header=None):
+    """SUMO command line for the config, with a %d left in for the TraCI port. SUMO saves its state at the
+    checkpoint times, and a resumed run loads the state saved with the controller checkpoint"""
+    binary = config["gui_binary"] if config["gui"] else config["sumo_binary"]
+    command = "%s -n %s -r %s --step-length %.2f --remote-port %%d" % (binary, config["net_file"],
+                                                                          config["route_file"], config["step_length"])
+    if config["additional_files"]:
+        command += " -a %s" % ",".join(config["additional_files"])
+    if config["tripinfo_output"] and not config["metrics"]:
+        command += " --tripinfo-output %s" % config["tripinfo_output"]
+    if config["netstate_dump"]:
+        command += " --netstate-dump %s" % config["netstate_dump"]
+    if config["checkpoint_interval"]:
+        times = checkpoint_times(config, resume_header["step"] if resume_header else 0)
+        command += " --save-state.times %s --save-state.files %s" % (
+            ",".join("%g" % step for step in times), ",".join(checkpoint_files(config, step)[1] for step in times))
+    if resume_header:
+        command += " --load-state %s" % resume_header["sumo_state"]
+    if config["sumo_options"]:
+        command += " " + config["sumo_options"]
+    return command
+
+
+def start_sumo(command, trace_file=None, connect_timeout=30., quiet=True):
+    """Launches command (formatted with a free port) and connects traci to it. getOpenPort only finds a port that was
+    free a moment ago, so two runs can pick the same one: the SUMO that loses exits at once, which raises
+    PortCollisionError. Returns the SUMO process"""
+    port = tools.getOpenPort()
+    output = open(os.devnull, "w") if quiet else sys.stdout
+    process = subprocess.Popen(command % port, shell=True, stdout=output, stderr=subprocess.STDOUT if quiet else None)
+    if not quiet:
+        print("Launched process: %s" % (command % port))
+
+    try:
+        traci.init(port, traceFile=trace_file, proc=process, timeout=connect_timeout)
+    except traci.FatalTraCIError:
+        if process.poll() is None:
+            raise
+        raise PortCollisionError("SUMO exited with code %s before traci connected on port %d" %
+                                 (process.returncode, port))
+    except socket.error:
+        process.kill()
+        raise
+    return process
+
+
+def build_controllers(config):
+    """The intersection controllers of the net file, with the green time and queue controllers named in config"""
+    green_time_controller_args = config["green_time_controller_args"]
+    if green_time_controller_args is None:
+        green_time_controller_args = [config["Tmin"], config["Tmax"]]
+    green_time_controller = getattr(ctrl, config["green_time_controller"])(*green_time_controller_args)
+
+    # Queue controllers with their own RandomState get the run's seed unless their arguments already set one, so
+    # that seeded, recorded and replayed runs break ties the same way every time
+    queue_controller_class = getattr(ctrl, config["queue_controller"])
+    queue_controller_args = config["queue_controller_args"]
+    queue_controller_kwargs = {}
+    if "seed" in inspect.getargspec(queue_controller_class.__init__).args[1 + len(queue_controller_args):]:
+        if config["seed"] is not None:
+            queue_controller_kwargs["seed"] = config["seed"]
+        elif config["record"] or config["replay"]:
+            queue_controller_kwargs["seed"] = 0
+    queue_controller = queue_controller_class(*queue_controller_args, **queue_controller_kwargs)
+
+    container = IntersectionControllerContainer(config["decision_interval"])
+    container.add_intersection_controllers_from_net_file(config["net_file"], config["target_frac"],
+                                                         green_time_controller, queue_controller)
+    return container
+
+
+def fast_forward(container, config):
+    """Lets the lights run SUMO's own programs up to config['warmup_time'], jumping warmup_jump seconds per
+    simulationStep, then steps through the last observation_window seconds at the step length while the
+    intersection controllers only estimate mu and lambda. Returns the simulation time reached, in s"""
+    step_length = config["step_length"]
+    warmup_time = config["warmup_time"]
+    observation_start = max(warmup_time - config["observation_window"], 0)
+
+    step = 0
+    while step < observation_start:
+        step = min(step + config["warmup_jump"], observation_start)
+        traci.simulationStep(int(round(step * 1000)))
+    while step < warmup_time:
+        traci.simulationStep()
+        container.observe_intersection_controllers(step_length)
+        step += step_length
+    return step
+
+
+def run_scenario(config, quiet=False):
+    """Runs one scenario and returns its timings (startup, simulation, steps per second) and, when config['metrics']
+    is set, the OnlineMetrics summary under 'metrics'. With config['store'], the run is also recorded in that
+    experiment store, under the id in 'run_id'"""
+    if not config["store"]:
+        return _run_scenario(config, quiet)
+
+    from experiment_store import ExperimentStore, summary_kpis
+    store = ExperimentStore(config["store"])
+    try:
+        run_id = store.start_run(config)
+        try:
+            result = _run_scenario(config, quiet, store, run_id)
+        except Exception as error:
+            store.finish_run(run_id, error="%s: %s" % (type(error).__name__, error))
+            raise
+        kpis = summary_kpis(result.get("metrics", {}))
+        kpis.update(result.get("report", {}))
+        if "latency" in result:
+            kpis.update({"stepLatencyP50": result["latency"]["p50_ms"], "stepLatencyP99": result["latency"]["p99_ms"],
+                         "stepLatencyMax": result["latency"]["max_ms"]})
+        store.finish_run(run_id, result, kpis)
+        result["run_id"] = run_id
+    finally:
+        store.close()
+    return result
+
+
+def _run_scenario(config, quiet, store=None, run_id=None):
+    start = time.time()
+    result = {}
+    if config["sumo_home"]:
+        os.environ["SUMO_HOME"] = config["sumo_home"]
+    if config["record"] and config["backend"] == "surrogate" and not config["replay"]:
+        raise ValueError("The surrogate backend does not use TraCI, so it cannot be recorded; use backend "
+                         "'embedded' to record a run of the surrogate")
+    if config["seed"] is not None or config["record"] or config["replay"]:
+        random.seed(config["seed"] or 0)  # Recorded and replayed runs must make the same random choices
+
+    container = build_controllers(config)
+    resume_header = None
+    if config["resume"]:
+        if config["backend"] != "sumo" or config["replay"]:
+            raise ValueError("Only runs with SUMO can be resumed from a checkpoint")
+        resume = latest_checkpoint(config) if config["resume"] == "latest" else config["resume"]
+        resume_header = container.load_checkpoint(resume)
+        result["resumed_from"] = resume
+    if config["checkpoint_interval"] and not os.path.isdir(config["checkpoint_dir"]):
+        os.makedirs(config["checkpoint_dir"])
+    result["controllers_time"] = time.time() - start
+    if config["profile"]:
+        container.enable_profiling()
+    if config["output"]:
+        # A resumed run continues the recording of the run it resumes
+        container.enable_output_recorder(config["output"],
+                                         resume_step=resume_header["step"] if resume_header else None)
+    elif store is not None and config["store_series"]:
+        from experiment_store import StoreRecorder
+        container.set_output_recorder(StoreRecorder(store, run_id, container.get_junction_ids()))
+    monitor = None
+    deferred_recorder = None
+    if config["realtime"]:
+        from deadline import DeadlineMonitor, DeferredRecorder, SIMULATION, CONTROLLERS, METRICS, DEFERRED
+        monitor = DeadlineMonitor(config["step_length"] if config["realtime"] is True else config["realtime"],
+                                  config["realtime_defer"])
+        container.enable_deadline_monitor(monitor, defer_estimators=config["realtime_defer"] is not None)
+        if config["realtime_defer"] is not None and container.get_output_recorder() is not None:
+            deferred_recorder = container.set_output_recorder(
+                DeferredRecorder(container.get_output_recorder(), monitor))
+    if config["stats"]:
+        traci.enableStatistics()  # Per command TraCI counts and timings, printed when traci is closed
+
+    process = None
+    connected = False
+    try:
+        if config["replay"]:
+            traci.replay(config["replay"])
+        elif config["backend"] == "embedded":
+            if traci.isEmbedded():
+                traci.initEmbedded(traceFile=config["record"])
+            else:
+                import traciemb_standin
+                from surrogate import SurrogateSimulation
+                traciemb_standin.load(SurrogateSimulation(config["net_file"], config["route_file"],
+                                                          config["step_length"], seed=config["seed"]))
+                traci.initEmbedded(traciemb_standin, config["record"])
+        elif config["backend"] == "surrogate":
+            from surrogate import SurrogateSimulation
+            SurrogateSimulation(config["net_file"], config["route_file"], config["step_length"],
+                                seed=config["seed"]).install()
+        else:
+            command = sumo_command(config, resume_header)
+            for attempt in range(1, config["max_port_attempts"] + 1):
+                try:
+                    process = start_sumo(command, config["record"], quiet=quiet)
+                    break
+                except PortCollisionError:
+                    if attempt == config["max_port_attempts"]:
+                        raise
+            result["port_attempts"] = attempt
+        connected = True
+        result["startup_time"] = time.time() - start
+
+        step = 0
+        if resume_header:
+            step = resume_header["step"]
+        elif config["warmup_time"]:
+            warmup_start = time.time()
+            step = fast_forward(container, config)
+            result["warmup_wall_time"] = time.time() - warmup_start
+
+        metrics = None  # KPIs cover the controlled part of the run only
+        if config["metrics"]:
+            from online_metrics import OnlineMetrics
+            metrics = OnlineMetrics(container.get_incoming_lanes(), config["step_length"])
+            metrics.subscribe()
+
+        step_length = config["step_length"]
+        max_time = config["max_time"]
+        progress_interval = None if quiet else config["progress_interval"]
+
+        loop_start = time.time()
+        next_progress = loop_start + progress_interval if progress_interval else None
+        checkpoints = iter(checkpoint_times(config, step) if config["checkpoint_interval"] else [])
+        next_checkpoint = next(checkpoints, None)
+        steps = 0
+
+        while traci.simulation.getMinExpectedNumber() > 0 and (max_time is None or step < max_time):
+            if monitor is not None:
+                monitor.start_step(step)
+            traci.simulationStep()
+            if monitor is not None:
+                monitor.lap(SIMULATION)
+            container.update_intersection_controllers(step, step_length)
+            if monitor is not None:
+                monitor.lap(CONTROLLERS)
+            if metrics is not None:
+                metrics.update(step)
+            if monitor is not None:
+                monitor.lap(METRICS)
+                if deferred_recorder is not None:
+                    deferred_recorder.drain()
+                    monitor.lap(DEFERRED)
+                monitor.end_step()
+                if config["realtime_pace"]:
+                    monitor.sleep_until_deadline()
+            step += step_length
+            steps += 1
+
+            if next_checkpoint is not None and step >= next_checkpoint - step_length / 2:
+                # SUMO has saved its state for this time at the end of the step
+                container.save_checkpoint(checkpoint_files(config, next_checkpoint)[0], next_checkpoint,
+                                          sumo_state=checkpoint_files(config, next_checkpoint)[1])
+                next_checkpoint = next(checkpoints, None)
+
+            if next_progress is not None and time.time() >= next_progress:
+                now = time.time()
+                print("t = %.1f s, %d steps, %.0f steps/s, %d vehicles expected" %
+                      (step, steps, steps / (now - loop_start), traci.simulation.getMinExpectedNumber()))
+                sys.stdout.flush()
+                next_progress = now + progress_interval
+
+        result["simulation_time"] = time.time() - loop_start
+        result["simulated_time"] = step
+        result["steps"] = steps
+        result["steps_per_second"] = steps / max(result["simulation_time"], 1e-9)
+    finally:
+        if connected:
+            traci.close()
+        container.flush_output()
+        if process is not None:
+            process.wait()
+
+    if metrics is not None:
+        result["metrics"] = metrics.get_summary()
+        if not isinstance(config["metrics"], bool):
+            metrics.write_summary(config["metrics"])
+    if monitor is not None:
+        result["latency"] = monitor.get_summary()
+        if config["realtime_overruns"]:
+            monitor.write_overruns(config["realtime_overruns"])
+    if config["profile"]:
+        container.export_profile(config["profile"])
+    if config["report"] and config["tripinfo_output"] and not config["metrics"]:
+        import plotting  # Loads pandas
+        result["report"] = {"meanWaitSteps": plotting.meanWaitSteps(config["tripinfo_output"], step_length),
+                            "meanDepartDelay": plotting.meanDepartDelay(config["tripinfo_output"]),
+                            "meanDuration": plotting.meanDuration(config["tripinfo_output"])}
+    result["wall_time"] = time.time() - start
+    return result
+
+
+def main(argv):
+    config_filepath, overrides = parse_arguments(argv)
+    config = load_config(config_filepath, overrides)
+    result = run_scenario(config)
+
+    if "report" in result:
+        print("Mean wait %(meanWaitSteps).2f, mean depart delay %(meanDepartDelay).2f, "
+              "mean duration %(meanDuration).2f" % result["report"])
+    print("Ran %.1f s of simulation in %.2f s" % (result["simulated_time"], result["wall_time"]))
+    if "latency" in result:
+        print("Step latency: p50 %(p50_ms).2f ms, p99 %(p99_ms).2f ms, max %(max_ms).2f ms; %(overruns)d of "
+              "%(steps)d steps over the %(budget_ms).1f ms budget, %(deferred_steps)d deferred work" % result["latency"])
+    if "-benchmark" in argv:
+        print("Startup: imports %.3f s, controllers %.3f s, until the first step %.3f s" %
+              (_IMPORTED - _START, result["controllers_time"], result["startup_time"]))
+        if "warmup_wall_time" in result:
+            print("Warm-up: %.2f s" % result["warmup_wall_time"])
+        print("Simulation: %d steps in %.2f s, %.0f steps/s" % (result["steps"], result["simulation_time"],
+                                                               result["steps_per_second"]))
+    sys.stdout.flush()
+    return result
+
+
+if __name__ == "__main__":
+
+    main(sys.argv)
@@ -0,0 +1,422 @@
+# -*- coding: utf-8 -*-
+"""
+Point queue surrogate for SUMO, used to screen controller settings without running the simulator.
+
+Every lane is a first in, first out point queue. A vehicle entering a lane is ready to leave it after the lane's free
+flow travel time. The vehicle at the head of a lane leaves once it is ready, its link is green, the lane's saturation
+headway has passed and the next lane on its route has storage space. Lights run the static program of the net file
+until their state is first set through traci, as in SUMO. install() swaps the subset of traci used by the
+intersection controllers for the surrogate's own functions, so IntersectionControllerContainer runs against it
+unmodified.
+"""
+from __future__ import print_function, division
+import time
+from collections import deque
+import xml.etree.cElementTree as ET
+import numpy as np
+from sumolib import net
+import traci
+import traci.constants as tc
+import TLSlogic
+
+
+class SurrogateSimulation:
+
+    def __init__(self, net_file, route_file, step_length=0.1, saturation_headway=2.0, jam_spacing=7.5,
+                 green_states="Gg", seed=None):
+        """ Builds the lanes, connections and signalised links from the net file and loads the vehicles of the route
+        file. Vehicles pass a signalised link when its state is one of green_states. Flows of the route file are
+        expanded into vehicles; seed sets the random departures of probability flows """
+        self._step_length = step_length
+        self._saturation_headway = saturation_headway
+        self._green_states = set(green_states)
+
+        self._read_net(net_file, jam_spacing)
+        self._read_static_programs(net_file)
+        self._read_routes(route_file, np.random.RandomState(seed))
+
+        # Dynamic state of the lanes
+        self._time = 0.0
+        self._lane_queues = [deque() for _ in self._lanes]  # (vehicle, time it is ready to leave) in arrival order
+        self._lane_counts = np.zeros(len(self._lanes), dtype=int)
+        self._head_ready_time = np.full(len(self._lanes), np.inf)
+        self._next_discharge_time = np.zeros(len(self._lanes))
+
+        # Dynamic state of the vehicles
+        num_vehicles = len(self._vehicle_ids)
+        self._route_position = np.zeros(num_vehicles, dtype=int)
+        self._next_lane = np.full(num_vehicles, -1, dtype=int)
+        self._actual_depart = np.full(num_vehicles, np.nan)
+        self._arrival = np.full(num_vehicles, np.nan)
+        self._free_flow_time = np.zeros(num_vehicles)
+
+        self._next_vehicle_to_depart = 0
+        self._waiting_to_insert = deque()
+        self._running = 0
+        self._departed_ids = []
+        self._arrived_ids = []
+
+        # Lights run the static program of the net file until their state is first set, as in SUMO
+        self._tls_states = dict((tls_id, "r" * num_links) for tls_id, num_links in self._num_links_by_tls.items())
+        self._static_program_positions = {}  # tls id -> [phase number, time the phase ends]
+        for tls_id, phases in self._static_programs.items():
+            if tls_id in self._tls_states and phases:
+                self._tls_states[tls_id] = phases[0][0]
+                self._static_program_positions[tls_id] = [0, phases[0][1]]
+
+        self._lane_subscriptions = {}
+        self._traci_originals = []
+
+    def _read_net(self, net_file, jam_spacing):
+        netObj = net.readNet(net_file)
+        [TLS_in_lanes, TLS_out_lanes] = TLSlogic.get_in_out_lanes_to_index(net_file)
+
+        self._lanes = []
+        self._lane_index = {}
+        self._lanes_by_edge = {}
+        lengths = []
+        speeds = []
+        for edge in netObj.getEdges():
+            self._lanes_by_edge[edge.getID()] = []
+            for lane in edge.getLanes():
+                self._lane_index[lane.getID()] = len(self._lanes)
+                self._lanes_by_edge[edge.getID()].append(len(self._lanes))
+                self._lanes.append(lane.getID())
+                lengths.append(lane.getLength())
+                speeds.append(lane.getSpeed())
+
+        self._lane_lengths = np.array(lengths)
+        self._lane_speeds = np.array(speeds)
+        self._travel_times = self._lane_lengths / self._lane_speeds
+        self._storage = np.maximum(1, (self._lane_lengths // jam_spacing).astype(int))
+
+        # lane -> {next edge: [lanes of the next edge connected to it]}
+        self._connections = [{} for _ in self._lanes]
+        for edge in netObj.getEdges():
+            for lane in edge.getLanes():
+                for connection in lane.getOutgoing():
+                    to_lane = connection.getToLane()
+                    self._connections[self._lane_index[lane.getID()]].setdefault(
+                        to_lane.getEdge().getID(), []).append(self._lane_index[to_lane.getID()])
+
+        # (from lane, to lane) -> (tls id, link index) for every signalised connection
+        self._signal_by_connection = {}
+        self._num_links_by_tls = {}
+        for tls_id in TLS_in_lanes:
+            self._num_links_by_tls[tls_id] = len(TLS_in_lanes[tls_id])
+            for link_index, (in_lane, out_lane) in enumerate(zip(TLS_in_lanes[tls_id], TLS_out_lanes[tls_id])):
+                if in_lane in self._lane_index and out_lane in self._lane_index:
+                    self._signal_by_connection[(self._lane_index[in_lane], self._lane_index[out_lane])] = \
+                        (tls_id, link_index)
+
+    def _read_static_programs(self, net_file):
+        """The phases (state, duration) of the first program of every traffic light in the net file"""
+        self._static_programs = {}
+        for _, element in ET.iterparse(net_file):
+            if element.tag == "tlLogic":
+                if element.get("id") not in self._static_programs:
+                    self._static_programs[element.get("id")] = [(phase.get("state"), float(phase.get("duration")))
+                                                                for phase in element.findall("phase")]
+                element.clear()
+
+    def _advance_static_programs(self):
+        for tls_id, position in self._static_program_positions.items():
+            phases = self._static_programs[tls_id]
+            while position[1] <= self._time:
+                position[0] = (position[0] + 1) % len(phases)
+                position[1] += phases[position[0]][1]
+            self._tls_states[tls_id] = phases[position[0]][0]
+
+    @staticmethod
+    def _flow_departs(element, random_state):
+        """Depart times of a flow: each second with its probability, or at a fixed period (also from vehsPerHour)"""
+        begin, end = float(element.get("begin", 0)), float(element.get("end", 86400))
+        if element.get("probability") is not None:
+            seconds = np.arange(begin, end)
+            return seconds[random_state.random_sample(len(seconds)) < float(element.get("probability"))]
+        if element.get("period") is not None:
+            period = float(element.get("period"))
+        elif element.get("vehsPerHour") is not None:
+            period = 3600. / float(element.get("vehsPerHour"))
+        else:
+            period = (end - begin) / int(element.get("number"))
+        return np.arange(begin, end, period)
+
+    def _read_routes(self, route_file, random_state):
+        vehicle_type_lengths = {}
+        routes = {}
+        vehicles = []
+
+        for _, element in ET.iterparse(route_file):
+            if element.tag == "vType":
+                vehicle_type_lengths[element.get("id")] = float(element.get("length", 5))
+            elif element.tag == "route" and element.get("id") is not None:
+                routes[element.get("id")] = element.get("edges").split()
+            elif element.tag == "vehicle":
+                inline_route = element.find("route")
+                edges = inline_route.get("edges").split() if inline_route is not None else routes[element.get("route")]
+                vehicles.append((float(element.get("depart")), element.get("id"), edges,
+                                 vehicle_type_lengths.get(element.get("type"), 5.0)))
+                element.clear()
+            elif element.tag == "flow":
+                inline_route = element.find("route")
+                edges = inline_route.get("edges").split() if inline_route is not None else routes[element.get("route")]
+                length = vehicle_type_lengths.get(element.get("type"), 5.0)
+                vehicles.extend((depart, "%s.%i" % (element.get("id"), number), edges, length)
+                                for number, depart in enumerate(self._flow_departs(element, random_state).tolist()))
+                element.clear()
+
+        vehicles.sort(key=lambda vehicle: vehicle[0])
+
+        self._depart = np.array([vehicle[0] for vehicle in vehicles])
+        self._vehicle_ids = [vehicle[1] for vehicle in vehicles]
+        self._vehicle_index = dict((veh_id, index) for index, veh_id in enumerate(self._vehicle_ids))
+        self._routes = [vehicle[2] for vehicle in vehicles]
+        self._vehicle_lengths = np.array([vehicle[3] for vehicle in vehicles])
+
+    # Movement of vehicles
+
+    def _choose_lane(self, candidates, following_edge):
+        """Picks the least occupied candidate lane, preferring lanes connected to the edge after it"""
+        if following_edge is not None:
+            connected = [lane for lane in candidates if following_edge in self._connections[lane]]
+            if connected:
+                candidates = connected
+        return min(candidates, key=lambda lane: self._lane_counts[lane])
+
+    def _following_edge(self, veh, position):
+        route = self._routes[veh]
+        return route[position] if position < len(route) else None
+
+    def _enter_lane(self, veh, lane, position):
+        if not self._lane_queues[lane]:
+            self._head_ready_time[lane] = self._time + self._travel_times[lane]
+        self._lane_queues[lane].append((veh, self._time + self._travel_times[lane]))
+        self._lane_counts[lane] += 1
+        self._route_position[veh] = position
+        self._free_flow_time[veh] += self._travel_times[lane]
+
+        next_edge = self._following_edge(veh, position + 1)
+        if next_edge is None:
+            self._next_lane[veh] = -1
+        else:
+            candidates = self._connections[lane].get(next_edge) or self._lanes_by_edge[next_edge]
+            self._next_lane[veh] = self._choose_lane(candidates, self._following_edge(veh, position + 2))
+
+    def _leave_lane(self, lane):
+        veh, _ = self._lane_queues[lane].popleft()
+        self._lane_counts[lane] -= 1
+        self._head_ready_time[lane] = self._lane_queues[lane][0][1] if self._lane_queues[lane] else np.inf
+        return veh
+
+    def _link_is_green(self, lane, next_lane):
+        signal = self._signal_by_connection.get((lane, next_lane))
+        if signal is None:
+            return True
+        tls_id, link_index = signal
+        return self._tls_states[tls_id][link_index] in self._green_states
+
+    def _insert_vehicles(self):
+        while self._next_vehicle_to_depart < len(self._depart) and \
+                self._depart[self._next_vehicle_to_depart] <= self._time:
+            self._waiting_to_insert.append(self._next_vehicle_to_depart)
+            self._next_vehicle_to_depart += 1
+
+        still_waiting = deque()
+        for veh in self._waiting_to_insert:
+            lane = self._choose_lane(self._lanes_by_edge[self._routes[veh][0]], self._following_edge(veh, 1))
+            if self._lane_counts[lane] < self._storage[lane]:
+                self._enter_lane(veh, lane, 0)
+                self._actual_depart[veh] = self._time
+                self._departed_ids.append(self._vehicle_ids[veh])
+                self._running += 1
+            else:
+                still_waiting.append(veh)
+        self._waiting_to_insert = still_waiting
+
+    def _discharge_lanes(self):
+        ready = np.nonzero((self._head_ready_time <= self._time) & (self._next_discharge_time <= self._time))[0]
+        for lane in ready:
+            # Several vehicles may leave in one step if the step is longer than the saturation headway
+            self._next_discharge_time[lane] = max(self._next_discharge_time[lane], self._time - self._step_length)
+            while self._head_ready_time[lane] <= self._time and self._next_discharge_time[lane] <= self._time:
+                veh = self._lane_queues[lane][0][0]
+                next_lane = self._next_lane[veh]
+                if next_lane < 0:
+                    self._leave_lane(lane)
+                    self._arrival[veh] = self._time
+                    self._arrived_ids.append(self._vehicle_ids[veh])
+                    self._running -= 1
+                elif self._link_is_green(lane, next_lane) and \
+                        self._lane_counts[next_lane] < self._storage[next_lane]:
+                    self._leave_lane(lane)
+                    self._enter_lane(veh, next_lane, self._route_position[veh] + 1)
+                else:
+                    break
+                self._next_discharge_time[lane] += self._saturation_headway
+
+    def step(self):
+        """Advances the simulation by one step"""
+        self._time += self._step_length
+        self._departed_ids = []
+        self._arrived_ids = []
+        if self._static_program_positions:
+            self._advance_static_programs()
+        self._insert_vehicles()
+        self._discharge_lanes()
+
+    # traci compatible functions
+
+    def simulationStep(self, step=0):
+        """Makes one simulation step, or steps up to the given time in ms as traci.simulationStep does"""
+        if step:
+            while self.getCurrentTime() < step:
+                self.step()
+        else:
+            self.step()
+        return []
+
+    def close(self):
+        self.uninstall()
+
+    def getCurrentTime(self):
+        return int(round(self._time * 1000))
+
+    def getMinExpectedNumber(self):
+        return len(self._depart) - self._next_vehicle_to_depart + len(self._waiting_to_insert) + self._running
+
+    def getDepartedIDList(self):
+        return self._departed_ids[:]
+
+    def getArrivedIDList(self):
+        return self._arrived_ids[:]
+
+    def getDepartedNumber(self):
+        return len(self._departed_ids)
+
+    def getArrivedNumber(self):
+        return len(self._arrived_ids)
+
+    def getLastStepVehicleNumber(self, laneID):
+        return int(self._lane_counts[self._lane_index[laneID]])
+
+    def getLastStepVehicleIDs(self, laneID):
+        return [self._vehicle_ids[veh] for veh, _ in self._lane_queues[self._lane_index[laneID]]]
+
+    def getLastStepHaltingNumber(self, laneID):
+        """Vehicles that have reached the end of the lane but not yet left it"""
+        return sum(1 for _, ready_time in self._lane_queues[self._lane_index[laneID]] if ready_time <= self._time)
+
+    def subscribeLane(self, laneID, varIDs=(tc.LAST_STEP_VEHICLE_NUMBER,), begin=0, end=2**31 - 1):
+        self._lane_subscriptions[laneID] = varIDs
+
+    def getLaneSubscriptionResults(self, laneID=None):
+        """Lane values for the subscribed variables, read from the current state as there is no transfer to save"""
+        if laneID is None:
+            return dict((lane, self.getLaneSubscriptionResults(lane)) for lane in self._lane_subscriptions)
+        if laneID not in self._lane_subscriptions:
+            return None
+        getters = {tc.LAST_STEP_VEHICLE_NUMBER: self.getLastStepVehicleNumber,
+                   tc.LAST_STEP_VEHICLE_HALTING_NUMBER: self.getLastStepHaltingNumber,
+                   tc.LAST_STEP_VEHICLE_ID_LIST: self.getLastStepVehicleIDs}
+        return dict((varID, getters[varID](laneID)) for varID in self._lane_subscriptions[laneID])
+
+    def getLastStepLength(self, laneID):
+        vehicles = [veh for veh, _ in self._lane_queues[self._lane_index[laneID]]]
+        return float(np.mean(self._vehicle_lengths[vehicles])) if vehicles else 0.
+
+    def getLength(self, laneID):
+        return float(self._lane_lengths[self._lane_index[laneID]])
+
+    def getMaxSpeed(self, laneID):
+        return float(self._lane_speeds[self._lane_index[laneID]])
+
+    def getRoute(self, vehID):
+        return self._routes[self._vehicle_index[vehID]][:]
+
+    def getRedYellowGreenState(self, tlsID):
+        return self._tls_states[tlsID]
+
+    def setRedYellowGreenState(self, tlsID, state):
+        self._static_program_positions.pop(tlsID, None)
+        self._tls_states[tlsID] = state
+
+    def install(self):
+        """Replaces the traci functions used by the intersection controllers with the surrogate's"""
+        replacements = [(traci, "simulationStep", self.simulationStep),
+                        (traci, "close", self.close),
+                        (traci.simulation, "getCurrentTime", self.getCurrentTime),
+                        (traci.simulation, "getMinExpectedNumber", self.getMinExpectedNumber),
+                        (traci.simulation, "getDepartedIDList", self.getDepartedIDList),
+                        (traci.simulation, "getArrivedIDList", self.getArrivedIDList),
+                        (traci.simulation, "getDepartedNumber", self.getDepartedNumber),
+                        (traci.simulation, "getArrivedNumber", self.getArrivedNumber),
+                        (traci.lane, "getLastStepVehicleNumber", self.getLastStepVehicleNumber),
+                        (traci.lane, "getLastStepVehicleIDs", self.getLastStepVehicleIDs),
+                        (traci.lane, "getLastStepLength", self.getLastStepLength),
+                        (traci.lane, "getLastStepHaltingNumber", self.getLastStepHaltingNumber),
+                        (traci.lane, "subscribe", self.subscribeLane),
+                        (traci.lane, "getSubscriptionResults", self.getLaneSubscriptionResults),
+                        (traci.lane, "getLength", self.getLength),
+                        (traci.lane, "getMaxSpeed", self.getMaxSpeed),
+                        (traci.vehicle, "getRoute", self.getRoute),
+                        (traci.trafficlights, "getRedYellowGreenState", self.getRedYellowGreenState),
+                        (traci.trafficlights, "setRedYellowGreenState", self.setRedYellowGreenState)]
+        for module, name, function in replacements:
+            self._traci_originals.append((module, name, getattr(module, name)))
+            setattr(module, name, function)
+
+    def uninstall(self):
+        """Puts back the original traci functions"""
+        for module, name, function in reversed(self._traci_originals):
+            setattr(module, name, function)
+        self._traci_originals = []
+
+    # Results
+
+    def get_trip_statistics(self):
+        """Summary of the vehicles that have arrived, comparable to the means taken from a tripinfo output"""
+        arrived = ~np.isnan(self._arrival)
+        duration = self._arrival[arrived] - self._actual_depart[arrived]
+        return {"arrived": int(np.sum(arrived)),
+                "meanDuration": float(np.mean(duration)) if duration.size else 0.,
+                "meanDepartDelay": float(np.mean(self._actual_depart[arrived] - self._depart[arrived])) if duration.size else 0.,
+                "meanTimeLoss": float(np.mean(duration - self._free_flow_time[arrived])) if duration.size else 0.}
+
+
+if __name__ == "__main__":
+
+    import controllers as ctrl
+    from intersection_controller import IntersectionControllerContainer
+
+    netFile_filepath = "netFiles/grid.net.xml"
+    routeFile_filepath = "netFiles/grid.rou.xml"
+    step_length = 0.1
+
+    target_frac = 0.5
+    Tmin = 10
+    Tmax = 60
+
+    timer = ctrl.ModelBasedGreenTimeController(Tmin, Tmax)
+    queue_control = ctrl.LmaxQueueController()
+
+    intersection_controller_container = IntersectionControllerContainer()
+    intersection_controller_container.add_intersection_controllers_from_net_file(netFile_filepath, target_frac, timer, queue_control)
+
+    start = time.time()
+    surrogate = SurrogateSimulation(netFile_filepath, routeFile_filepath, step_length)
+    surrogate.install()
+    print("Loaded surrogate in %.2f s" % (time.time() - start))
+
+    start = time.time()
+    step = 0
+    while traci.simulation.getMinExpectedNumber() > 0:
+        traci.simulationStep()
+        intersection_controller_container.update_intersection_controllers(step, step_length)
+        step += step_length
+    wall_time = time.time() - start
+
+    print(surrogate.get_trip_statistics())
+    print("Simulated %.0f s in %.2f s wall time (%.0fx real time)" % (step, wall_time, step / wall_time))
+
+    traci.close()
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Parameter sweeps over the controller settings. Every point of the grid is one run of a headless SUMO, launched by the
+worker that drives it on a port from tools.getOpenPort, with its own IntersectionControllerContainer. Runs are spread
+over a process pool sized by the free CPUs and memory, and their KPIs are collected into one table.
+"""
+from __future__ import print_function, division
+import os
+import sys
+import time
+import itertools
+import multiprocessing
+import pandas as pd
+import runner
+
+DEFAULT_SCENARIO = {"net_file": "netFiles/grid.net.xml",
+                    "route_file": "netFiles/grid.rou.xml"}
+
+
+def expand_grid(grid):
+    """Returns one dict per combination of the values in grid, a dict of parameter name to list of values"""
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+
+
+def available_memory():
+    """Bytes of memory available to new processes, or None if it cannot be read"""
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def choose_num_workers(memory_per_run=512 * 2 ** 20, reserved_cpus=0, max_workers=None):
+    """Number of concurrent runs: one per CPU (each run is a SUMO process plus its controlling worker, which mostly
+    wait on each other) but no more than fit into the available memory at memory_per_run bytes each"""
+    workers = max(multiprocessing.cpu_count() - reserved_cpus, 1)
+    memory = available_memory()
+    if memory is not None:
+        workers = min(workers, max(int(memory // memory_per_run), 1))
+    if max_workers is not None:
+        workers = min(workers, max_workers)
+    return workers
+
+
+def run_point(point, scenario=None):
+    """Runs the scenario (runner config keys, over runner.DEFAULT_CONFIG and DEFAULT_SCENARIO) with the parameters of
+    point and returns a row of the parameters, the OnlineMetrics KPIs and the wall time. Errors are reported in the
+    row's 'error' column so that one failed run does not stop a sweep"""
+    config = dict(runner.DEFAULT_CONFIG)
+    config.update(DEFAULT_SCENARIO)
+    config.update(scenario or {})
+    config.update(point)
+    config["metrics"] = True
+    row = dict(point)
+
+    start = time.time()
+    try:
+        result = runner.run_scenario(config, quiet=True)
+        for kpi in ("departed", "arrived", "running", "meanTravelTime", "totalWaitingTime", "totalDelay"):
+            row[kpi] = result["metrics"][kpi]
+        row["simulated_time"] = result["simulated_time"]
+        row["port_attempts"] = result.get("port_attempts")
+    except Exception as error:
+        row["error"] = "%s: %s" % (type(error).__name__, error)
+    row["wall_time"] = time.time() - start
+    return row
+
+
+def _run_point_args(args):
+    return run_point(*args)
+
+
+def run_sweep(grid, scenario=None, num_workers=None, memory_per_run=512 * 2 ** 20, progress=True):
+    """Runs every point of the parameter grid (see expand_grid) and returns a table with a row per run. Each worker
+    process runs a single point, so traci's module level connection is never shared between runs. With a 'store' in
+    the scenario, every worker also records its run in that experiment store"""
+    points = expand_grid(grid)
+    if num_workers is None:
+        num_workers = choose_num_workers(memory_per_run)
+    num_workers = min(num_workers, len(points))
+
+    rows = []
+    pool = multiprocessing.Pool(num_workers, maxtasksperchild=1)
+    try:
+        for row in pool.imap_unordered(_run_point_args, [(point, scenario) for point in points]):
+            rows.append(row)
+            if progress:
+                print("%d/%d runs done (%.1f s): %s" % (len(rows), len(points), row["wall_time"],
+                                                       row.get("error", "ok")))
+                sys.stdout.flush()
+    finally:
+        pool.close()
+        pool.join()
+
+    names = sorted(grid)
+    return pd.DataFrame(rows).sort_values(names).reset_index(drop=True)
+
+
+if __name__ == "__main__":
+
+    grid = {"target_frac": [0.3, 0.5, 0.7],
+            "Tmin": [5, 10],
+            "Tmax": [40, 60],
+            "queue_controller": ["LmaxQueueController", "CongestionAwareLmaxQueueController",
+                                 "MaxPressureQueueController"]}
+
+    start = time.time()
+    table = run_sweep(grid)
+    print(table.to_string())
+    print("Swept %d points in %.1f s" % (len(table), time.time() - start))
+
+    if len(sys.argv) > 1:
+        table.to_csv(sys.argv[1], index=False)
@@ -1,7 +1,6 @@
 # -*- coding: utf-8 -*-
 from __future__ import division
 import socket
-from matplotlib import pyplot as plt
 
 def getOpenPort():
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
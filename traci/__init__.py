@@ -24,14 +24,20 @@ from __future__ import print_function
 import socket
 import time
 import struct
+import gzip
 try:
     import traciemb
     _embedded = True
 except ImportError:
+    traciemb = None
     _embedded = False
+_sumoTraciemb = traciemb  # The module of an embedding SUMO, restored when a stand-in is closed
 
 _RESULTS = {0x00: "OK", 0x01: "Not implemented", 0xFF: "Error"}
 _DEBUG = False
+_TRACE_MAGIC = "TRACITRACE1\n"
+_CONNECT_FIRST_WAIT = 0.001  # Seconds before the first retry to connect, doubled after each attempt
+_CONNECT_MAX_WAIT = 0.1
 
 
 def isEmbedded():
@@ -174,7 +180,75 @@ class SubscriptionResults:
         return "<%s, %s>" % (self._results, self._contextResults)
 
 
+class TraceRecorder:
+
+    """Writes every message sent to SUMO and the response to it into a gzipped binary trace file.
+
+    Each exchange is stored as the lengths of the message and the response (!ii) followed by both,
+    without the length prefixes used on the socket.
+    """
+
+    def __init__(self, filename):
+        self._file = gzip.open(filename, "wb")
+        self._file.write(_TRACE_MAGIC)
+
+    def record(self, sent, received):
+        self._file.write(struct.pack("!ii", len(sent), len(received)) + sent + received)
+
+    def close(self):
+        self._file.close()
+
+
+class ReplaySocket:
+
+    """Stands in for the socket to SUMO, answering every message with the response recorded in a trace file.
+
+    With strict set, each message sent must match the recorded one, so a replay that diverges from
+    the recorded run fails at the first differing command instead of returning wrong answers.
+    """
+
+    def __init__(self, filename, strict=True):
+        self._file = gzip.open(filename, "rb")
+        if self._file.read(len(_TRACE_MAGIC)) != _TRACE_MAGIC:
+            raise FatalTraCIError("%s is not a TraCI trace file." % filename)
+        self._strict = strict
+        self._exchanges = 0
+        self._pending = ""
+        self._pos = 0
+
+    def _readExchange(self):
+        header = self._file.read(8)
+        if len(header) < 8:
+            return None
+        sentLength, receivedLength = struct.unpack("!ii", header)
+        return self._file.read(sentLength), self._file.read(receivedLength)
+
+    def setsockopt(self, *args):
+        pass
+
+    def send(self, data):
+        exchange = self._readExchange()
+        if exchange is None:
+            raise FatalTraCIError("Trace exhausted after %s messages." % self._exchanges)
+        sent, received = exchange
+        if self._strict and data[4:] != sent:
+            raise FatalTraCIError("Message %s differs from the trace." % self._exchanges)
+        self._exchanges += 1
+        self._pending = self._pending[self._pos:] + struct.pack("!i", len(received) + 4) + received
+        self._pos = 0
+        return len(data)
+
+    def recv(self, bufsize):
+        chunk = self._pending[self._pos:self._pos + bufsize]
+        self._pos += len(chunk)
+        return chunk
+
+    def close(self):
+        self._file.close()
+
+
 from . import constants
+from .instrumentation import CommandStatistics, timer
 
 
 def getParameterAccessors(cmdGetID, cmdSetID):
@@ -263,6 +337,8 @@ _modules = {constants.RESPONSE_SUBSCRIBE_INDUCTIONLOOP_VARIABLE: inductionloop,
             constants.CMD_GET_GUI_VARIABLE: gui}
 _connections = {}
 _message = Message()
+_recorder = None
+_statistics = None
 
 
 def _recvExact():
@@ -286,16 +362,26 @@ def _recvExact():
 
 
 def _sendExact():
+    if _statistics:
+        start = timer()
     if _embedded:
         result = Storage(traciemb.execute(_message.string))
     else:
         length = struct.pack("!i", len(_message.string) + 4)
-        _connections[""].send(length + _message.string)
+        try:
+            _connections[""].send(length + _message.string)
+        except socket.error:
+            _message.string = ""
+            _message.queue = []
+            raise
         result = _recvExact()
     if not result:
-        _connections[""].close()
-        del _connections[""]
+        if "" in _connections:
+            _connections[""].close()
+            del _connections[""]
         raise FatalTraCIError("connection closed by SUMO")
+    if _recorder:
+        _recorder.record(_message.string, result._content)
     for command in _message.queue:
         prefix = result.read("!BBB")
         err = result.readString()
@@ -309,11 +395,35 @@ def _sendExact():
         elif prefix[1] == constants.CMD_STOP:
             length = result.read("!B")[0] - 1
             result.read("!%sx" % length)
+    if _statistics:
+        _recordCommandStatistics(result, timer() - start)
     _message.string = ""
     _message.queue = []
     return result
 
 
+def _recordCommandStatistics(result, latency):
+    """Records a message under its first command, keyed by its variable ID for get and set
+    commands. The bytes and latency of a message of several commands all go to the first one"""
+    message = _message.string
+    offset = 5 if struct.unpack_from("!B", message)[0] == 0 else 1
+    cmdID = struct.unpack_from("!B", message, offset)[0]
+    varID = None
+    if 0xa0 <= cmdID <= 0xaf or 0xc0 <= cmdID <= 0xcf:
+        varID = struct.unpack_from("!B", message, offset + 1)[0]
+    _statistics.recordCommand(cmdID, varID, len(message) + 4, len(result._content) + 4, latency)
+
+
+def _decodeResult(cmdID, varID, decode, result):
+    """Returns decode(result), timing it as the decode time of the get command if statistics are enabled"""
+    if not _statistics:
+        return decode(result)
+    start = timer()
+    value = decode(result)
+    _statistics.recordValueDecode(cmdID, varID, timer() - start)
+    return value
+
+
 def _beginMessage(cmdID, varID, objID, length=0):
     _message.queue.append(cmdID)
     length += 1 + 1 + 1 + 4 + len(objID)
@@ -368,6 +478,8 @@ def _checkResult(cmdID, varID, objID):
 
 
 def _readSubscription(result):
+    if _statistics:
+        start = timer()
     result.printDebug()  # to enable this you also need to set _DEBUG to True
     result.readLength()
     response = result.read("!B")[0]
@@ -407,6 +519,8 @@ def _readSubscription(result):
                 else:
                     raise FatalTraCIError(
                         "Cannot handle subscription response %02x for %s." % (response, objectID))
+    if _statistics:
+        _statistics.recordDecode(response, timer() - start)
     return objectID, response
 
 
@@ -422,7 +536,7 @@ def _subscribe(cmdID, begin, end, objID, varIDs, parameters=None):
     else:
         _message.string += struct.pack("!Bi", 0, length + 4)
     _message.string += struct.pack("!Biii",
-                                   cmdID, begin, end, len(objID)) + objID
+                                   cmdID, begin, end, len(objID)) + str(objID)
     _message.string += struct.pack("!B", len(varIDs))
     for v in varIDs:
         _message.string += struct.pack("!B", v)
@@ -443,7 +557,7 @@ def _subscribeContext(cmdID, begin, end, objID, domain, dist, varIDs):
     else:
         _message.string += struct.pack("!Bi", 0, length + 4)
     _message.string += struct.pack("!Biii",
-                                   cmdID, begin, end, len(objID)) + objID
+                                   cmdID, begin, end, len(objID)) + str(objID)
     _message.string += struct.pack("!BdB", domain, dist, len(varIDs))
     for v in varIDs:
         _message.string += struct.pack("!B", v)
@@ -454,21 +568,101 @@ def _subscribeContext(cmdID, begin, end, objID, domain, dist, varIDs):
             response, objectID, cmdID, objID))
 
 
-def init(port=8813, numRetries=10, host="localhost", label="default"):
-    if _embedded:
-        return getVersion()
-    for wait in range(1, numRetries + 2):
+def connectSocket(port=8813, host="localhost", unixSocket=None, timeout=0, proc=None):
+    """Returns a socket connected to SUMO on host:port, or on the Unix domain socket unixSocket where SUMO or a
+    local proxy offers one. While nothing listens, connecting is retried for up to timeout seconds, with a wait
+    doubling from 1 ms to at most 0.1 s, so a connection is made soon after SUMO is ready. If proc, the
+    subprocess.Popen of SUMO, exits meanwhile, FatalTraCIError is raised at once."""
+    deadline = time.time() + timeout
+    wait = _CONNECT_FIRST_WAIT
+    while True:
+        if proc is not None and proc.poll() is not None:
+            raise FatalTraCIError("SUMO exited with code %s before traci connected." % proc.returncode)
+        if unixSocket:
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            connection = socket.socket()
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         try:
-            _connections[""] = _connections[label] = socket.socket()
-            _connections[label].setsockopt(socket.IPPROTO_TCP,
-                                           socket.TCP_NODELAY, 1)
-            _connections[label].connect((host, port))
-            break
+            connection.connect(unixSocket or (host, port))
+            return connection
         except socket.error:
+            connection.close()
+            if time.time() + wait > deadline:
+                raise
             time.sleep(wait)
+            wait = min(2 * wait, _CONNECT_MAX_WAIT)
+
+
+def init(port=8813, numRetries=10, host="localhost", label="default", traceFile=None, unixSocket=None,
+         proc=None, timeout=None):
+    """Connects to SUMO, over TCP or the Unix domain socket unixSocket (see connectSocket). Connecting is retried for
+    timeout seconds, by default as long as numRetries retries used to wait, 1 + 2 + ... + numRetries seconds, and
+    given up as soon as proc, the SUMO process, exits. If traceFile is given, every message and response is
+    recorded into it so that the run can be replayed later without SUMO (see replay)."""
+    if traceFile:
+        startRecording(traceFile)
+    if _embedded:
+        return getVersion()
+    if timeout is None:
+        timeout = numRetries * (numRetries + 1) / 2.
+    _connections[""] = _connections[label] = connectSocket(port, host, unixSocket, timeout, proc)
+    return getVersion()
+
+
+def initEmbedded(executor=None, traceFile=None):
+    """Sends all following commands in this process to executor.execute(message), which returns the response,
+    instead of over a socket: SUMO's traciemb when SUMO runs this script, otherwise a stand-in such as
+    traciemb_standin. A stand-in is closed by close() like a connection, after which the socket is used again."""
+    global traciemb, _embedded
+    if executor is not None:
+        traciemb = executor
+    elif traciemb is None:
+        raise FatalTraCIError("traciemb is only available when SUMO runs the script.")
+    _embedded = True
+    if traceFile:
+        startRecording(traceFile)
+    return getVersion()
+
+
+def replay(traceFile, label="default", strict=True):
+    """Answers all following commands from a trace recorded with init(traceFile=...) instead of SUMO.
+    The commands must be issued in the same order as in the recorded run."""
+    _connections[""] = _connections[label] = ReplaySocket(traceFile, strict)
     return getVersion()
 
 
+def startRecording(traceFile):
+    global _recorder
+    stopRecording()
+    _recorder = TraceRecorder(traceFile)
+
+
+def stopRecording():
+    global _recorder
+    if _recorder:
+        _recorder.close()
+        _recorder = None
+
+
+def enableStatistics(out=None):
+    """Starts counting calls, bytes, latency and decode time per command and variable ID.
+    The summary is written to out (default stdout) when the connection is closed."""
+    global _statistics
+    _statistics = CommandStatistics(out)
+    return _statistics
+
+
+def disableStatistics():
+    global _statistics
+    _statistics = None
+
+
+def getStatistics():
+    """Returns the CommandStatistics being recorded, or None if disabled"""
+    return _statistics
+
+
 def simulationStep(step=0):
     """
     Make simulation step and simulate up to "step" second in sim time.
@@ -501,12 +695,22 @@ def getVersion():
 
 
 def close():
+    global traciemb, _embedded
     if "" in _connections:
         _message.queue.append(constants.CMD_CLOSE)
         _message.string += struct.pack("!BB", 1 + 1, constants.CMD_CLOSE)
         _sendExact()
         _connections[""].close()
         del _connections[""]
+    elif _embedded and traciemb is not _sumoTraciemb:
+        _message.queue.append(constants.CMD_CLOSE)
+        _message.string += struct.pack("!BB", 1 + 1, constants.CMD_CLOSE)
+        _sendExact()
+        traciemb = _sumoTraciemb
+        _embedded = traciemb is not None
+    stopRecording()
+    if _statistics:
+        _statistics.dump()
 
 
 def switch(label):
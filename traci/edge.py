@@ -46,7 +46,8 @@ subscriptionResults = traci.SubscriptionResults(_RETURN_VALUE_FUNC)
 def _getUniversal(varID, edgeID):
     result = traci._sendReadOneStringCmd(
         tc.CMD_GET_EDGE_VARIABLE, varID, edgeID)
-    return _RETURN_VALUE_FUNC[varID](result)
+    return traci._decodeResult(
+        tc.CMD_GET_EDGE_VARIABLE, varID, _RETURN_VALUE_FUNC[varID], result)
 
 
 def getIDList():
@@ -33,7 +33,8 @@ subscriptionResults = traci.SubscriptionResults(_RETURN_VALUE_FUNC)
 def _getUniversal(varID, viewID):
     result = traci._sendReadOneStringCmd(
         tc.CMD_GET_GUI_VARIABLE, varID, viewID)
-    return _RETURN_VALUE_FUNC[varID](result)
+    return traci._decodeResult(
+        tc.CMD_GET_GUI_VARIABLE, varID, _RETURN_VALUE_FUNC[varID], result)
 
 
 def getIDList():
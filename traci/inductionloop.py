@@ -56,7 +56,8 @@ subscriptionResults = traci.SubscriptionResults(_RETURN_VALUE_FUNC)
 def _getUniversal(varID, loopID):
     result = traci._sendReadOneStringCmd(
         tc.CMD_GET_INDUCTIONLOOP_VARIABLE, varID, loopID)
-    return _RETURN_VALUE_FUNC[varID](result)
+    return traci._decodeResult(
+        tc.CMD_GET_INDUCTIONLOOP_VARIABLE, varID, _RETURN_VALUE_FUNC[varID], result)
 
 
 def getIDList():
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+@file    instrumentation.py
+
+Opt-in instrumentation of the TraCI connection.
+
+Counts the calls, bytes sent and received, round trip latency and decode time for every
+command and variable ID. Times go into fixed histograms with power of two microsecond
+buckets, so recording a call only costs a few additions. Enabled with traci.enableStatistics().
+
+The latency of a command runs from sending its message until the response statuses are
+checked. Decode time is the time spent reading the returned value in the domains' getters
+(e.g. traci.lane.getLastStepVehicleNumber) and in parsing subscription responses. A message
+holding several commands is counted once, under its first command.
+"""
+from __future__ import print_function
+import sys
+from timeit import default_timer as timer
+import traci.constants as tc
+
+NUM_BUCKETS = 32  # bucket b holds times t with 2**(b-1) <= t (in us) < 2**b, the last bucket is unbounded
+
+_COUNT, _SENT, _RECEIVED, _LATENCY, _DECODE, _LATENCY_HIST, _DECODE_HIST = range(7)
+
+_COMMAND_NAMES = dict((value, name) for name, value in vars(tc).items()
+                      if name.startswith("CMD_") or name.startswith("RESPONSE_SUBSCRIBE_"))
+
+
+def _bucket(seconds):
+    return min(NUM_BUCKETS - 1, int(seconds * 1e6).bit_length())
+
+
+def _quantile(histogram, fraction):
+    """Upper bound (in seconds) of the bucket holding the given fraction of the calls"""
+    total = sum(histogram)
+    if not total:
+        return 0.
+    target = fraction * total
+    count = 0
+    for bucket, bucket_count in enumerate(histogram):
+        count += bucket_count
+        if count >= target:
+            return 2 ** bucket / 1e6
+    return 2 ** (NUM_BUCKETS - 1) / 1e6
+
+
+class CommandStatistics:
+
+    def __init__(self, out=None):
+        """Statistics keyed by (command ID, variable ID). The variable ID is None for commands
+        without one, e.g. simulation steps. The summary is written to out on traci.close()."""
+        self._stats = {}
+        self._out = out
+
+    def _entry(self, key):
+        entry = self._stats.get(key)
+        if entry is None:
+            entry = self._stats[key] = [0, 0, 0, 0., 0., [0] * NUM_BUCKETS, [0] * NUM_BUCKETS]
+        return entry
+
+    def recordCommand(self, cmdID, varID, sent, received, latency):
+        entry = self._entry((cmdID, varID))
+        entry[_COUNT] += 1
+        entry[_SENT] += sent
+        entry[_RECEIVED] += received
+        entry[_LATENCY] += latency
+        entry[_LATENCY_HIST][_bucket(latency)] += 1
+
+    def recordValueDecode(self, cmdID, varID, decode):
+        """Decode time of the value returned by a get command already counted by recordCommand"""
+        entry = self._entry((cmdID, varID))
+        entry[_DECODE] += decode
+        entry[_DECODE_HIST][_bucket(decode)] += 1
+
+    def recordDecode(self, responseID, decode):
+        """Decode time of a subscription response, which arrives without a command of its own"""
+        entry = self._entry((responseID, None))
+        entry[_COUNT] += 1
+        entry[_DECODE] += decode
+        entry[_DECODE_HIST][_bucket(decode)] += 1
+
+    def reset(self):
+        self._stats.clear()
+
+    def get(self):
+        """Returns a dict (command ID, variable ID) -> dict of the totals, means and approximate quantiles"""
+        result = {}
+        for key, entry in self._stats.items():
+            count = entry[_COUNT]
+            result[key] = {"count": count,
+                           "bytesSent": entry[_SENT],
+                           "bytesReceived": entry[_RECEIVED],
+                           "latencyTotal": entry[_LATENCY],
+                           "latencyMean": entry[_LATENCY] / count,
+                           "latencyP50": _quantile(entry[_LATENCY_HIST], 0.5),
+                           "latencyP99": _quantile(entry[_LATENCY_HIST], 0.99),
+                           "latencyHistogram": entry[_LATENCY_HIST][:],
+                           "decodeTotal": entry[_DECODE],
+                           "decodeMean": entry[_DECODE] / count,
+                           "decodeHistogram": entry[_DECODE_HIST][:]}
+        return result
+
+    def summary(self):
+        lines = ["%-42s %4s %9s %11s %11s %10s %10s %10s %10s" %
+                 ("command", "var", "calls", "sent", "received", "wait [s]", "p50 [ms]", "p99 [ms]", "decode [s]")]
+        stats = self.get()
+        for (cmdID, varID) in sorted(stats, key=lambda key: -(stats[key]["latencyTotal"] + stats[key]["decodeTotal"])):
+            entry = stats[(cmdID, varID)]
+            lines.append("%-42s %4s %9d %11d %11d %10.3f %10.3f %10.3f %10.3f" %
+                         (_COMMAND_NAMES.get(cmdID, "0x%02x" % cmdID),
+                          "" if varID is None else "0x%02x" % varID,
+                          entry["count"], entry["bytesSent"], entry["bytesReceived"], entry["latencyTotal"],
+                          entry["latencyP50"] * 1e3, entry["latencyP99"] * 1e3, entry["decodeTotal"]))
+        return "\n".join(lines)
+
+    def dump(self, out=None):
+        out = out or self._out or sys.stdout
+        print(self.summary(), file=out)
@@ -32,7 +32,8 @@ subscriptionResults = traci.SubscriptionResults(_RETURN_VALUE_FUNC)
 def _getUniversal(varID, junctionID):
     result = traci._sendReadOneStringCmd(
         tc.CMD_GET_JUNCTION_VARIABLE, varID, junctionID)
-    return _RETURN_VALUE_FUNC[varID](result)
+    return traci._decodeResult(
+        tc.CMD_GET_JUNCTION_VARIABLE, varID, _RETURN_VALUE_FUNC[varID], result)
 
 
 def getIDList():
@@ -82,7 +82,8 @@ subscriptionResults = traci.SubscriptionResults(_RETURN_VALUE_FUNC)
 def _getUniversal(varID, laneID):
     result = traci._sendReadOneStringCmd(
         tc.CMD_GET_LANE_VARIABLE, varID, laneID)
-    return _RETURN_VALUE_FUNC[varID](result)
+    return traci._decodeResult(
+        tc.CMD_GET_LANE_VARIABLE, varID, _RETURN_VALUE_FUNC[varID], result)
 
 
 def getIDList():
@@ -31,7 +31,8 @@ subscriptionResults = traci.SubscriptionResults(_RETURN_VALUE_FUNC)
 def _getUniversal(varID, detID):
     result = traci._sendReadOneStringCmd(
         tc.CMD_GET_MULTI_ENTRY_EXIT_DETECTOR_VARIABLE, varID, detID)
-    return _RETURN_VALUE_FUNC[varID](result)
+    return traci._decodeResult(
+        tc.CMD_GET_MULTI_ENTRY_EXIT_DETECTOR_VARIABLE, varID, _RETURN_VALUE_FUNC[varID], result)
 
 
 def getIDList():
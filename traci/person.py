@@ -43,7 +43,8 @@ subscriptionResults = traci.SubscriptionResults(_RETURN_VALUE_FUNC)
 def _getUniversal(varID, personID):
     result = traci._sendReadOneStringCmd(
         tc.CMD_GET_PERSON_VARIABLE, varID, personID)
-    return _RETURN_VALUE_FUNC[varID](result)
+    return traci._decodeResult(
+        tc.CMD_GET_PERSON_VARIABLE, varID, _RETURN_VALUE_FUNC[varID], result)
 
 
 def getIDList():
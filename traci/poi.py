@@ -31,7 +31,8 @@ subscriptionResults = traci.SubscriptionResults(_RETURN_VALUE_FUNC)
 
 def _getUniversal(varID, poiID):
     result = traci._sendReadOneStringCmd(tc.CMD_GET_POI_VARIABLE, varID, poiID)
-    return _RETURN_VALUE_FUNC[varID](result)
+    return traci._decodeResult(
+        tc.CMD_GET_POI_VARIABLE, varID, _RETURN_VALUE_FUNC[varID], result)
 
 
 def getIDList():
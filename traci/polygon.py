@@ -31,7 +31,8 @@ subscriptionResults = traci.SubscriptionResults(_RETURN_VALUE_FUNC)
 def _getUniversal(varID, polygonID):
     result = traci._sendReadOneStringCmd(
         tc.CMD_GET_POLYGON_VARIABLE, varID, polygonID)
-    return _RETURN_VALUE_FUNC[varID](result)
+    return traci._decodeResult(
+        tc.CMD_GET_POLYGON_VARIABLE, varID, _RETURN_VALUE_FUNC[varID], result)
 
 
 def getIDList():
@@ -30,7 +30,8 @@ subscriptionResults = traci.SubscriptionResults(_RETURN_VALUE_FUNC)
 def _getUniversal(varID, routeID):
     result = traci._sendReadOneStringCmd(
         tc.CMD_GET_ROUTE_VARIABLE, varID, routeID)
-    return _RETURN_VALUE_FUNC[varID](result)
+    return traci._decodeResult(
+        tc.CMD_GET_ROUTE_VARIABLE, varID, _RETURN_VALUE_FUNC[varID], result)
 
 
 def getIDList():
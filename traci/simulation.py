@@ -50,7 +50,8 @@ subscriptionResults = traci.SubscriptionResults(_RETURN_VALUE_FUNC)
 
 def _getUniversal(varID):
     result = traci._sendReadOneStringCmd(tc.CMD_GET_SIM_VARIABLE, varID, "")
-    return _RETURN_VALUE_FUNC[varID](result)
+    return traci._decodeResult(
+        tc.CMD_GET_SIM_VARIABLE, varID, _RETURN_VALUE_FUNC[varID], result)
 
 
 def getCurrentTime():
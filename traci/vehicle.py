@@ -114,7 +114,8 @@ subscriptionResults = traci.SubscriptionResults(_RETURN_VALUE_FUNC)
 def _getUniversal(varID, vehID):
     result = traci._sendReadOneStringCmd(
         tc.CMD_GET_VEHICLE_VARIABLE, varID, vehID)
-    return _RETURN_VALUE_FUNC[varID](result)
+    return traci._decodeResult(
+        tc.CMD_GET_VEHICLE_VARIABLE, varID, _RETURN_VALUE_FUNC[varID], result)
 
 
 def getIDList():
@@ -43,7 +43,8 @@ subscriptionResults = traci.SubscriptionResults(_RETURN_VALUE_FUNC)
 def _getUniversal(varID, typeID):
     result = traci._sendReadOneStringCmd(
         tc.CMD_GET_VEHICLETYPE_VARIABLE, varID, typeID)
-    return _RETURN_VALUE_FUNC[varID](result)
+    return traci._decodeResult(
+        tc.CMD_GET_VEHICLETYPE_VARIABLE, varID, _RETURN_VALUE_FUNC[varID], result)
 
 
 def getIDList():
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+Stand-in for SUMO's traciemb module, for testing the embedded TraCI mode without an embedding SUMO.
+
+execute(message) answers TraCI messages as SUMO does, byte for byte, from a surrogate.SurrogateSimulation loaded with
+load(). It covers the commands used by the runner, the intersection controllers and OnlineMetrics: version, simulation
+step, close, the simulation, lane, vehicle and traffic light getters used there, setting a light's state and lane
+subscriptions. serve() answers the same messages over a TCP or Unix domain socket, like SUMO's --remote-port, so that
+the transports can be compared on identical work (see embedded_benchmark.py and transport_benchmark.py).
+"""
+from __future__ import print_function, division
+import os
+import socket
+import struct
+import traci.constants as tc
+
+_INTEGER, _DOUBLE, _STRING, _STRINGLIST = tc.TYPE_INTEGER, tc.TYPE_DOUBLE, tc.TYPE_STRING, tc.TYPE_STRINGLIST
+
+# Variable ID -> (value type, name of the SurrogateSimulation getter) of every domain
+_SIMULATION_VARIABLES = {tc.VAR_TIME_STEP: (_INTEGER, "getCurrentTime"),
+                         tc.VAR_MIN_EXPECTED_VEHICLES: (_INTEGER, "getMinExpectedNumber"),
+                         tc.VAR_DEPARTED_VEHICLES_IDS: (_STRINGLIST, "getDepartedIDList"),
+                         tc.VAR_ARRIVED_VEHICLES_IDS: (_STRINGLIST, "getArrivedIDList"),
+                         tc.VAR_DEPARTED_VEHICLES_NUMBER: (_INTEGER, "getDepartedNumber"),
+                         tc.VAR_ARRIVED_VEHICLES_NUMBER: (_INTEGER, "getArrivedNumber")}
+_LANE_VARIABLES = {tc.LAST_STEP_VEHICLE_NUMBER: (_INTEGER, "getLastStepVehicleNumber"),
+                   tc.LAST_STEP_VEHICLE_ID_LIST: (_STRINGLIST, "getLastStepVehicleIDs"),
+                   tc.LAST_STEP_VEHICLE_HALTING_NUMBER: (_INTEGER, "getLastStepHaltingNumber"),
+                   tc.LAST_STEP_LENGTH: (_DOUBLE, "getLastStepLength"),
+                   tc.VAR_LENGTH: (_DOUBLE, "getLength"),
+                   tc.VAR_MAXSPEED: (_DOUBLE, "getMaxSpeed")}
+_VEHICLE_VARIABLES = {tc.VAR_EDGES: (_STRINGLIST, "getRoute")}
+_TL_VARIABLES = {tc.TL_RED_YELLOW_GREEN_STATE: (_STRING, "getRedYellowGreenState")}
+
+_GET_COMMANDS = {tc.CMD_GET_SIM_VARIABLE: _SIMULATION_VARIABLES,
+                 tc.CMD_GET_LANE_VARIABLE: _LANE_VARIABLES,
+                 tc.CMD_GET_VEHICLE_VARIABLE: _VEHICLE_VARIABLES,
+                 tc.CMD_GET_TL_VARIABLE: _TL_VARIABLES}
+
+
+def _pack_string(value):
+    return struct.pack("!i", len(value)) + value
+
+
+def _pack_value(value_type, value):
+    if value_type == _INTEGER:
+        return struct.pack("!Bi", _INTEGER, value)
+    if value_type == _DOUBLE:
+        return struct.pack("!Bd", _DOUBLE, value)
+    if value_type == _STRING:
+        return struct.pack("!B", _STRING) + _pack_string(value)
+    return struct.pack("!Bi", _STRINGLIST, len(value)) + "".join(_pack_string(item) for item in value)
+
+
+def _pack_command(content):
+    """A response command: its length, one byte if it fits, otherwise a zero byte and four bytes, and content"""
+    if len(content) + 1 <= 255:
+        return struct.pack("!B", len(content) + 1) + content
+    return struct.pack("!Bi", 0, len(content) + 5) + content
+
+
+def _status(cmdID, result=tc.RTYPE_OK, description=""):
+    return struct.pack("!BBBi", 1 + 1 + 1 + 4 + len(description), cmdID, result, len(description)) + description
+
+
+class TraCIServer:
+
+    def __init__(self, simulation):
+        """ Answers TraCI messages from simulation, a SurrogateSimulation, as SUMO's TraCI server does """
+        self._simulation = simulation
+        self._lane_subscriptions = []  # (lane, variable IDs) in the order they were subscribed
+        self.closed = False
+
+    def _lane_subscription_response(self, lane, varIDs):
+        content = struct.pack("!B", tc.RESPONSE_SUBSCRIBE_LANE_VARIABLE) + _pack_string(lane) + \
+            struct.pack("!B", len(varIDs))
+        for varID in varIDs:
+            value_type, getter = _LANE_VARIABLES[varID]
+            content += struct.pack("!BB", varID, tc.RTYPE_OK) + _pack_value(value_type,
+                                                                             getattr(self._simulation, getter)(lane))
+        return _pack_command(content)
+
+    def _command(self, cmdID, body):
+        """Status and response of one command"""
+        if cmdID == tc.CMD_GETVERSION:
+            return _status(cmdID) + _pack_command(struct.pack("!Bi", cmdID, tc.TRACI_VERSION) +
+                                                  _pack_string("SUMO surrogate stand-in"))
+
+        if cmdID == tc.CMD_SIMSTEP2:
+            self._simulation.simulationStep(struct.unpack_from("!i", body)[0])
+            return _status(cmdID) + struct.pack("!i", len(self._lane_subscriptions)) + "".join(
+                self._lane_subscription_response(lane, varIDs) for lane, varIDs in self._lane_subscriptions)
+
+        if cmdID == tc.CMD_CLOSE:
+            self.closed = True
+            return _status(cmdID)
+
+        if cmdID in _GET_COMMANDS:
+            varID = struct.unpack_from("!B", body)[0]
+            objID_length = struct.unpack_from("!i", body, 1)[0]
+            objID = body[5:5 + objID_length]
+            if varID not in _GET_COMMANDS[cmdID]:
+                return _status(cmdID, tc.RTYPE_NOTIMPLEMENTED, "Variable %02x is not supported" % varID)
+            value_type, getter = _GET_COMMANDS[cmdID][varID]
+            value = getattr(self._simulation, getter)() if cmdID == tc.CMD_GET_SIM_VARIABLE else \
+                getattr(self._simulation, getter)(objID)
+            return _status(cmdID) + _pack_command(struct.pack("!BB", cmdID + 0x10, varID) + _pack_string(objID) +
+                                                  _pack_value(value_type, value))
+
+        if cmdID == tc.CMD_SET_TL_VARIABLE:
+            varID = struct.unpack_from("!B", body)[0]
+            objID_length = struct.unpack_from("!i", body, 1)[0]
+            objID = body[5:5 + objID_length]
+            if varID != tc.TL_RED_YELLOW_GREEN_STATE:
+                return _status(cmdID, tc.RTYPE_NOTIMPLEMENTED, "Variable %02x is not supported" % varID)
+            state_length = struct.unpack_from("!i", body, 5 + objID_length + 1)[0]
+            state_start = 5 + objID_length + 1 + 4
+            self._simulation.setRedYellowGreenState(objID, body[state_start:state_start + state_length])
+            return _status(cmdID)
+
+        if cmdID == tc.CMD_SUBSCRIBE_LANE_VARIABLE:
+            objID_length = struct.unpack_from("!i", body, 8)[0]
+            lane = body[12:12 + objID_length]
+            num_vars = struct.unpack_from("!B", body, 12 + objID_length)[0]
+            varIDs = struct.unpack_from("!%dB" % num_vars, body, 13 + objID_length)
+            if any(varID not in _LANE_VARIABLES for varID in varIDs):
+                return _status(cmdID, tc.RTYPE_NOTIMPLEMENTED, "Lane subscription variable not supported")
+            self._lane_subscriptions = [(subscribed, ids) for subscribed, ids in self._lane_subscriptions
+                                        if subscribed != lane] + [(lane, varIDs)]
+            return _status(cmdID) + self._lane_subscription_response(lane, varIDs)
+
+        return _status(cmdID, tc.RTYPE_NOTIMPLEMENTED, "Command %02x is not supported" % cmdID)
+
+    def execute(self, message):
+        """The response to a message of one or more commands, without the length prefix used on the socket"""
+        responses = []
+        position = 0
+        while position < len(message):
+            length = struct.unpack_from("!B", message, position)[0]
+            header = 1
+            if length == 0:
+                length = struct.unpack_from("!i", message, position + 1)[0]
+                header = 5
+            cmdID = struct.unpack_from("!B", message, position + header)[0]
+            responses.append(self._command(cmdID, message[position + header + 1:position + length]))
+            position += length
+        return "".join(responses)
+
+
+_server = None
+
+
+def load(simulation):
+    """Makes execute answer from simulation, a SurrogateSimulation"""
+    global _server
+    _server = TraCIServer(simulation)
+
+
+def execute(message):
+    return _server.execute(message)
+
+
+def serve(simulation, port, host="localhost", unixSocket=None):
+    """Answers TraCI messages from simulation over TCP on port, or on the Unix domain socket unixSocket, for one
+    client, until it closes the connection"""
+    server = TraCIServer(simulation)
+    if unixSocket:
+        if os.path.exists(unixSocket):
+            os.remove(unixSocket)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(unixSocket)
+    else:
+        listener = socket.socket()
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((host, port))
+    listener.listen(1)
+    connection, _ = listener.accept()
+    if not unixSocket:
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    listener.close()
+    try:
+        while not server.closed:
+            header = receive_exact(connection, 4)
+            if not header:
+                break
+            message = receive_exact(connection, struct.unpack("!i", header)[0] - 4)
+            response = server.execute(message)
+            connection.sendall(struct.pack("!i", len(response) + 4) + response)
+    finally:
+        connection.close()
+        if unixSocket and os.path.exists(unixSocket):
+            os.remove(unixSocket)
+
+
+def receive_exact(connection, length):
+    received = ""
+    while len(received) < length:
+        chunk = connection.recv(length - len(received))
+        if not chunk:
+            return None
+        received += chunk
+    return received
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Round trip latency of TraCI's transports: TCP over localhost against a Unix domain socket.
+
+    python transport_benchmark.py [repetitions]
+
+An echo stand-in in another process returns every length prefixed message as it is, so the round trips measure the
+transport alone, for message sizes from a single getter to a long vehicle id list. The same traci commands are then
+timed against traciemb_standin.serve over either socket. The echo runs also time how long traci.connectSocket takes to
+connect once the server starts listening.
+"""
+from __future__ import print_function, division
+import os
+import sys
+import socket
+import struct
+import tempfile
+import time
+import multiprocessing
+from timeit import default_timer
+import numpy as np
+import tools
+import traci
+import traciemb_standin
+from surrogate import SurrogateSimulation
+
+MESSAGE_SIZES = (16, 256, 4096, 65536)  # Bytes, after the 4 byte length prefix
+LISTEN_DELAY = 0.02  # Seconds the servers wait before listening, to time the connection retries
+
+
+def _listen(port, unixSocket):
+    if unixSocket:
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(unixSocket)
+    else:
+        listener = socket.socket()
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(("localhost", port))
+    listener.listen(1)
+    return listener
+
+
+def _echo(port, unixSocket):
+    """Echoes length prefixed messages back to one client until it disconnects"""
+    time.sleep(LISTEN_DELAY)
+    listener = _listen(port, unixSocket)
+    connection, _ = listener.accept()
+    if not unixSocket:
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    listener.close()
+    while True:
+        header = traciemb_standin.receive_exact(connection, 4)
+        if not header:
+            break
+        message = traciemb_standin.receive_exact(connection, struct.unpack("!i", header)[0] - 4)
+        connection.sendall(header + message)
+    connection.close()
+
+
+def _serve(net_file, route_file, port, unixSocket):
+    simulation = SurrogateSimulation(net_file, route_file, seed=0)
+    time.sleep(LISTEN_DELAY)
+    traciemb_standin.serve(simulation, port, unixSocket=unixSocket)
+
+
+def _start_server(target, args, unixSocket):
+    if unixSocket and os.path.exists(unixSocket):
+        os.remove(unixSocket)
+    server = multiprocessing.Process(target=target, args=args)
+    server.start()
+    return server
+
+
+def echo_round_trips(unixSocket=None, repetitions=5000, sizes=MESSAGE_SIZES):
+    """Round trip seconds of every message, by size, to an echo server on a free TCP port or unixSocket, and the
+    seconds connecting took after the server started listening"""
+    port = tools.getOpenPort()
+    server = _start_server(_echo, (port, unixSocket), unixSocket)
+    start = default_timer()
+    connection = traci.connectSocket(port, unixSocket=unixSocket, timeout=30)
+    connect_time = default_timer() - start - LISTEN_DELAY
+    round_trips = {}
+    for size in sizes:
+        message = struct.pack("!i", size + 4) + b"x" * size
+        times = np.zeros(repetitions)
+        for repetition in range(repetitions):
+            start = default_timer()
+            connection.sendall(message)
+            traciemb_standin.receive_exact(connection, len(message))
+            times[repetition] = default_timer() - start
+        round_trips[size] = times
+    connection.close()
+    server.join()
+    return round_trips, connect_time
+
+
+def traci_round_trips(net_file, route_file, tls_id, unixSocket=None, repetitions=5000):
+    """Seconds per traci command against traciemb_standin.serve over TCP or unixSocket"""
+    port = tools.getOpenPort()
+    server = _start_server(_serve, (net_file, route_file, port, unixSocket), unixSocket)
+    traci.init(port, numRetries=8, unixSocket=unixSocket)
+
+    times = {}
+    for name, function, args in (("getMinExpectedNumber", traci.simulation.getMinExpectedNumber, ()),
+                                 ("getRedYellowGreenState", traci.trafficlights.getRedYellowGreenState, (tls_id,)),
+                                 ("simulationStep", traci.simulationStep, ())):
+        start = default_timer()
+        for _ in range(repetitions):
+            function(*args)
+        times[name] = (default_timer() - start) / repetitions
+    traci.close()
+    server.join()
+    return times
+
+
+if __name__ == "__main__":
+
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    unixSocket = os.path.join(tempfile.gettempdir(), "traci_benchmark_%d.sock" % os.getpid())
+
+    tcp, tcp_connect = echo_round_trips(None, repetitions)
+    uds, uds_connect = echo_round_trips(unixSocket, repetitions)
+    print("Echo round trips (us)")
+    print("%8s %9s %9s %9s %9s %9s" % ("bytes", "TCP p50", "TCP p99", "UDS p50", "UDS p99", "p50 gain"))
+    for size in MESSAGE_SIZES:
+        tcp_p50, tcp_p99 = 1e6 * np.percentile(tcp[size], [50, 99])
+        uds_p50, uds_p99 = 1e6 * np.percentile(uds[size], [50, 99])
+        print("%8d %9.1f %9.1f %9.1f %9.1f %8.0f%%" % (size, tcp_p50, tcp_p99, uds_p50, uds_p99,
+                                                       100 * (1 - uds_p50 / tcp_p50)))
+    print("Connected %.1f ms (TCP) and %.1f ms (UDS) after the server listened" % (1e3 * tcp_connect,
+                                                                                  1e3 * uds_connect))
+
+    tcp = traci_round_trips("netFiles/grid.net.xml", "netFiles/grid.rou.xml", "0/0", None, repetitions)
+    uds = traci_round_trips("netFiles/grid.net.xml", "netFiles/grid.rou.xml", "0/0", unixSocket, repetitions)
+    print("TraCI commands against traciemb_standin (us)")
+    print("%-24s %9s %9s" % ("command", "TCP", "UDS"))
+    for name in sorted(tcp):
+        print("%-24s %9.1f %9.1f" % (name, 1e6 * tcp[name], 1e6 * uds[name]))
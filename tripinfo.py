@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function, division
+import os
+import math
+import hashlib
+import zipfile
+from array import array
+from collections import defaultdict
+import xml.etree.cElementTree as ET
+import numpy as np
+
+TRIPINFO_ATTRIBUTES = ("waitSteps", "duration", "departDelay")
+# Attributes always interned as strings, even when their values look like numbers (e.g. vehicle ids "0", "1", ...)
+STRING_ATTRIBUTES = ("id", "vType", "departLane", "arrivalLane", "devices", "vaporized")
+
+
+class QuantileSketch:
+
+    def __init__(self, relative_accuracy=0.01):
+        """ Quantile sketch with log spaced buckets (as in DDSketch). Quantiles are within relative_accuracy of the
+        true value, memory grows with the log of the value range rather than the number of values, and two sketches
+        with the same accuracy can be merged """
+        self._relative_accuracy = relative_accuracy
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self._positive = defaultdict(int)
+        self._negative = defaultdict(int)
+        self._zero = 0
+        self._count = 0
+
+    def _key(self, value):
+        return int(math.ceil(math.log(value) / self._log_gamma))
+
+    def _value(self, key):
+        return 2 * self._gamma ** key / (self._gamma + 1)
+
+    def add(self, value):
+        if value > 0:
+            self._positive[self._key(value)] += 1
+        elif value < 0:
+            self._negative[self._key(-value)] += 1
+        else:
+            self._zero += 1
+        self._count += 1
+
+    def merge(self, other):
+        for key, count in other._positive.items():
+            self._positive[key] += count
+        for key, count in other._negative.items():
+            self._negative[key] += count
+        self._zero += other._zero
+        self._count += other._count
+
+    def get_count(self):
+        return self._count
+
+    def quantile(self, q):
+        if not self._count:
+            return float("nan")
+        rank = q * (self._count - 1)
+
+        seen = 0
+        for key in sorted(self._negative, reverse=True):
+            seen += self._negative[key]
+            if seen > rank:
+                return -self._value(key)
+        seen += self._zero
+        if seen > rank:
+            return 0.
+        for key in sorted(self._positive):
+            seen += self._positive[key]
+            if seen > rank:
+                return self._value(key)
+        return self._value(max(self._positive))
+
+
+class RunningStatistics:
+
+    def __init__(self, bin_width=1.0, relative_accuracy=0.01):
+        """ Count, mean, variance, min and max (Welford's method), a histogram with fixed width bins and a quantile
+        sketch of a stream of values, in constant memory. Statistics of separate streams can be merged """
+        self._bin_width = bin_width
+        self._count = 0
+        self._mean = 0.
+        self._m2 = 0.
+        self._min = float("inf")
+        self._max = float("-inf")
+        self._histogram = defaultdict(int)
+        self._sketch = QuantileSketch(relative_accuracy)
+
+    def add(self, value):
+        self._count += 1
+        delta = value - self._mean
+        self._mean += delta / self._count
+        self._m2 += delta * (value - self._mean)
+        if value < self._min: self._min = value
+        if value > self._max: self._max = value
+        self._histogram[int(math.floor(value / self._bin_width))] += 1
+        self._sketch.add(value)
+
+    def merge(self, other):
+        if not other._count:
+            return
+        count = self._count + other._count
+        delta = other._mean - self._mean
+        self._m2 += other._m2 + delta * delta * self._count * other._count / count
+        self._mean += delta * other._count / count
+        self._count = count
+        self._min = min(self._min, other._min)
+        self._max = max(self._max, other._max)
+        for key, bin_count in other._histogram.items():
+            self._histogram[key] += bin_count
+        self._sketch.merge(other._sketch)
+
+    def get_count(self):
+        return self._count
+
+    def get_mean(self):
+        return self._mean if self._count else float("nan")
+
+    def get_variance(self):
+        return self._m2 / self._count if self._count else float("nan")
+
+    def get_min(self):
+        return self._min
+
+    def get_max(self):
+        return self._max
+
+    def get_quantile(self, q):
+        return self._sketch.quantile(q)
+
+    def get_histogram(self):
+        """Returns the lower edges of the non-empty bins and their counts"""
+        keys = sorted(self._histogram)
+        return [key * self._bin_width for key in keys], [self._histogram[key] for key in keys]
+
+
+def read_tripinfo_statistics(filepath, attributes=TRIPINFO_ATTRIBUTES, bin_widths=None):
+    """Reads a tripinfo output in one streaming pass, clearing every element once read, and returns a dict of
+    RunningStatistics by attribute. Memory use does not depend on the number of trips"""
+    bin_widths = bin_widths or {}
+    statistics = dict((attribute, RunningStatistics(bin_widths.get(attribute, 1.0))) for attribute in attributes)
+
+    context = ET.iterparse(filepath, events=("start", "end"))
+    _, root = next(context)
+
+    for event, element in context:
+        if event == "end" and element.tag == "tripinfo":
+            for attribute in attributes:
+                value = element.get(attribute)
+                if value is not None:
+                    statistics[attribute].add(float(value))
+            # Drop the trip, and the reference the root keeps to it
+            element.clear()
+            root.clear()
+
+    return statistics
+
+
+def source_signature(filepath, validate="mtime"):
+    """Identifies the version of a file, by modification time and size or by the SHA1 of its content"""
+    if validate == "hash":
+        sha1 = hashlib.sha1()
+        with open(filepath, "rb") as source:
+            for block in iter(lambda: source.read(1 << 20), b""):
+                sha1.update(block)
+        return "sha1:" + sha1.hexdigest()
+    status = os.stat(filepath)
+    return "mtime:%r:%d" % (status.st_mtime, status.st_size)
+
+
+def convert_tripinfo_to_columns(filepath):
+    """Reads every attribute of every trip in one streaming pass into typed columns. Numeric attributes become float
+    or int arrays (NaN where a trip lacks the attribute), other attributes such as ids and lanes are interned: an int
+    code per trip (-1 if missing) plus an array of the distinct values under '<attribute>__values'"""
+    numeric = {}
+    codes = {}
+    vocabularies = {}
+    rows = 0
+
+    context = ET.iterparse(filepath, events=("start", "end"))
+    _, root = next(context)
+
+    for event, element in context:
+        if event != "end" or element.tag != "tripinfo":
+            continue
+        for attribute, value in element.attrib.items():
+            if attribute not in codes:
+                # A new attribute is missing from all the earlier trips
+                codes[attribute] = array("i", [-1] * rows)
+                vocabularies[attribute] = {}
+                if attribute not in STRING_ATTRIBUTES:
+                    try:
+                        float(value)
+                        numeric[attribute] = array("d", [float("nan")] * rows)
+                    except ValueError:
+                        pass
+            if attribute in numeric:
+                try:
+                    numeric[attribute].append(float(value))
+                except ValueError:
+                    # Not numeric after all: the column keeps the text interned below
+                    del numeric[attribute]
+            # Numeric columns also intern their text until the end of the file settles their type, so that a column
+            # that turns out to hold strings keeps the original text of its earlier values (e.g. "1", not "1.0")
+            codes[attribute].append(vocabularies[attribute].setdefault(value, len(vocabularies[attribute])))
+        rows += 1
+        for column in numeric.values():
+            if len(column) < rows: column.append(float("nan"))
+        for column in codes.values():
+            if len(column) < rows: column.append(-1)
+        element.clear()
+        root.clear()
+
+    columns = {}
+    for attribute, column in numeric.items():
+        values = np.frombuffer(column, dtype=np.float64) if rows else np.zeros(0)
+        if not np.any(np.isnan(values)) and np.all(values == np.floor(values)):
+            values = values.astype(np.int64)
+        columns[attribute] = values.copy()
+    for attribute, column in codes.items():
+        if attribute in numeric:
+            continue
+        columns[attribute] = np.frombuffer(column, dtype=np.int32).copy() if rows else np.zeros(0, dtype=np.int32)
+        vocabulary = vocabularies[attribute]
+        columns[attribute + "__values"] = np.array(sorted(vocabulary, key=vocabulary.get))
+    return columns
+
+
+_loaded_columns = {}  # Tripinfo output -> (signature, column names, arrays read so far)
+
+
+def _read_cache_names(cache_filepath, signature):
+    """The column names of a cache written for the given signature, or None if it is missing, stale or unreadable"""
+    try:
+        with np.load(cache_filepath) as cache:
+            if "__source__" in cache.files and str(cache["__source__"]) == signature:
+                return [name for name in cache.files if name != "__source__"]
+    except (IOError, ValueError, zipfile.BadZipfile):
+        pass
+    return None
+
+
+def load_tripinfo_columns(filepath, attributes=None, validate="mtime", memoise=True):
+    """Returns a dict of the requested columns (all if None) of a tripinfo output. The columns are converted once
+    and cached as <filepath>.npz next to it; the cache is rebuilt when the output changes, as judged by its
+    modification time and size or, with validate='hash', its content, or when it cannot be read. The arrays are
+    copied out of the cache, which is closed again, so that analysing many outputs keeps no files open. They are
+    also kept in memory for the next call unless memoise is False, e.g. when every output is read once"""
+    signature = source_signature(filepath, validate)
+    cache_filepath = filepath + ".npz"
+
+    cached = _loaded_columns.get(filepath)
+    if cached is None or cached[0] != signature:
+        names = _read_cache_names(cache_filepath, signature)
+        loaded = {}
+        if names is None:
+            loaded = convert_tripinfo_to_columns(filepath)
+            names = list(loaded)
+            temporary_filepath = "%s.%d.tmp.npz" % (cache_filepath, os.getpid())
+            np.savez(temporary_filepath, __source__=np.array(signature), **loaded)
+            os.rename(temporary_filepath, cache_filepath)
+        cached = (signature, names, loaded)
+        if memoise:
+            _loaded_columns[filepath] = cached
+
+    _, names, loaded = cached
+    attributes = attributes or names
+    missing = [attribute for attribute in attributes if attribute not in loaded]
+    if missing:
+        with np.load(cache_filepath) as cache:
+            for attribute in missing:
+                loaded[attribute] = cache[attribute]
+    return dict((attribute, loaded[attribute]) for attribute in attributes)